@@ -1,12 +1,25 @@
-import sqlite3
-import re
-import hashlib
-import random
+import os
 import time
 import datetime
 
 from getpass import getpass
 
+from hivebank import (
+    BankService,
+    BankError,
+    ValidationError,
+    AuthenticationError,
+    InvalidPinError,
+    InsufficientFundsError,
+    DuplicateUserError,
+    ThrottledError,
+    ConnectionManager,
+    LoginThrottle,
+    TransactionLimits,
+    Metrics,
+)
+from hivebank.service import is_credit, narration
+
 class BankSystem:
     # Ansi color codes
     RED = "\033[91m"
@@ -14,348 +27,191 @@ class BankSystem:
     YELLOW = "\033[93m"
     RESET = "\033[0m"
 
-    # This initializes the name of the database file and make sure the necessary tables exist
-    def __init__(self, USERS_DB = "users.db"):
+    # This initializes the name of the database file and the headless service that does the actual banking.
+    # The CLI only prompts, prints and hands the answers to self.service.
+    # Pass a hivebank Metrics object to time the service calls (the _wait pauses are not included),
+    # and an AccountCache to keep the dashboard's account lookups in memory.
+    # Failed logins and PINs are throttled by the service and the lockouts are kept in the database,
+    # so a locked account stays locked after a restart and nobody else is kept waiting.
+    # Withdrawals and transfers are held to the default hivebank.limits limits.
+    def __init__(self, USERS_DB = "users.db", metrics=None, cache=None):
         self.USERS_DB = USERS_DB
-        self._create_tables()
+        db = ConnectionManager(USERS_DB, metrics=metrics)
+        self.service = BankService(USERS_DB, db=db, metrics=metrics, cache=cache, throttle=LoginThrottle(db=db), limits=TransactionLimits())
 
-    # This connects the code to the database
-    def _connect(self):
-        return sqlite3.connect(self.USERS_DB)
-    
     # This creates slight delay for different actions to make the app feel more real
     def _wait(self, message="Processing...", seconds=2):
         print(f"{self.YELLOW}{message}{self.RESET}")
         time.sleep(seconds)
 
-    
-    # Database table creation
-    def _create_tables(self):
-        with self._connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            full_name TEXT NOT NULL CHECK (full_name <> ''),
-            username TEXT NOT NULL UNIQUE CHECK (username <> ''),
-            email TEXT NOT NULL UNIQUE CHECK (email <> ''),
-            password TEXT NOT NULL CHECK (password <> ''),
-            pin TEXT NOT NULL,
-            initial_deposit INTEGER NOT NULL CHECK (initial_deposit >= 2000),
-            account_number TEXT NOT NULL UNIQUE,
-            balance REAL NOT NULL DEFAULT 0
-        );
-        """)
-
-
-            # Transactions table to track all financial activities
-            # Links each transaction to a specific user using the foreign key
-            cursor.execute("""
-        CREATE TABLE IF NOT EXISTS transactions (
-            transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            full_name TEXT NOT NULL,
-            recipient_name TEXT,
-            transaction_type TEXT NOT NULL,
-            amount REAL NOT NULL CHECK (amount > 0),
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-            );
-        """)
-            
-            cursor.execute("UPDATE users SET balance = initial_deposit WHERE balance = 0")
-            conn.commit()
-
 
-    def _pin(self, pin):
-        return hashlib.sha256(pin.encode()).hexdigest() 
+    # Keeps asking until validate(answer) stops raising ValidationError
+    def _prompt(self, question, validate, reader=input):
+        while True:
+            try:
+                return validate(reader(question))
+            except ValidationError as exc:
+                print(f"{self.RED}{exc}{self.RESET}")
 
 
-    def _account_number_generator(self):
+    def _prompt_amount(self, question):
         while True:
-            account_number = str(random.randint(10_000_000, 99_999_999))
-            with self._connect() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT 1 FROM users WHERE account_number = ?", (account_number,))
-                
-                if cursor.fetchone() is None:
-                    return account_number
-                
+            try:
+                amount = float(input(question))
+            except ValueError:
+                print(f"{self.RED}Please, enter a valid number.{self.RESET}")
+                continue
 
-    def _verify_pin(self, user_id):
-        max_attempts = 3
-        with self._connect() as conn:
-            cursor = conn.cursor()
+            try:
+                return self.service.validate_amount(amount)
+            except ValidationError as exc:
+                print(f"{self.RED}{exc}{self.RESET}")
 
-            # This sql query asks the database to find the pin whose user_id matches the given one. Fetchone() gets the first row from the query result
-            cursor.execute("SELECT pin FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            conn.commit()
 
-        if not result:
-            print(f"{self.RED}User not found.{self.RESET}")
-            return False
-       
-        # Takes the first and only stored item from the database
-        stored_hashed_pin = result[0]
+    def _verify_pin(self, user_id):
+        max_attempts = 3
 
         while max_attempts > 0:
             entered_pin = getpass("\nEnter your 4-digit transaction PIN: ").strip()
-            entered_hashed_pin = hashlib.sha256(entered_pin.encode()).hexdigest()
 
-            if entered_hashed_pin == stored_hashed_pin:
-                self._wait(f"{self.RESET}PIN verified...👍{self.RESET}", 1)
-                return True
-            
-            else:
+            try:
+                self.service.verify_pin(user_id, entered_pin)
+            except InvalidPinError:
                 max_attempts -= 1
                 print(f"{self.RED}Incorrect PIN. {max_attempts} attempt(s) remaining.{self.RESET}")
-                self._wait("Please try again...", 1)
+            except BankError as exc:
+                print(f"{self.RED}{exc}{self.RESET}")
+                return False
+            else:
+                self._wait(f"{self.RESET}PIN verified...👍{self.RESET}", 1)
+                return True
 
         self._wait(f"{self.RED}Too many failed PIN attempts. Transaction canceled.{self.RESET}", 1)
         return False
 
-    
+
     def _confirmation(self, action, transaction_amount):
         confirm = input(f"Are you sure you want to {action} ₦{transaction_amount:.2f}? (yes/no): ").strip().lower()
 
         if confirm != "yes":
             print(f"{self.RED}Transaction canceled.{self.RESET}")
             return False
-        
+
         return True
 
-                
+
     def sign_up(self):
-        name_pattern = r"^[A-Za-z]+(?:[-'][A-Za-z]+)*$"
+        service = self.service
         while True:
-            while True:
-                first_name = input("\nEnter your first name: ").strip().capitalize()
-
-                if not first_name:
-                    print(f"{self.RED}This field cannot be blank.{self.RESET}")
-                    continue
-
-                if not re.fullmatch(name_pattern, first_name):
-                    print(f"{self.RED}First name must contain only letters (you may include '-' or apostrophe).{self.RESET}")
-                    continue
-
-                break
-
-            while True:
-                last_name = input("\nEnter your last name: ").strip().capitalize()
-
-                if not last_name:
-                    print(f"{self.RED}This field cannot be blank.{self.RESET}")
-                    continue
-
-                if not re.fullmatch(name_pattern, last_name):
-                    print(f"{self.RED}Last name must contain only letters (you may include '-' or apostrophe.{self.RESET}")
-                    continue
-                break
-
-            while True:
-                middle_name = input("\nEnter your middle name: ").strip().capitalize()
-
-                if not middle_name:
-                    print(f"{self.RED}This field cannot be blank.{self.RESET}")
-                    continue
-
-                if not re.fullmatch(name_pattern, middle_name):
-                    print(f"{self.RED}Middle name must contain only letters (you may include '-' or apostrophe).{self.RESET}")
-                    continue
-
-                break
-
-            combined_names = first_name + last_name + middle_name
+            first_name = self._prompt("\nEnter your first name: ", lambda name: service.validate_name(name, "First name"))
+            last_name = self._prompt("\nEnter your last name: ", lambda name: service.validate_name(name, "Last name"))
+            middle_name = self._prompt("\nEnter your middle name: ", lambda name: service.validate_name(name, "Middle name"))
 
-            if len(combined_names) < 4 or len(combined_names) > 255:
-                print(f"{self.RED}Full name must be between 4 and 255 characters long.{self.RESET}")
+            try:
+                service.validate_full_name(first_name, middle_name, last_name)
+            except ValidationError as exc:
+                print(f"{self.RED}{exc}{self.RESET}")
                 print(f"{self.YELLOW}Please enter your names again.{self.RESET}")
                 continue
-
-            full_name = f"{first_name} {middle_name} {last_name}"
-            break
-
-        while True:
-            username_pattern = r"^(?=.{3,20}$)[A-Za-z][A-Za-z0-9]*$"
-            username = input("\nEnter your username: ").strip()
-
-            if not username:
-                print(f"{self.RED}This field cannot be blank.{self.RESET}")
-                continue
-
-            if not re.fullmatch(username_pattern, username):
-                print(f"{self.RED}Invalid username. Must start with a letter and be 3-20 letters/numbers only.{self.RESET}")
-                continue
-
             break
 
+        username = self._prompt("\nEnter your username: ", service.validate_username)
+        email = self._prompt("\nEnter your email: ", service.validate_email)
 
         while True:
-            email_pattern = r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}"
-            email = input("\nEnter your email: ").strip()
-
-            if not email:
-                print(f"{self.RED}This field cannot be blank.{self.RESET}")
-                continue
-
-            if not re.fullmatch(email_pattern, email):
-                print(f"{self.RED}Invalid email{self.RESET}")
-                continue
-
-            break
-
-
-        while True:
-            password_pattern = r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,32}$"
-            password1 = getpass("\nEnter a password: ").strip()
-
-            if not password1:
-                print(f"{self.RED}This field cannot be blank.{self.RESET}")
-                continue
-
-            if not re.fullmatch(password_pattern, password1):
-                print(f"{self.RED}Invalid password. Must include upper, lower, number, symbol, and be 8-32 chars long.{self.RESET}")
-                continue
-
+            password1 = self._prompt("\nEnter a password: ", service.validate_password, getpass)
             password2 = getpass("\nConfirm your password: ").strip()
 
             if not password2:
                 print("Confirm password field cannot be blank.")
                 continue
 
-            if not re.fullmatch(password_pattern, password2):
-                print(f"{self.RED}Invalid password. Must include upper, lower, number, symbol, and be 8-32 chars long.{self.RESET}")
-                continue
-
             if password1 != password2:
                 print(f"{self.RED}Password do not match!{self.RESET}")
                 continue
 
             break
 
-        hashed_password = hashlib.sha256(password1.encode()).hexdigest()
-
-
         while True:
-            pin = getpass("\nCreate a 4-digit transaction PIN: ")
-
-            if len(pin) == 4 and pin.isdigit():
-                confirm_pin = getpass("\nConfirm your PIN: ")
-
-                if pin == confirm_pin:
-                    hashed_pin = self._pin(pin)
-                    break
-                
-                else:
-                    print(f"{self.RED}PiNs do not match. Please try again.{self.RESET}")
+            pin = self._prompt("\nCreate a 4-digit transaction PIN: ", service.validate_pin, getpass)
+            confirm_pin = getpass("\nConfirm your PIN: ")
 
-            else:
-                print(f"{self.RED}Invalid PIN. Please enter a 4-digit number.{self.RESET}")
+            if pin == confirm_pin:
+                break
 
+            print(f"{self.RED}PiNs do not match. Please try again.{self.RESET}")
 
         while True:
             try:
                 initial_deposit = int(input("\nEnter initial deposit (minimum of ₦2000 required): ₦"))
+                service.validate_initial_deposit(initial_deposit)
             except ValueError:
                 print(f"{self.RED}Initial deposit must be integers.{self.RESET}")
+            except ValidationError as exc:
+                print(f"{self.RED}{exc}{self.RESET}")
             else:
-                if initial_deposit < 2000:
-                    print(f"{self.RED}Initial deposit must be a minimum of ₦2000.{self.RESET}")
-                    continue
                 break
 
-
-        with self._connect() as conn:
-            account_number = self._account_number_generator()
-            cursor = conn.cursor()
-            balance = initial_deposit
-            try:
-                cursor.execute("INSERT INTO users (full_name, username, email, password, pin, initial_deposit, account_number, balance) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (full_name, username, email, hashed_password, hashed_pin, initial_deposit, account_number, balance))
-            except sqlite3.IntegrityError as exc:
-                exc = str(exc)
-                if exc == "UNIQUE constraint failed: users.email":
-                    print(f"{self.RED}Email already exists.{self.RESET}")
-                elif exc == "UNIQUE constraint failed: users.username":
-                    print(f"{self.RED}Username already exists.{self.RESET}")
-                else:
-                    print(exc)
-            else:
-                conn.commit()
-                self._wait("Creating account...", 2)
-                print(f"Account created successfully! Your account number is {account_number}.")
-                self._wait("Redirecting to login...", 1)
-                self.log_in()
+        try:
+            account = service.sign_up(first_name, middle_name, last_name, username, email, password1, pin, initial_deposit)
+        except DuplicateUserError as exc:
+            print(f"{self.RED}{exc}{self.RESET}")
+        else:
+            self._wait("Creating account...", 2)
+            print(f"Account created successfully! Your account number is {account['account_number']}.")
+            self._wait("Redirecting to login...", 1)
+            self.log_in()
 
 
+    # A locked account (too many failed attempts) goes back to the main menu straight away
     def log_in(self):
-        max_attempts = 3
-        with self._connect() as conn:
-            cursor = conn.cursor()
-            while True:
-                while max_attempts > 0:
-                    username_pattern = r"^(?=.{3,20}$)[A-Za-z][A-Za-z0-9]*$"
-                    email_pattern = r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}"
-
-                    username_or_email = input("\nEnter your username or email: ").strip()
-
-                    if not username_or_email:
-                        print(f"{self.RED}This field cannot be blank.\n{self.RESET}")
-                        continue
+        while True:
+            username_or_email = input("\nEnter your username or email: ").strip()
 
-                    if not (re.fullmatch(username_pattern, username_or_email)) and not (re.fullmatch(email_pattern, username_or_email)):
-                        print(f"{self.RED}Invalid username or email\n{self.RESET}")
-                        continue
+            if not username_or_email:
+                print(f"{self.RED}This field cannot be blank.\n{self.RESET}")
+                continue
 
-                    password1 = getpass("\nEnter your password: ").strip()
+            if not self.service.is_valid_login_id(username_or_email):
+                print(f"{self.RED}Invalid username or email\n{self.RESET}")
+                continue
 
-                    if not password1:
-                        print(f"{self.RED}This field cannot be blank.\n{self.RESET}")
-                        continue
-                    
-                    hashed_password = hashlib.sha256(password1.encode()).hexdigest()
+            password1 = getpass("\nEnter your password: ").strip()
 
-                    cursor.execute("SELECT * FROM users WHERE (username=? OR email=?) AND password=?", (username_or_email, username_or_email, hashed_password))
+            if not password1:
+                print(f"{self.RED}This field cannot be blank.\n{self.RESET}")
+                continue
 
-                    # Returns the first matching row as a tuple if match is found
-                    user = cursor.fetchone()
+            try:
+                user_id = self.service.log_in(username_or_email, password1)
+            except ThrottledError as exc:
+                print(f"{self.RED}{exc}{self.RESET}")
+                return False
+            except AuthenticationError:
+                print(f"{self.RED}Invalid credentials{self.RESET}")
+                continue
 
-                    if user:
-                        self._wait("\nLogging in...", 2)
-                        print("Log in successful")
+            self._wait("\nLogging in...", 2)
+            print("Log in successful")
 
-                        # Passing the user_id from the row to open the dashboard for the user
-                        self.dashboard(user[0]) 
-                        return True
-                    
-                    else: 
-                        max_attempts -= 1
-                        print(f"{self.RED}Invalid credentials{self.RESET}")
-                
-                self._wait(f"{self.RED}Too many failed attempts. Please wait one minute before trying again{self.RESET}", 60)
-                max_attempts = 3
+            # Passing the user_id to open the dashboard for the user
+            self.dashboard(user_id)
+            return True
 
 
     def dashboard(self, user_id):
-        with self._connect() as conn:
-            cursor = conn.cursor()
-
-            while True:
-                cursor.execute("SELECT full_name, account_number, balance FROM users WHERE user_id = ?", (user_id,))
-                user = cursor.fetchone()
-
-                if not user:
-                    print(f"{self.RED}Error: User not found.{self.RESET}")
-                    return
-                
-                full_name, account_number, balance = user
+        while True:
+            try:
+                user = self.service.account_details(user_id)
+            except BankError:
+                print(f"{self.RED}Error: User not found.{self.RESET}")
+                return
 
-                menu = f"""
+            menu = f"""
 ------------------HOME🏡------------------------
-\nWelcome back, {full_name}!
-Account_number: {account_number}
-Balance: ₦{balance:,.2f}
+\nWelcome back, {user['full_name']}!
+Account_number: {user['account_number']}
+Balance: ₦{user['balance']:,.2f}
 \nChoose an action:
 1. Deposit
 2. Withdrawal
@@ -364,240 +220,177 @@ Balance: ₦{balance:,.2f}
 5. Transaction History
 6. Logout
 """
-            
-                print(menu)
-                choice = input("Choose an option: ").strip()
-
-                if choice == "1":
-                    self._wait("Loading...", 1)
-                    self.deposit(user_id)
-
-                elif choice == "2":
-                    self._wait("Loading...", 1)
-                    self.withdrawal(user_id)
-                
-                elif choice == "3":
-                    self._wait("Loading...", 1)
-                    self.transfer(user_id)
-                
-                elif choice == "4":
-                    self.account_details(user_id)
-                
-                elif choice == "5":
-                    self.transaction_history(user_id)
-
-                elif choice == "6":
-                    self._wait("Logging out...", 1)
-                    break
-
-                conn.commit()
 
+            print(menu)
+            choice = input("Choose an option: ").strip()
 
-    def deposit(self, user_id):
-        with self._connect() as conn:
-            cursor = conn.cursor()
-
-            while True:
-                try:
-                    deposit_amt = float(input("\nEnter deposit amount: ₦"))
-                except ValueError:
-                    print(f"{self.RED}Please, enter a valid number.{self.RESET}")
-                    continue
-
-                if deposit_amt <= 0:
-                    print(f"{self.RED}The amount must be greater than 0{self.RESET}")
-                    continue
-
-                if not self._confirmation("deposit", deposit_amt):
-                    return
-                
-                self._wait("Depositing...", 2)
-                break
+            if choice == "1":
+                self._wait("Loading...", 1)
+                self.deposit(user_id)
 
-            cursor.execute("SELECT full_name FROM users WHERE user_id = ?", (user_id,))
-            full_name = cursor.fetchone()[0]
+            elif choice == "2":
+                self._wait("Loading...", 1)
+                self.withdrawal(user_id)
 
-            # Adds to their balance since a deposit has been made and logs the user's transaction
-            cursor.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (deposit_amt, user_id))
-            cursor.execute("INSERT INTO transactions (user_id, full_name, transaction_type, amount, timestamp) VALUES (?, ?, ?, ?, ?)", (user_id, full_name, "CR-Deposit", deposit_amt, datetime.datetime.now().isoformat()))
+            elif choice == "3":
+                self._wait("Loading...", 1)
+                self.transfer(user_id)
 
-            conn.commit()
-            print(f"₦{deposit_amt:,.2f} deposited successfully!")
+            elif choice == "4":
+                self.account_details(user_id)
 
+            elif choice == "5":
+                self.transaction_history(user_id)
 
-    def withdrawal(self, user_id):
-        with self._connect() as conn:
-            cursor = conn.cursor()
-
-            while True:
-                try:
-                    withdrawal_amt = float(input("\nEnter the amount you want to withdraw: ₦"))
-                except ValueError:
-                    print(f"{self.RED}Please, enter a valid number.{self.RESET}")
-                    continue
-                
-
-                if withdrawal_amt <= 0:
-                    print(f"{self.RED}The amount must be greater than 0.{self.RESET}")
-                    continue
-
-                if not self._verify_pin(user_id):
-                    return
-                
-                if not self._confirmation("withdraw", withdrawal_amt):
-                    return
-
-                cursor.execute("SELECT full_name, balance FROM users WHERE user_id = ?", (user_id,))
-                full_name, balance = cursor.fetchone()
-
-                if withdrawal_amt > balance:
-                    print(f"{self.RED}Insufficient funds.{self.RESET}\nYour current balance is ₦{balance:.2f}")
-                    continue
-
-                self._wait("Processing withdrawal...", 2)
+            elif choice == "6":
+                self._wait("Logging out...", 1)
                 break
 
-            updated_balance = balance - withdrawal_amt
-            # Subtracts from their balance since a withdrawal has been made and logs the user's transaction
-            cursor.execute("UPDATE users SET balance = ? WHERE user_id = ?", (updated_balance, user_id))
-            cursor.execute("INSERT INTO transactions (user_id, full_name, transaction_type, amount, timestamp) VALUES (?, ?, ?, ?, ?)", (user_id, full_name, "DR-Withdrawal", withdrawal_amt, datetime.datetime.now().isoformat()))
 
-            conn.commit()
-            print(f"₦{withdrawal_amt:,.2f} withdrawn successfully!")
+    def deposit(self, user_id):
+        deposit_amt = self._prompt_amount("\nEnter deposit amount: ₦")
 
+        if not self._confirmation("deposit", deposit_amt):
+            return
 
-    def transfer(self, user_id):
-        with self._connect() as conn:
-            cursor = conn.cursor()
+        self._wait("Depositing...", 2)
+
+        try:
+            self.service.deposit(user_id, deposit_amt)
+        except BankError as exc:
+            print(f"{self.RED}{exc}{self.RESET}")
+            return
+
+        print(f"₦{deposit_amt:,.2f} deposited successfully!")
 
-            cursor.execute("SELECT full_name, account_number, balance FROM users WHERE user_id = ?", (user_id,))
-            sender = cursor.fetchone()
-            if not sender:
-                print(f"{self.RED}Error: user not found.{self.RESET}")
+
+    def withdrawal(self, user_id):
+        while True:
+            withdrawal_amt = self._prompt_amount("\nEnter the amount you want to withdraw: ₦")
+
+            if not self._verify_pin(user_id):
+                return
+
+            if not self._confirmation("withdraw", withdrawal_amt):
                 return
-            
-            sender_name, sender_account, sender_balance = sender
-
-            while True:
-                recipient_account = input("\nEnter the recipient's account number: ").strip()
-                if not recipient_account:
-                    print(f"{self.RED}This field cannot be blank.{self.RESET}")
-                    continue
-                if recipient_account == sender_account:
-                    print(f"{self.RED}You cannot transfer money to yourself.{self.RESET}")
-                    continue
-
-                cursor.execute("SELECT user_id, full_name FROM users WHERE account_number = ?", (recipient_account,))
-                recipient = cursor.fetchone()
-                if not recipient:
-                    print(f"{self.RED}Recipient cannot be found.{self.RESET}")
-                    continue
-
-                recipient_id, recipient_name = recipient
-
-                self._wait("Processing...", 1)
-                print(recipient_name)
-                break
 
-            while True:
-                try:
-                    transfer_amt = float(input("\nEnter amount to transfer: ₦"))
-                except ValueError:
-                    print(f"{self.RED}Please, enter a valid number.{self.RESET}")
-                    continue
+            try:
+                self.service.withdrawal(user_id, withdrawal_amt)
+            except InsufficientFundsError as exc:
+                print(f"{self.RED}Insufficient funds.{self.RESET}\nYour current balance is ₦{exc.balance:.2f}")
+                continue
+            except BankError as exc:
+                print(f"{self.RED}{exc}{self.RESET}")
+                return
 
-                if transfer_amt <= 0:
-                    print(f"{self.RED}Amount must be greater than 0.{self.RESET}")
-                    continue
+            self._wait("Processing withdrawal...", 2)
+            break
 
-                if transfer_amt > sender_balance:
-                    print(f"{self.RED}Insufficient funds.{self.RESET}")
-                    continue
+        print(f"₦{withdrawal_amt:,.2f} withdrawn successfully!")
 
-                if not self._verify_pin(user_id):
-                    return
-                
-                if not self._confirmation("transfer", transfer_amt):
-                    return
 
-                self._wait("\nProcessing transfer...", 2)
-                break
+    def transfer(self, user_id):
+        try:
+            sender_balance = self.service.account_details(user_id)["balance"]
+        except BankError:
+            print(f"{self.RED}Error: user not found.{self.RESET}")
+            return
 
-            cursor.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (transfer_amt, user_id))
-            cursor.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (transfer_amt, recipient_id))
+        while True:
+            recipient_account = input("\nEnter the recipient's account number: ").strip()
 
-            # This logs the sender (---> money leaving) and recipient (---> money entering) transactions
-            cursor.execute("INSERT INTO transactions (user_id, full_name, recipient_name, transaction_type, amount, timestamp) VALUES (?, ?, ?, ?, ?, ?)", (user_id, sender_name, recipient_name, "DR-Transfer To", transfer_amt, datetime.datetime.now().isoformat()))
-            cursor.execute("INSERT INTO transactions (user_id, recipient_name, full_name, transaction_type, amount, timestamp) VALUES (?, ?, ?, ?, ?, ?)", (recipient_id, recipient_name, sender_name, "CR-Transfer From", transfer_amt, datetime.datetime.now().isoformat()))
+            try:
+                recipient = self.service.find_recipient(user_id, recipient_account)
+            except BankError as exc:
+                print(f"{self.RED}{exc}{self.RESET}")
+                continue
 
-            conn.commit()
-            print(f"₦{transfer_amt:,.2f} Transfer successfull!👍")
+            self._wait("Processing...", 1)
+            print(recipient["full_name"])
+            break
 
+        while True:
+            transfer_amt = self._prompt_amount("\nEnter amount to transfer: ₦")
 
-    def account_details(self, user_id):
-        with self._connect() as conn:
-            cursor = conn.cursor()
+            if transfer_amt > sender_balance:
+                print(f"{self.RED}Insufficient funds.{self.RESET}")
+                continue
 
-            cursor.execute("SELECT full_name, username, account_number, email, balance FROM users WHERE user_id = ?", (user_id,))
-            user = cursor.fetchone()
+            if not self._verify_pin(user_id):
+                return
 
-            if not user:
-                print(f"{self.RED}Account not found.{self.RESET}")
+            if not self._confirmation("transfer", transfer_amt):
                 return
-            
-            full_name, username, account_number, email, balance = user
 
-            self._wait("Details loading...", 2)
-            print(f"""
+            self._wait("\nProcessing transfer...", 2)
+            break
+
+        try:
+            self.service.transfer(user_id, recipient["account_number"], transfer_amt)
+        except BankError as exc:
+            print(f"{self.RED}{exc}{self.RESET}")
+            return
+
+        print(f"₦{transfer_amt:,.2f} Transfer successfull!👍")
+
+
+    def account_details(self, user_id):
+        try:
+            user = self.service.account_details(user_id)
+        except BankError:
+            print(f"{self.RED}Account not found.{self.RESET}")
+            return
+
+        self._wait("Details loading...", 2)
+        print(f"""
 _________DETAILS_________
-Name: {full_name}
-Username: {username}
-Account Number: {account_number}
-Email: {email}
-Balance: ₦{balance:,.2f}
+Name: {user['full_name']}
+Username: {user['username']}
+Account Number: {user['account_number']}
+Email: {user['email']}
+Balance: ₦{user['balance']:,.2f}
 """)
-            
-    
+
+
     def transaction_history(self, user_id):
-        with self._connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT full_name, recipient_name, transaction_type, amount, timestamp FROM transactions WHERE user_id = ? ORDER BY timestamp DESC", (user_id,))
-            
-            transactions = cursor.fetchall()
+        page = self.service.transaction_page(user_id)
+
+        self._wait(f"Transaction History Loading...", 2)
+        print("\n--------------------TRANSACTION HISTORY--------------------")
+
+        if not page["transactions"]:
+            print(f"\n{self.RED}No transactions found.{self.RESET}")
+            return
+
+        while True:
+            self._print_transactions(page["transactions"])
 
-            self._wait(f"Transaction History Loading...", 2)
-            print("\n--------------------TRANSACTION HISTORY--------------------")
+            if page["next_cursor"] is None:
+                return
 
-            if not transactions:
-                print(f"\n{self.RED}No transactions found.{self.RESET}")
+            more = input("\nShow older transactions? (yes/no): ").strip().lower()
+            if more != "yes":
                 return
-            
-            for transaction in transactions:
-                sender, recipient, trans_type, amount, timestamp = transaction
-                date_time = datetime.datetime.fromisoformat(timestamp)
-                formatted_date = date_time.strftime("%a %d %b %Y")
-                formatted_time = date_time.strftime("%I:%M%p")
-
-                if "CR" in trans_type:
-                    color = self.GREEN
-                    if "Deposit" in trans_type:
-                        narration = f"Deposit by {sender}"
-                    else:
-                        narration = f"Transfer from {sender}"
-                elif "DR" in trans_type:
-                    color = self.RED
-                    if "Withdrawal" in trans_type:
-                        narration = f"Withdrawal by {sender}"
-                    else:
-                        narration = f"Transfer to {recipient}"
-                else:
-                    color = self.RESET
-
-                print(f"""
+
+            page = self.service.transaction_page(user_id, cursor=page["next_cursor"])
+
+
+    def _print_transactions(self, transactions):
+        for transaction in transactions:
+            sender = transaction["sender"]
+            recipient = transaction["recipient"]
+            trans_type = transaction["transaction_type"]
+            date_time = datetime.datetime.fromisoformat(transaction["timestamp"])
+            formatted_date = date_time.strftime("%a %d %b %Y")
+            formatted_time = date_time.strftime("%I:%M%p")
+
+            color = self.GREEN if is_credit(trans_type) else self.RED
+
+            print(f"""
 Date: {formatted_date}
 Time: {formatted_time}
-Amount: {color}₦{amount:,.2f}{self.RESET}
-Narration: {narration}
+Amount: {color}₦{transaction['amount']:,.2f}{self.RESET}
+Narration: {narration(trans_type, sender, recipient)}
 ----------------------------------------""")
 
 
@@ -634,5 +427,12 @@ is stored securely — just like honey in the hive.
 
 # This creates BankSystem instance and starts the application
 if __name__ == "__main__":
-    app = BankSystem()
-    app.run_interface()
\ No newline at end of file
+    # HIVEBANK_METRICS=metrics.json (or metrics.prom) records timings and writes them on exit
+    metrics_path = os.environ.get("HIVEBANK_METRICS")
+    metrics = Metrics() if metrics_path else None
+    app = BankSystem(metrics=metrics)
+    try:
+        app.run_interface()
+    finally:
+        if metrics is not None:
+            metrics.write(metrics_path)
\ No newline at end of file
@@ -0,0 +1,270 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hivebank import BankService, BankError, AccountCache
+from hivebank.service import DEPOSIT, WITHDRAWAL, TRANSFER_OUT, TRANSFER_IN, POSTING_INSERT, posting_row, to_epoch, to_minor
+
+# Throughput and latency percentiles of the core BankService operations as the database grows.
+#
+# For every data size ("users:transactions") a scratch database is synthesised with that many
+# accounts and ledger rows, spread over the last year. Each operation is then run by 1..N worker
+# threads and every call is timed, giving ops/s and p50/p95/p99 latency per (size, workers, operation).
+#
+#   python benchmarks/core_operations.py --sizes 1000:10000 10000:100000 --workers 1 4 --output run.json
+#   python benchmarks/core_operations.py --sizes 1000:10000 --baseline run.json
+#
+# --output writes the whole run as one JSON document (with the machine and SQLite version) so runs
+# can be kept and compared; --baseline compares this run against a saved one and exits with 1 when
+# an operation got slower than --tolerance allows.
+
+OPERATIONS = ("deposit", "withdrawal", "transfer", "details", "lookup", "history")
+
+SEED_CHUNK = 50_000
+
+
+def parse_size(text):
+    try:
+        users, transactions = (int(part) for part in text.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"size must look like USERS:TRANSACTIONS, got {text!r}") from None
+    if users < 2 or transactions < 0:
+        raise argparse.ArgumentTypeError("size needs at least 2 users and no negative transactions")
+    return users, transactions
+
+
+# Fills a scratch database with users accounts and about transactions ledger rows, oldest first,
+# keeping balance_after and the final balances consistent with the rows
+def seed(path, users, transactions, opening_balance, rng):
+    service = BankService(path)
+    names = [f"Bench User {i}" for i in range(users)]
+    balances = [float(opening_balance)] * users
+
+    with service.db.transaction("IMMEDIATE") as conn:
+        conn.executemany(
+            "INSERT INTO users (full_name, username, email, password, pin, initial_deposit, account_number, balance_minor) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(names[i], f"bench{i}", f"bench{i}@example.com", "x", "x", opening_balance, f"{10_000_000 + i}", opening_balance * 100) for i in range(users)],
+        )
+        first_id = conn.execute("SELECT MIN(user_id) FROM users").fetchone()[0]
+
+    start = datetime.datetime.now() - datetime.timedelta(days=365)
+    step = datetime.timedelta(days=365) / max(1, transactions)
+    rows = []
+    written = 0
+
+    def flush():
+        with service.db.transaction("IMMEDIATE") as conn:
+            conn.executemany(POSTING_INSERT, rows)
+        rows.clear()
+
+    while written < transactions:
+        posted_at = to_epoch(start + step * written)
+        user = rng.randrange(users)
+        amount = float(rng.randint(1, 500))
+        kind = rng.random()
+
+        if kind < 0.3 and written + 2 <= transactions:
+            recipient = rng.randrange(users - 1)
+            recipient += recipient >= user
+            if balances[user] >= amount:
+                balances[user] -= amount
+                balances[recipient] += amount
+                rows.append(posting_row(first_id + user, first_id + recipient, TRANSFER_OUT, amount, posted_at, balances[user]))
+                rows.append(posting_row(first_id + recipient, first_id + user, TRANSFER_IN, amount, posted_at, balances[recipient]))
+                written += 2
+                continue
+        if kind < 0.6 and balances[user] >= amount:
+            balances[user] -= amount
+            rows.append(posting_row(first_id + user, None, WITHDRAWAL, amount, posted_at, balances[user]))
+        else:
+            balances[user] += amount
+            rows.append(posting_row(first_id + user, None, DEPOSIT, amount, posted_at, balances[user]))
+        written += 1
+
+        if len(rows) >= SEED_CHUNK:
+            flush()
+    if rows:
+        flush()
+
+    with service.db.transaction("IMMEDIATE") as conn:
+        conn.executemany("UPDATE users SET balance_minor = ? WHERE user_id = ?", [(to_minor(balance), first_id + i) for i, balance in enumerate(balances)])
+        conn.execute("ANALYZE")
+    service.close()
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[max(1, math.ceil(len(ordered) * fraction)) - 1]
+
+
+def operation_call(service, name, user_ids, account_numbers, rng):
+    user_id = rng.choice(user_ids)
+    if name == "deposit":
+        return lambda: service.deposit(user_id, rng.randint(1, 100))
+    if name == "withdrawal":
+        return lambda: service.withdrawal(user_id, rng.randint(1, 100))
+    if name == "transfer":
+        recipient = rng.choice(account_numbers)
+        return lambda: service.transfer(user_id, recipient, rng.randint(1, 100))
+    if name == "details":
+        return lambda: service.account_details(user_id)
+    if name == "lookup":
+        recipient = rng.choice(account_numbers)
+        return lambda: service.find_recipient(user_id, recipient)
+    if name == "history":
+        return lambda: service.transaction_page(user_id)
+    raise ValueError(f"Unknown operation: {name}")
+
+
+# Runs calls of one operation spread over workers threads; returns the result row for it
+def measure(service, name, workers, calls, user_ids, account_numbers, seed_value):
+    def worker(count, worker_seed):
+        rng = random.Random(worker_seed)
+        latencies = []
+        errors = 0
+        for _ in range(count):
+            call = operation_call(service, name, user_ids, account_numbers, rng)
+            began = time.perf_counter()
+            try:
+                call()
+            except BankError:
+                # Refusals (e.g. a transfer to yourself) are still timed, they took the same SQL path
+                errors += 1
+            latencies.append(time.perf_counter() - began)
+        return latencies, errors
+
+    share = max(1, calls // workers)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = [future.result() for future in [pool.submit(worker, share, seed_value * 1_000 + index) for index in range(workers)]]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+    milliseconds = lambda value: round(value * 1_000, 3)
+    return {
+        "operation": name,
+        "workers": workers,
+        "calls": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "seconds": round(elapsed, 3),
+        "ops_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": milliseconds(percentile(latencies, 0.50)),
+        "p95_ms": milliseconds(percentile(latencies, 0.95)),
+        "p99_ms": milliseconds(percentile(latencies, 0.99)),
+        "max_ms": milliseconds(latencies[-1]),
+    }
+
+
+def run_size(users, transactions, worker_counts, operations, calls, opening_balance, seed_value, cache_size=0):
+    rng = random.Random(seed_value)
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "bench.db")
+        started = time.perf_counter()
+        seed(path, users, transactions, opening_balance, rng)
+        seeded = time.perf_counter() - started
+
+        service = BankService(path, cache=AccountCache(cache_size) if cache_size else None)
+        conn = service.db.connection()
+        user_ids = [row[0] for row in conn.execute("SELECT user_id FROM users")]
+        account_numbers = [row[0] for row in conn.execute("SELECT account_number FROM users")]
+
+        try:
+            for workers in worker_counts:
+                for name in operations:
+                    result = measure(service, name, workers, calls, user_ids, account_numbers, seed_value)
+                    result.update(users=users, transactions=transactions, seed_seconds=round(seeded, 3))
+                    yield result
+        finally:
+            service.close()
+
+
+def environment():
+    return {
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def result_key(result):
+    return (result["users"], result["transactions"], result["workers"], result["operation"])
+
+
+# Results that got slower than the baseline by more than tolerance (a fraction), on p95 or throughput
+def regressions(results, baseline, tolerance):
+    previous = {result_key(result): result for result in baseline["results"]}
+    found = []
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            found.append((result, "p95_ms", before["p95_ms"], result["p95_ms"]))
+        if result["ops_per_second"] < before["ops_per_second"] * (1 - tolerance):
+            found.append((result, "ops_per_second", before["ops_per_second"], result["ops_per_second"]))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput and latency of core banking operations by data size and worker count.")
+    parser.add_argument("--sizes", type=parse_size, nargs="+", default=[(1_000, 10_000), (10_000, 100_000)], help="USERS:TRANSACTIONS pairs (default: 1000:10000 10000:100000)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument("--calls", type=int, default=2_000, help="calls per operation and worker count (default: 2000)")
+    parser.add_argument("--opening-balance", type=int, default=1_000_000)
+    parser.add_argument("--cache-size", type=int, default=0, help="serve lookups through an AccountCache of this size (default: 0, off)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed, so runs synthesise the same data")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per result instead of a table")
+    parser.add_argument("--output", help="write the whole run, with environment details, to this JSON file")
+    parser.add_argument("--baseline", help="JSON file from an earlier --output run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    run = {"environment": environment(), "settings": {"calls": args.calls, "seed": args.seed, "opening_balance": args.opening_balance, "cache_size": args.cache_size}, "results": []}
+
+    if not args.json:
+        print(f"{'users':>8} {'rows':>10} {'workers':>8} {'operation':<11} {'ops/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+
+    for users, transactions in args.sizes:
+        for result in run_size(users, transactions, args.workers, args.operations, args.calls, args.opening_balance, args.seed, args.cache_size):
+            run["results"].append(result)
+            if args.json:
+                print(json.dumps(result), flush=True)
+            else:
+                print(
+                    f"{users:>8} {transactions:>10} {result['workers']:>8} {result['operation']:<11} {result['ops_per_second']:>10,.1f} "
+                    f"{result['p50_ms']:>8.3f} {result['p95_ms']:>8.3f} {result['p99_ms']:>8.3f} {result['errors']:>7}",
+                    flush=True,
+                )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(run, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            found = regressions(run["results"], json.load(baseline_file), args.tolerance)
+        for result, metric, before, after in found:
+            print(f"REGRESSION {result['operation']} users={result['users']} rows={result['transactions']} workers={result['workers']}: {metric} {before} -> {after}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hivebank import BankService, ConnectionManager
+from hivebank.group_commit import GroupCommitWriter
+from transfer_throughput import seed
+
+# Deposits per second and caller-side latency with one commit per posting versus a GroupCommitWriter,
+# for the same number of concurrent callers. Use --synchronous FULL to see the effect of sharing fsyncs.
+#
+#   python benchmarks/group_commit_throughput.py --callers 32 --deposits 20000 --synchronous FULL
+
+
+def run(mode, accounts, deposits, callers, synchronous, max_batch, max_delay):
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "bench.db")
+        seed(path, accounts, 10_000)
+
+        db = ConnectionManager(path, synchronous=synchronous)
+        service = BankService(path, db=db)
+        writer = GroupCommitWriter(service, max_batch, max_delay) if mode == "group" else None
+        post = writer.deposit if writer else service.deposit
+        user_ids = [row[0] for row in db.connection().execute("SELECT user_id FROM users")]
+
+        def caller(count, caller_seed):
+            rng = random.Random(caller_seed)
+            latencies = []
+            for _ in range(count):
+                began = time.perf_counter()
+                post(rng.choice(user_ids), rng.randint(1, 100))
+                latencies.append(time.perf_counter() - began)
+            return latencies
+
+        share = deposits // callers
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=callers) as pool:
+            latencies = sorted(latency for future in [pool.submit(caller, share, index) for index in range(callers)] for latency in future.result())
+        elapsed = time.perf_counter() - started
+
+        if writer:
+            writer.close()
+        service.close()
+
+        return {
+            "mode": mode,
+            "callers": callers,
+            "deposits": len(latencies),
+            "synchronous": synchronous,
+            "seconds": round(elapsed, 3),
+            "deposits_per_second": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1_000, 3),
+            "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1_000, 3),
+            "average_batch": round(writer.average_batch, 1) if writer else 1.0,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deposit throughput with and without group commit.")
+    parser.add_argument("--accounts", type=int, default=1_000)
+    parser.add_argument("--deposits", type=int, default=20_000)
+    parser.add_argument("--callers", type=int, default=32)
+    parser.add_argument("--synchronous", default="FULL")
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--max-delay", type=float, default=0.002, help="seconds the writer waits to fill a batch")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per mode")
+    args = parser.parse_args(argv)
+
+    if not args.json:
+        print(f"{'mode':<8} {'deposits/s':>12} {'p50 ms':>8} {'p99 ms':>8} {'batch':>7}")
+
+    for mode in ("single", "group"):
+        result = run(mode, args.accounts, args.deposits, args.callers, args.synchronous, args.max_batch, args.max_delay)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{mode:<8} {result['deposits_per_second']:>12,.1f} {result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f} {result['average_batch']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hivebank import CredentialHasher
+
+# Logins per second, and per core, that CredentialHasher sustains at each cost setting.
+# A burst of concurrent logins is simulated by one thread per pending login calling verify(),
+# which hands the KDF work to the hasher's process pool.
+#
+#   python benchmarks/login_throughput.py --workers 4 --logins 200
+
+COST_SETTINGS = [
+    ("scrypt", {"n": 2 ** 13}),
+    ("scrypt", {"n": 2 ** 14}),
+    ("scrypt", {"n": 2 ** 15}),
+    ("pbkdf2_sha256", {"iterations": 210_000}),
+    ("pbkdf2_sha256", {"iterations": 600_000}),
+]
+
+
+def run(algorithm, cost, workers, logins):
+    hasher = CredentialHasher(algorithm, workers=workers, **cost)
+    try:
+        stored = hasher.hash("Passw0rd!")
+
+        # Warm the pool so process start-up is not counted
+        hasher.verify("Passw0rd!", stored)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, workers) * 2) as threads:
+            results = list(threads.map(lambda _: hasher.verify("Passw0rd!", stored), range(logins)))
+        elapsed = time.perf_counter() - started
+    finally:
+        hasher.close()
+
+    cores = min(max(1, workers), os.cpu_count() or 1)
+    return {
+        "algorithm": algorithm,
+        "cost": cost,
+        "workers": workers,
+        "logins": logins,
+        "seconds": round(elapsed, 3),
+        "logins_per_second": round(logins / elapsed, 1),
+        "logins_per_second_per_core": round(logins / elapsed / cores, 1),
+        "all_verified": all(results),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Login throughput by KDF cost setting.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="hashing processes (0 hashes in-thread)")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per setting")
+    args = parser.parse_args(argv)
+
+    if not args.json:
+        print(f"{'algorithm':<15} {'cost':<20} {'logins/s':>10} {'per core':>10}")
+
+    for algorithm, cost in COST_SETTINGS:
+        result = run(algorithm, cost, args.workers, args.logins)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            cost_text = ", ".join(f"{key}={value}" for key, value in cost.items())
+            print(f"{algorithm:<15} {cost_text:<20} {result['logins_per_second']:>10,.1f} {result['logins_per_second_per_core']:>10,.1f}")
+
+
+if __name__ == "__main__":
+    main()
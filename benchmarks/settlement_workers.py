@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hivebank import BankError, CredentialHasher
+from hivebank.bulk import parse_row
+from hivebank.limits import TransactionLimits
+from hivebank.sharding import ShardedBankService
+from hivebank.workers import PostingWorkerPool
+
+# Posts the same settlement file into a sharded bank twice: row by row through ShardedBankService,
+# and with a PostingWorkerPool (one worker process per shard). Checks that both runs accept and
+# refuse the same rows and end with the same balances, and prints per-worker throughput. Both runs
+# enforce the default transaction limits.
+#
+#   python benchmarks/settlement_workers.py --accounts 400 --rows 20000 --shards 2 4 8
+
+
+def make_rows(account_numbers, count, seed):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        posting_type = rng.choice(["deposit", "withdrawal", "transfer", "transfer"])
+        row = {"type": posting_type, "account_number": rng.choice(account_numbers), "amount": round(rng.uniform(1, 1_500), 2)}
+        if posting_type == "transfer":
+            row["recipient_account"] = rng.choice(account_numbers)
+        rows.append(row)
+    return rows
+
+
+def balances(bank):
+    result = {}
+    for shard in bank.shards:
+        result.update(shard.db.connection().execute("SELECT account_number, ROUND(balance, 2) FROM users"))
+    return result
+
+
+# Posts every row on its own, in file order, and returns (seconds, {line: status}, balances)
+def run_serial(directory, shards, rows):
+    bank = ShardedBankService(directory, shards, limits=TransactionLimits())
+    statuses = {}
+    started = time.perf_counter()
+    for line, row in enumerate(rows, start=1):
+        try:
+            posting_type, account_number, amount, recipient_account = parse_row(bank, row)
+            shard = bank.shard_for_account(account_number)
+            user = shard.db.connection().execute("SELECT user_id FROM users WHERE account_number = ?", (account_number,)).fetchone()
+            if posting_type == "deposit":
+                bank.deposit(user[0], amount)
+            elif posting_type == "withdrawal":
+                bank.withdrawal(user[0], amount)
+            else:
+                bank.transfer(user[0], recipient_account, amount)
+            statuses[line] = "posted"
+        except BankError:
+            statuses[line] = "rejected"
+    elapsed = time.perf_counter() - started
+    result = balances(bank)
+    bank.close()
+    return elapsed, statuses, result
+
+
+def run(accounts, count, shards, opening_balance):
+    with tempfile.TemporaryDirectory() as scratch:
+        seeded = os.path.join(scratch, "seeded")
+        # Credentials are never checked here, so the cheapest KDF setting keeps seeding fast
+        bank = ShardedBankService(seeded, shards, hasher=CredentialHasher(n=2, workers=0))
+        account_numbers = [
+            bank.sign_up("Bench", "Load", "User", f"bench{i}", f"bench{i}@example.com", "Passw0rd!", "1234", opening_balance)["account_number"]
+            for i in range(accounts)
+        ]
+        bank.close()
+        rows = make_rows(account_numbers, count, shards)
+
+        serial = os.path.join(scratch, "serial")
+        shutil.copytree(seeded, serial)
+        serial_seconds, serial_statuses, serial_balances = run_serial(serial, shards, rows)
+
+        pooled = os.path.join(scratch, "pooled")
+        shutil.copytree(seeded, pooled)
+        pool = PostingWorkerPool(pooled, shards)
+        started = time.perf_counter()
+        report = pool.import_rows(enumerate(rows, start=1))
+        pool_seconds = time.perf_counter() - started
+
+        bank = ShardedBankService(pooled, shards)
+        same_balances = balances(bank) == serial_balances
+        bank.close()
+
+        return {
+            "shards": shards,
+            "rows": count,
+            "serial_rows_per_second": round(count / serial_seconds, 1),
+            "pool_rows_per_second": round(count / pool_seconds, 1),
+            "same_results": {result["line"]: result["status"] for result in report.results} == serial_statuses,
+            "same_balances": same_balances,
+            "workers": pool.stats(),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Settlement throughput, serial against one worker process per shard.")
+    parser.add_argument("--accounts", type=int, default=400)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--opening-balance", type=int, default=3_000)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per run")
+    args = parser.parse_args(argv)
+
+    for shards in args.shards:
+        result = run(args.accounts, args.rows, shards, args.opening_balance)
+        if args.json:
+            print(json.dumps(result))
+            continue
+        print(
+            f"{shards} shards: serial {result['serial_rows_per_second']:,.1f} rows/s, pool {result['pool_rows_per_second']:,.1f} rows/s, "
+            f"same results {result['same_results']}, same balances {result['same_balances']}"
+        )
+        for worker in result["workers"]:
+            print(
+                f"  worker {worker['worker']}: {worker['postings']} postings, {worker['credits']} credits, "
+                f"cpu {worker['cpu_seconds']:.2f}s, handoff wait {worker['handoff_wait_seconds']:.2f}s, max queue {worker['max_queue_depth']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hivebank import BankService, BankError, ConnectionManager, CredentialHasher
+from hivebank.sharding import ShardedBankService
+
+# Measures how many transfers per second BankService sustains as the number of worker threads grows.
+# Every run starts from a fresh scratch database, and afterwards checks that no money was created or
+# lost and that no balance went negative.
+#
+#   python benchmarks/transfer_throughput.py --accounts 1000 --transfers 20000 --workers 1 2 4 8
+#   python benchmarks/transfer_throughput.py --shards 1 2 4 --workers 4 --synchronous FULL
+#
+# With --shards every run uses a ShardedBankService with that many database files instead.
+
+
+def seed(path, accounts, opening_balance):
+    service = BankService(path)
+    rows = [
+        (f"Bench User {i}", f"bench{i}", f"bench{i}@example.com", "x", "x", opening_balance, f"{10_000_000 + i}", opening_balance * 100)
+        for i in range(accounts)
+    ]
+    with service.db.transaction("IMMEDIATE") as conn:
+        conn.executemany("INSERT INTO users (full_name, username, email, password, pin, initial_deposit, account_number, balance_minor) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    service.close()
+
+
+def open_sharded(directory, shards, accounts, opening_balance, synchronous):
+    # Credentials are never checked here, so the cheapest KDF setting keeps seeding fast
+    service = ShardedBankService(directory, shards, hasher=CredentialHasher(n=2, workers=0), synchronous=synchronous)
+    account_numbers = {}
+    for i in range(accounts):
+        account = service.sign_up("Bench", "Load", "User", f"bench{i}", f"bench{i}@example.com", "Passw0rd!", "1234", opening_balance)
+        account_numbers[account["user_id"]] = account["account_number"]
+    return service, account_numbers
+
+
+def totals(service):
+    shards = getattr(service, "shards", [service])
+    rows = [shard.db.connection().execute("SELECT SUM(balance), MIN(balance) FROM users").fetchone() for shard in shards]
+    return sum(row[0] or 0 for row in rows), min(row[1] for row in rows if row[1] is not None)
+
+
+def run(accounts, transfers, workers, opening_balance, synchronous, shards=None):
+    with tempfile.TemporaryDirectory() as scratch:
+        if shards:
+            service, account_numbers = open_sharded(os.path.join(scratch, "bench"), shards, accounts, opening_balance, synchronous)
+            databases = [shard.db for shard in service.shards]
+        else:
+            path = os.path.join(scratch, "bench.db")
+            seed(path, accounts, opening_balance)
+            db = ConnectionManager(path, synchronous=synchronous)
+            service = BankService(path, db=db)
+            account_numbers = dict(db.connection().execute("SELECT user_id, account_number FROM users"))
+            databases = [db]
+        user_ids = list(account_numbers)
+
+        refused = 0
+        refused_lock = threading.Lock()
+
+        def worker(count, worker_seed):
+            nonlocal refused
+            rng = random.Random(worker_seed)
+            for _ in range(count):
+                sender, recipient = rng.sample(user_ids, 2)
+                try:
+                    service.transfer(sender, account_numbers[recipient], rng.randint(1, opening_balance // 10))
+                except BankError:
+                    with refused_lock:
+                        refused += 1
+
+        share = transfers // workers
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(worker, share, index) for index in range(workers)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        total, lowest = totals(service)
+        service.close()
+
+        return {
+            "shards": shards or 1,
+            "workers": workers,
+            "transfers": share * workers,
+            "refused": refused,
+            "seconds": round(elapsed, 3),
+            "transfers_per_second": round(share * workers / elapsed, 1),
+            "busy_retries": sum(db.retry_count for db in databases),
+            "money_conserved": abs(total - accounts * opening_balance) < 1e-6,
+            "lowest_balance": lowest,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transfer throughput by worker count.")
+    parser.add_argument("--accounts", type=int, default=1_000)
+    parser.add_argument("--transfers", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--opening-balance", type=int, default=10_000)
+    parser.add_argument("--synchronous", default="NORMAL")
+    parser.add_argument("--shards", type=int, nargs="+", help="run against a ShardedBankService with each of these shard counts")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per run")
+    args = parser.parse_args(argv)
+
+    if not args.json:
+        print(f"{'shards':>7} {'workers':>8} {'transfers/s':>12} {'refused':>8} {'retries':>8} {'conserved':>10}")
+
+    for shards in args.shards or [None]:
+        for workers in args.workers:
+            result = run(args.accounts, args.transfers, workers, args.opening_balance, args.synchronous, shards)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f"{result['shards']:>7} {result['workers']:>8} {result['transfers_per_second']:>12,.1f} {result['refused']:>8} {result['busy_retries']:>8} {str(result['money_conserved']):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+from .errors import (
+    BankError,
+    ValidationError,
+    AuthenticationError,
+    UserNotFoundError,
+    RecipientNotFoundError,
+    InvalidPinError,
+    InsufficientFundsError,
+    DuplicateUserError,
+    ThrottledError,
+    LimitExceededError,
+    TooManyArchivesError,
+)
+from .accounts import AccountNumberAllocator
+from .cache import AccountCache
+from .db import ConnectionManager
+from .hashing import CredentialHasher
+from .journal import Journal, Replica
+from .limits import Limit, TransactionLimits
+from .metrics import Metrics
+from .service import BankService
+from .throttle import LoginThrottle
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+
+from .errors import BankError
+
+# Unique 8-digit account numbers without probing the users table.
+#
+# A persisted counter is pushed through a keyed Feistel permutation, so consecutive counter values
+# come out as scattered, unguessable account numbers and no two counter values can ever give the
+# same number. The key, the counter and the check digit setting live in account_number_sequence,
+# so every process that opens the database continues the same sequence.
+#
+# Counter values are reserved from the database in blocks, so a batch of sign ups costs one
+# UPDATE no matter how many numbers it needs.
+
+FEISTEL_HALF_BITS = 14
+FEISTEL_MASK = (1 << FEISTEL_HALF_BITS) - 1
+FEISTEL_ROUNDS = 4
+
+SEQUENCE_NAME = "account_number"
+
+
+class AccountNumbersExhaustedError(BankError):
+    pass
+
+
+# Luhn check digit for a string of digits
+def luhn_digit(digits):
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        value = int(digit)
+        if position % 2 == 0:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return str((10 - total % 10) % 10)
+
+
+class AccountNumberAllocator:
+    def __init__(self, db, block_size=100, check_digit=False):
+        self.db = db
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._key, self.check_digit = self._load_sequence(check_digit)
+        self._tables = None
+
+        # With a check digit the permutation covers the 7-digit body, otherwise all 8 digits
+        if self.check_digit:
+            self._base, self._size = 1_000_000, 9_000_000
+        else:
+            self._base, self._size = 10_000_000, 90_000_000
+
+    # account_number_sequence is created by hivebank.schema, in bank databases and sharded catalogs alike
+    def _load_sequence(self, check_digit):
+        # An existing sequence is only read, so opening a database takes no write lock
+        row = self.db.connection().execute("SELECT key, check_digit FROM account_number_sequence WHERE name = ?", (SEQUENCE_NAME,)).fetchone()
+        if row is not None:
+            return row[0], bool(row[1])
+
+        def load(conn):
+            conn.execute(
+                "INSERT OR IGNORE INTO account_number_sequence (name, next_value, key, check_digit) VALUES (?, 0, ?, ?)",
+                (SEQUENCE_NAME, os.urandom(16), int(check_digit)),
+            )
+            key, stored_check_digit = conn.execute("SELECT key, check_digit FROM account_number_sequence WHERE name = ?", (SEQUENCE_NAME,)).fetchone()
+            return key, bool(stored_check_digit)
+
+        return self.db.run(load)
+
+    # Claims count counter values in the database and returns the first one
+    def _claim(self, count):
+        if self.db.connection().in_transaction:
+            # A rollback of the caller's transaction would hand these numbers out twice
+            raise RuntimeError("Account numbers must be reserved outside of another transaction.")
+
+        def claim(conn):
+            end = conn.execute("UPDATE account_number_sequence SET next_value = next_value + ? WHERE name = ? RETURNING next_value", (count, SEQUENCE_NAME)).fetchone()[0]
+            if end > self._size:
+                raise AccountNumbersExhaustedError("No account numbers left.")
+            return end - count
+
+        return self.db.run(claim)
+
+    # The round function only ever sees 14-bit inputs, so each round is precomputed into a lookup table
+    def _round_tables(self):
+        tables = []
+        for round_number in range(FEISTEL_ROUNDS):
+            table = []
+            for half in range(FEISTEL_MASK + 1):
+                digest = hashlib.blake2b(bytes((round_number,)) + half.to_bytes(2, "big"), key=self._key, digest_size=4).digest()
+                table.append(int.from_bytes(digest, "big") & FEISTEL_MASK)
+            tables.append(table)
+        return tables
+
+    # Bijection on [0, self._size): Feistel over 28 bits, cycle-walking until the result is in range
+    def _permute(self, value):
+        if self._tables is None:
+            self._tables = self._round_tables()
+        while True:
+            left, right = value >> FEISTEL_HALF_BITS, value & FEISTEL_MASK
+            for table in self._tables:
+                left, right = right, left ^ table[right]
+            value = (left << FEISTEL_HALF_BITS) | right
+            if value < self._size:
+                return value
+
+    def _format(self, counter):
+        body = str(self._base + self._permute(counter))
+        if self.check_digit:
+            return body + luhn_digit(body)
+        return body
+
+    # Returns one new account number
+    def allocate(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next = self._claim(self.block_size)
+                self._end = self._next + self.block_size
+            counter = self._next
+            self._next += 1
+        return self._format(counter)
+
+    # Returns count new account numbers with a single database round trip, for batch sign ups
+    def reserve(self, count):
+        if count < 1:
+            return []
+        first = self._claim(count)
+        return [self._format(counter) for counter in range(first, first + count)]
+
+    def is_valid(self, account_number):
+        if len(account_number) != 8 or not account_number.isdigit():
+            return False
+        if self.check_digit:
+            return luhn_digit(account_number[:7]) == account_number[7]
+        return True
@@ -0,0 +1,309 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .service import BankService, COUNTERPARTY_NAME, CREDIT_TYPE_CODES, TRANSFER_OUT, TRANSFER_IN, TYPE_CODES, TYPE_NAMES, EPOCH, parse_date
+
+# Columnar analytics over the transactions table, for finance reporting.
+#
+# Ledger rows are copied out of SQLite in transaction_id order, a chunk at a time, into NumPy
+# columns (the ledger already stores integers, so this is a straight copy):
+#   transaction_id, user_id   int64
+#   type_code                 int8, see hivebank.service.TYPE_CODES
+#   amount_minor              int64, amount in kobo so sums are exact
+#   epoch                     int64, posted_at: seconds since 1970-01-01 of the local wall-clock time
+#   counterparty              int32, index into the store's counterparty table (-1 for deposits/withdrawals)
+# Aggregates are then computed with bincount/cumsum over whole columns instead of row by row.
+#
+# Counterparties are told apart by counterparty_id, so two accounts with the same full name stay
+# separate. Only legacy rows not yet migrated (hivebank.migrate_ledger), which have no id, fall
+# back to the name they recorded.
+#
+# With a directory the columns are .npy files opened as memory maps, plus meta.json holding the
+# last transaction_id loaded and the counterparty table, so refresh() only reads rows added since
+# the previous run and a report process can map the columns without loading them. A store written
+# before counterparties had ids is loaded again from scratch.
+#
+# NumPy is an optional dependency: pip install numpy.
+
+COLUMNS = (
+    ("transaction_id", "int64"),
+    ("user_id", "int64"),
+    ("type_code", "int8"),
+    ("amount_minor", "int64"),
+    ("epoch", "int64"),
+    ("counterparty", "int32"),
+)
+
+SECONDS_PER_DAY = 86_400
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("hivebank.analytics needs NumPy: pip install numpy")
+
+
+def _day(moment):
+    moment = parse_date(moment)
+    if isinstance(moment, datetime.datetime):
+        moment = moment.date()
+    return (moment - EPOCH.date()).days
+
+
+# Rows with an id are keyed on it alone; legacy rows without one on their name
+def _counterparty_key(counterparty_id, name):
+    return (counterparty_id, None) if counterparty_id is not None else (None, name)
+
+
+def _date(day):
+    return (EPOCH.date() + datetime.timedelta(days=int(day))).isoformat()
+
+
+class TransactionStore:
+    # directory=None keeps the columns in memory only
+    def __init__(self, directory=None, chunk_size=100_000):
+        _require_numpy()
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.length = 0
+        self.last_transaction_id = 0
+        # (counterparty_id, name) per counterparty code, name being what reports show
+        self.counterparties = []
+        self._counterparty_codes = {}
+        self._columns = {}
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+        if not self._columns:
+            self._columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS}
+
+    # ------------------------------------------------------------------ storage
+
+    def _meta_path(self):
+        return os.path.join(self.directory, "meta.json")
+
+    def _column_path(self, name):
+        return os.path.join(self.directory, f"{name}.npy")
+
+    def _load(self):
+        if not os.path.exists(self._meta_path()):
+            return
+        with open(self._meta_path(), encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        if "counterparties" not in meta:
+            return
+        self.length = meta["length"]
+        self.last_transaction_id = meta["last_transaction_id"]
+        self.counterparties = [tuple(counterparty) for counterparty in meta["counterparties"]]
+        self._counterparty_codes = {_counterparty_key(*counterparty): code for code, counterparty in enumerate(self.counterparties)}
+        self._columns = {name: np.load(self._column_path(name), mmap_mode="r+") for name, _ in COLUMNS}
+
+    def _save(self):
+        for column in self._columns.values():
+            if isinstance(column, np.memmap):
+                column.flush()
+        meta = {"length": self.length, "last_transaction_id": self.last_transaction_id, "counterparties": self.counterparties}
+        scratch = self._meta_path() + ".tmp"
+        with open(scratch, "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(scratch, self._meta_path())
+
+    # Makes room for at least length + extra rows, doubling capacity so appends stay amortised O(1)
+    def _reserve(self, extra):
+        capacity = len(self._columns["transaction_id"])
+        if self.length + extra <= capacity:
+            return
+        capacity = max(self.length + extra, capacity * 2, 1_024)
+
+        for name, dtype in COLUMNS:
+            old = self._columns[name]
+            if self.directory is None:
+                new = np.zeros(capacity, dtype=dtype)
+            else:
+                scratch = self._column_path(name) + ".tmp"
+                new = np.lib.format.open_memmap(scratch, mode="w+", dtype=dtype, shape=(capacity,))
+            new[:self.length] = old[:self.length]
+            if self.directory is not None:
+                new.flush()
+                del old
+                os.replace(scratch, self._column_path(name))
+                new = np.load(self._column_path(name), mmap_mode="r+")
+            self._columns[name] = new
+
+    def _counterparty_code(self, counterparty_id, name):
+        key = _counterparty_key(counterparty_id, name)
+        code = self._counterparty_codes.get(key)
+        if code is None:
+            code = self._counterparty_codes[key] = len(self.counterparties)
+            self.counterparties.append((counterparty_id, name))
+        return code
+
+    # Loads every transaction after last_transaction_id and returns how many rows were added
+    def refresh(self, service):
+        conn = service.db.connection()
+        sql = (
+            f"SELECT transaction_id, user_id, type_code, amount_minor, posted_at, CASE WHEN type_code IN (?, ?) THEN {COUNTERPARTY_NAME} END, counterparty_id FROM {{}} l "
+            "WHERE transaction_id > ? ORDER BY transaction_id LIMIT ?"
+        )
+        # Rows archived (hivebank.archive) before this engine loaded them are read from the archives,
+        # a batch of them at a time, until the engine has reached the rows still in postings
+        hot_start = None
+        archived = False
+        if service.archive_boundary() is not None:
+            hot_start = conn.execute("SELECT MIN(transaction_id) FROM postings").fetchone()[0]
+            archived = hot_start is None or self.last_transaction_id + 1 < hot_start
+
+        added = 0
+        while True:
+            params = (TYPE_CODES[TRANSFER_OUT], TYPE_CODES[TRANSFER_IN], self.last_transaction_id, self.chunk_size)
+            rows = conn.execute(sql.format("ledger"), params).fetchall()
+            if archived:
+                for schemas in service.archive_batches():
+                    for schema in schemas:
+                        rows += conn.execute(sql.format(f"{schema}.ledger"), params).fetchall()
+                rows = sorted({row[0]: row for row in rows}.values())[:self.chunk_size]
+            if not rows:
+                break
+
+            self._reserve(len(rows))
+            start, end = self.length, self.length + len(rows)
+            columns = self._columns
+            for index, (name, _) in enumerate(COLUMNS[:-1]):
+                columns[name][start:end] = [row[index] for row in rows]
+            # The other party: the recipient of money sent, the sender of money received
+            columns["counterparty"][start:end] = [-1 if row[5] is None else self._counterparty_code(row[6], row[5]) for row in rows]
+
+            self.length = end
+            self.last_transaction_id = rows[-1][0]
+            if hot_start is not None and self.last_transaction_id + 1 >= hot_start:
+                archived = False
+            added += len(rows)
+            if self.directory is not None:
+                self._save()
+        return added
+
+    def column(self, name):
+        return self._columns[name][:self.length]
+
+    # ---------------------------------------------------------------- selection
+
+    # Boolean mask of rows for user_id (None for the whole bank) with from_date <= day <= to_date
+    def _mask(self, user_id=None, from_date=None, to_date=None):
+        mask = np.ones(self.length, dtype=bool)
+        if user_id is not None:
+            mask &= self.column("user_id") == user_id
+        if from_date is not None:
+            mask &= self.column("epoch") >= _day(from_date) * SECONDS_PER_DAY
+        if to_date is not None:
+            mask &= self.column("epoch") < (_day(to_date) + 1) * SECONDS_PER_DAY
+        return mask
+
+    # ---------------------------------------------------------------- aggregates
+
+    # Per day and transaction_type: {date: {transaction_type: amount}}, amounts in naira
+    def daily_flows(self, user_id=None, from_date=None, to_date=None):
+        mask = self._mask(user_id, from_date, to_date)
+        if not mask.any():
+            return {}
+        days = self.column("epoch")[mask] // SECONDS_PER_DAY
+        codes = self.column("type_code")[mask].astype("int64")
+        amounts = self.column("amount_minor")[mask]
+
+        first = days.min()
+        slots = len(TYPE_NAMES) + 1
+        totals = np.bincount((days - first) * slots + codes, weights=amounts, minlength=(days.max() - first + 1) * slots).reshape(-1, slots)
+
+        flows = {}
+        for offset in np.flatnonzero(totals.any(axis=1)):
+            flows[_date(first + offset)] = {TYPE_NAMES[code]: float(totals[offset, code]) / 100 for code in TYPE_NAMES if totals[offset, code]}
+        return flows
+
+    # Net flow (credits minus debits) per day with its trailing moving average over window days.
+    # Days without transactions count as zero, so the average is over calendar days.
+    def moving_average(self, user_id=None, window=7, from_date=None, to_date=None):
+        mask = self._mask(user_id, from_date, to_date)
+        if not mask.any():
+            return []
+        days = self.column("epoch")[mask] // SECONDS_PER_DAY
+        amounts = self.column("amount_minor")[mask]
+        signed = np.where(np.isin(self.column("type_code")[mask], CREDIT_TYPE_CODES), amounts, -amounts)
+
+        first = days.min()
+        net = np.bincount(days - first, weights=signed)
+        running = np.cumsum(np.concatenate(([0.0], net)))
+        counts = np.minimum(np.arange(1, len(net) + 1), window)
+        averages = (running[1:] - running[np.maximum(np.arange(1, len(net) + 1) - window, 0)]) / counts
+        return [{"date": _date(first + offset), "net": float(net[offset]) / 100, "moving_average": float(averages[offset]) / 100} for offset in range(len(net))]
+
+    # The counterparties user_id (or the whole bank) moved most money with, largest first.
+    # sent_to is money paid to the counterparty, received_from is money the counterparty paid.
+    def top_counterparties(self, user_id=None, limit=10, from_date=None, to_date=None):
+        mask = self._mask(user_id, from_date, to_date) & (self.column("counterparty") >= 0)
+        if not mask.any():
+            return []
+        counterparties = self.column("counterparty")[mask]
+        codes = self.column("type_code")[mask]
+        amounts = self.column("amount_minor")[mask]
+
+        size = len(self.counterparties)
+        sent_to = np.bincount(counterparties, weights=np.where(codes == TYPE_CODES[TRANSFER_OUT], amounts, 0), minlength=size)
+        received_from = np.bincount(counterparties, weights=np.where(codes == TYPE_CODES[TRANSFER_IN], amounts, 0), minlength=size)
+        transfers = np.bincount(counterparties, minlength=size)
+        total = sent_to + received_from
+
+        top = np.argsort(-total, kind="stable")[:limit]
+        return [
+            {"counterparty_id": self.counterparties[code][0], "name": self.counterparties[code][1], "sent_to": float(sent_to[code]) / 100, "received_from": float(received_from[code]) / 100, "transfers": int(transfers[code])}
+            for code in top
+            if transfers[code]
+        ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transaction analytics over NumPy columns.")
+    parser.add_argument("report", choices=["refresh", "daily", "moving-average", "counterparties"])
+    parser.add_argument("--db", default="users.db", help="database file (default: users.db)")
+    parser.add_argument("--store", help="directory for the memory-mapped columns; kept between runs and refreshed incrementally")
+    parser.add_argument("--account", help="account number to report on (default: the whole bank)")
+    parser.add_argument("--from", dest="from_date", help="first day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="to_date", help="last day, YYYY-MM-DD")
+    parser.add_argument("--window", type=int, default=7, help="moving average window in days (default: 7)")
+    parser.add_argument("--limit", type=int, default=10, help="counterparties to list (default: 10)")
+    args = parser.parse_args(argv)
+
+    store = TransactionStore(args.store)
+    service = BankService(args.db)
+    try:
+        added = store.refresh(service)
+        user_id = None
+        if args.account:
+            row = service.db.connection().execute("SELECT user_id FROM users WHERE account_number = ?", (args.account,)).fetchone()
+            if not row:
+                print(f"Account {args.account} not found.", file=sys.stderr)
+                return 1
+            user_id = row[0]
+    finally:
+        service.close()
+
+    if args.report == "refresh":
+        result = {"added": added, "rows": store.length, "last_transaction_id": store.last_transaction_id}
+    elif args.report == "daily":
+        result = store.daily_flows(user_id, args.from_date, args.to_date)
+    elif args.report == "moving-average":
+        result = store.moving_average(user_id, args.window, args.from_date, args.to_date)
+    else:
+        result = store.top_counterparties(user_id, args.limit, args.from_date, args.to_date)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
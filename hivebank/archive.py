@@ -0,0 +1,222 @@
+import argparse
+import datetime
+import os
+import sys
+import threading
+import time
+
+from .journal import Journal, JournalError
+from .service import BankService, EPOCH, LEDGER_VIEW, attach_limit, to_epoch
+
+# Hot/cold archiving of the ledger.
+#
+# Rows posted before a cut-off (max_age_days before today) move out of postings into one SQLite file
+# per calendar year next to the main database, <name>-archive-YYYY.db, listed in the archives table
+# and opened with ATTACH only when a read needs them. The hot table and its index then only hold
+# recent history, which is what postings, history pages and statements touch almost every time.
+#
+# A run first records the new cut-off in archives.archived_until, so readers know rows below it may
+# have moved, then walks postings from its oldest row in chunks. Each chunk is copied into the
+# archive (INSERT OR IGNORE, committed with synchronous=FULL) and only then deleted from postings in
+# a second short transaction. A crash in between leaves the rows in both places, which the next run
+# finishes; every reader of the archives (history, statements, reconciliation, analytics) keeps one
+# copy per transaction_id, so no row is ever lost or counted twice.
+#
+# Rows are archived in transaction_id order and a run stops at the first row newer than the cut-off;
+# ids follow posting time, so that row and everything after it is recent.
+#
+# The journal (hivebank.journal) only reads postings, so a row archived before it was journaled would
+# never reach it. With a journal (the service's, or one passed in), a run first syncs it and never
+# archives past its postings_mark.
+#
+#   python -m hivebank.archive --db users.db --max-age-days 365 --chunk-size 5000 --pause 0.05
+
+ARCHIVE_COLUMNS = "transaction_id, user_id, counterparty_id, type_code, amount_minor, posted_at, balance_after_minor"
+
+
+def archive_name(year):
+    return f"archive_{year}"
+
+
+def year_of(posted_at):
+    return (EPOCH + datetime.timedelta(seconds=posted_at)).year
+
+
+def year_bounds(year):
+    return to_epoch(datetime.date(year, 1, 1)), to_epoch(datetime.date(year + 1, 1, 1))
+
+
+class Archiver:
+    def __init__(self, service, max_age_days=365, chunk_size=5_000, pause=0.0, journal=None):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.service = service
+        self.journal = journal if journal is not None else service.journal
+        self.max_age_days = max_age_days
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.archived = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    # Rows posted before this (midnight, max_age_days ago) are archived
+    def cutoff(self, today=None):
+        today = today or datetime.date.today()
+        return to_epoch(today - datetime.timedelta(days=self.max_age_days))
+
+    def _file_for(self, year):
+        stem = os.path.splitext(os.path.basename(self.service.users_db))[0]
+        return f"{stem}-archive-{year}.db"
+
+    # Years with rows posted before cutoff still in postings
+    def _years(self, cutoff):
+        oldest = self.service.db.connection().execute("SELECT MIN(posted_at) FROM postings").fetchone()[0]
+        if oldest is None or oldest >= cutoff:
+            return []
+        return list(range(year_of(oldest), year_of(cutoff - 1) + 1))
+
+    # Attaches the archive files for years (no more than SQLite can attach at once), detaching any
+    # other archive, and creates their tables, so a registered archive always has its tables
+    def _prepare(self, years):
+        conn = self.service.db.connection()
+        self.service._attach(conn, [(archive_name(year), self._file_for(year)) for year in years])
+        for year in years:
+            schema = archive_name(year)
+            conn.execute(f"PRAGMA {schema}.journal_mode = WAL")
+            # The copy must be on disk before the hot rows are deleted
+            conn.execute(f"PRAGMA {schema}.synchronous = FULL")
+            conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.postings (
+                transaction_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                counterparty_id INTEGER,
+                type_code INTEGER NOT NULL,
+                amount_minor INTEGER NOT NULL,
+                posted_at INTEGER NOT NULL,
+                balance_after_minor INTEGER NOT NULL
+                )
+            """)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_postings_user_posted ON postings (user_id, posted_at, transaction_id)")
+            if not conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'view' AND name = 'ledger'").fetchone():
+                conn.execute(LEDGER_VIEW.replace("CREATE VIEW ledger", f"CREATE VIEW {schema}.ledger"))
+
+    # Records the cut-off for every year, before any row moves
+    def _register(self, conn, years, cutoff):
+        for year in years:
+            period_start, period_end = year_bounds(year)
+            conn.execute(
+                "INSERT INTO archives (name, path, period_start, period_end, archived_until) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET archived_until = MAX(archived_until, excluded.archived_until)",
+                (archive_name(year), self._file_for(year), period_start, period_end, min(cutoff, period_end)),
+            )
+
+    # Moves up to chunk_size of the oldest rows posted before cutoff; returns how many moved
+    def step(self, cutoff):
+        db = self.service.db
+        rows = db.connection().execute(f"SELECT {ARCHIVE_COLUMNS} FROM postings ORDER BY transaction_id LIMIT ?", (self.chunk_size,)).fetchall()
+        journaled = None if self.journal is None else self.journal.postings_mark
+        limit = attach_limit(db.connection())
+        chunk = []
+        by_year = {}
+        for row in rows:
+            if row[5] >= cutoff or (journaled is not None and row[0] > journaled):
+                break
+            year = year_of(row[5])
+            # A chunk only spans as many years as can be attached together
+            if year not in by_year and len(by_year) == limit:
+                break
+            by_year.setdefault(year, []).append(row)
+            chunk.append(row)
+        if not chunk:
+            return 0
+
+        self._prepare(sorted(by_year))
+
+        def copy(conn):
+            for year, year_rows in by_year.items():
+                conn.executemany(f"INSERT OR IGNORE INTO {archive_name(year)}.postings ({ARCHIVE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", year_rows)
+
+        db.run(copy)
+        # Nothing is inserted below an existing id, so these are exactly the rows just copied
+        db.run(lambda conn: conn.execute("DELETE FROM postings WHERE transaction_id <= ?", (chunk[-1][0],)))
+        return len(chunk)
+
+    # Archives everything posted before the cut-off and returns the number of rows moved
+    def run(self, today=None, progress=None):
+        conn = self.service.db.connection()
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'legacy_transactions'").fetchone():
+            raise RuntimeError("Finish python -m hivebank.migrate_ledger before archiving.")
+        if self.journal is not None:
+            try:
+                self.journal.sync(self.service.db)
+            except (OSError, JournalError) as exc:
+                raise RuntimeError(f"Cannot bring journal {self.journal.path} up to date, so nothing was archived: {exc}") from exc
+
+        cutoff = self.cutoff(today)
+        years = self._years(cutoff)
+        limit = attach_limit(conn)
+        for start in range(0, len(years), limit):
+            self._prepare(years[start:start + limit])
+        self.service.db.run(lambda conn: self._register(conn, years, cutoff))
+
+        moved = 0
+        while not self._stop.is_set():
+            count = self.step(cutoff)
+            if not count:
+                break
+            moved += count
+            self.archived += count
+            if progress is not None:
+                progress(moved)
+            if self.pause:
+                time.sleep(self.pause)
+        return moved
+
+    # Runs run() on a background thread, e.g. from a long-lived server process
+    def start(self, today=None):
+        if self._thread is not None and self._thread.is_alive():
+            raise RuntimeError("Archiver is already running.")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(today,), name="hivebank-archiver", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    # Asks a background run to stop after its current chunk and waits for it
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old ledger rows into yearly archive files.")
+    parser.add_argument("--db", default="users.db", help="database file (default: users.db)")
+    parser.add_argument("--max-age-days", type=int, default=365, help="archive rows posted more than this many days ago (default: 365)")
+    parser.add_argument("--chunk-size", type=int, default=5_000, help="rows moved per transaction (default: 5000)")
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to wait between chunks (default: 0)")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the main database afterwards to return the freed pages to the file system")
+    parser.add_argument("--journal", help="the bank's journal: bring it up to date first and only archive rows it holds")
+    args = parser.parse_args(argv)
+
+    service = BankService(args.db, journal=Journal(args.journal) if args.journal else None)
+    try:
+        archiver = Archiver(service, args.max_age_days, args.chunk_size, args.pause)
+        moved = archiver.run(progress=lambda moved: print(f"  {moved} archived", end="\r", flush=True))
+        # Ends the progress line so the summary does not run into it
+        if moved:
+            print()
+        if args.vacuum:
+            service.db.connection().execute("VACUUM main")
+    except RuntimeError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    finally:
+        service.close()
+        if service.journal is not None:
+            service.journal.close()
+    print(f"Archived {moved} row(s) posted before {datetime.date.today() - datetime.timedelta(days=args.max_age_days)}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+import argparse
+import csv
+import json
+import os
+import sys
+
+from .errors import LimitExceededError, ValidationError
+from .limits import TransactionLimits
+from .service import BankService, DEPOSIT, WITHDRAWAL, TRANSFER_OUT, TRANSFER_IN, POSTING_INSERT, minor_posting_row, to_minor
+
+# Bulk posting of deposits, withdrawals and transfers from upstream files.
+#
+# Rows are streamed from a CSV (with a header) or JSONL file with the fields
+#   type               deposit | withdrawal | transfer
+#   account_number     account being posted to (the sender for transfers)
+#   amount             positive number
+#   recipient_account  only for transfers
+#
+# Every batch runs in one BEGIN IMMEDIATE transaction: the balances of the accounts it touches
+# are read once, each row is checked in file order against the same rules as BankService
+# (positive amount, known accounts, no transfers to self, transaction limits, no overdraft), and
+# the accepted rows are written with executemany. Withdrawals and transfers count against the
+# service's TransactionLimits like any other posting, including earlier rows of the same batch.
+
+POSTING_TYPES = ("deposit", "withdrawal", "transfer")
+
+# SQLite caps the number of ? placeholders per statement
+LOOKUP_CHUNK = 500
+
+
+class BulkImportReport:
+    def __init__(self):
+        self.posted = 0
+        self.rejected = 0
+        self.results = []
+
+    def add(self, line, status, reason=None):
+        if status == "posted":
+            self.posted += 1
+        else:
+            self.rejected += 1
+        self.results.append({"line": line, "status": status, "reason": reason})
+
+    def write_csv(self, path):
+        with open(path, "w", newline="", encoding="utf-8") as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=["line", "status", "reason"])
+            writer.writeheader()
+            writer.writerows(self.results)
+
+
+# Yields (line_number, row) pairs without loading the whole file
+def read_rows(path):
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline="", encoding="utf-8") as source:
+        if extension == ".csv":
+            # The header is line 1, so the first data row is line 2
+            for line, row in enumerate(csv.DictReader(source), start=2):
+                yield line, row
+        elif extension in (".jsonl", ".ndjson"):
+            for line, text in enumerate(source, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    row = json.loads(text)
+                except json.JSONDecodeError as exc:
+                    row = ValidationError("row", f"Invalid JSON: {exc.msg}")
+                yield line, row
+        else:
+            raise ValueError(f"Unsupported file type: {extension or path}")
+
+
+# Normalises one row into (type, account_number, amount, recipient_account); service checks the amount
+def parse_row(service, row):
+    if isinstance(row, ValidationError):
+        raise row
+    if not isinstance(row, dict):
+        raise ValidationError("row", "Row must be an object.")
+
+    posting_type = str(row.get("type") or "").strip().lower()
+    if posting_type not in POSTING_TYPES:
+        raise ValidationError("type", f"Unknown posting type: {row.get('type')!r}")
+
+    account_number = str(row.get("account_number") or "").strip()
+    if not account_number:
+        raise ValidationError("account_number", "account_number cannot be blank.")
+
+    try:
+        amount = float(row.get("amount"))
+    except (TypeError, ValueError):
+        raise ValidationError("amount", "Please, enter a valid number.") from None
+    amount = service.validate_amount(amount)
+
+    recipient_account = None
+    if posting_type == "transfer":
+        recipient_account = str(row.get("recipient_account") or "").strip()
+        if not recipient_account:
+            raise ValidationError("recipient_account", "This field cannot be blank.")
+        if recipient_account == account_number:
+            raise ValidationError("recipient_account", "You cannot transfer money to yourself.")
+
+    return posting_type, account_number, amount, recipient_account
+
+
+class BulkImporter:
+    def __init__(self, service, batch_size=5_000):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.service = service
+        self.batch_size = batch_size
+
+    def import_file(self, path):
+        return self.import_rows(read_rows(path))
+
+    # Applies (line_number, row) pairs in batches of batch_size and returns a BulkImportReport
+    def import_rows(self, rows):
+        report = BulkImportReport()
+        batch = []
+        for line, row in rows:
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self._apply_batch(batch, report)
+                batch = []
+
+        if batch:
+            self._apply_batch(batch, report)
+        return report
+
+    # Returns the LimitExceededError message for a debit that would break a limit, else None
+    def _refuse_limit(self, conn, account, transaction_type, amount, posted_at):
+        try:
+            self.service._check_limits(conn, account["user_id"], transaction_type, amount, posted_at)
+        except LimitExceededError as exc:
+            return str(exc)
+        return None
+
+    def _load_accounts(self, cursor, account_numbers):
+        accounts = {}
+        account_numbers = list(account_numbers)
+        for start in range(0, len(account_numbers), LOOKUP_CHUNK):
+            chunk = account_numbers[start:start + LOOKUP_CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+            cursor.execute(f"SELECT account_number, user_id, balance_minor FROM users WHERE account_number IN ({placeholders})", chunk)
+            for account_number, user_id, balance_minor in cursor:
+                accounts[account_number] = {"user_id": user_id, "balance_minor": balance_minor}
+        return accounts
+
+    def _apply_batch(self, batch, report):
+        parsed = []
+        for line, row in batch:
+            try:
+                parsed.append((line, parse_row(self.service, row)))
+            except ValidationError as exc:
+                report.add(line, "rejected", str(exc))
+
+        if not parsed:
+            return
+
+        account_numbers = set()
+        for _, (_, account_number, _, recipient_account) in parsed:
+            account_numbers.add(account_number)
+            if recipient_account:
+                account_numbers.add(recipient_account)
+
+        posted_at = self.service._now()
+
+        # Rebuilt from scratch if the transaction has to be retried
+        def post(conn):
+            balance_updates = []
+            transaction_rows = []
+            outcomes = []
+            cursor = conn.cursor()
+            accounts = self._load_accounts(cursor, account_numbers)
+
+            for line, (posting_type, account_number, amount, recipient_account) in parsed:
+                account = accounts.get(account_number)
+                if account is None:
+                    outcomes.append((line, "rejected", "User not found."))
+                    continue
+                amount_minor = to_minor(amount)
+
+                if posting_type == "deposit":
+                    account["balance_minor"] += amount_minor
+                    balance_updates.append((amount_minor, account["user_id"]))
+                    transaction_rows.append(minor_posting_row(account["user_id"], None, DEPOSIT, amount_minor, posted_at, account["balance_minor"]))
+
+                elif posting_type == "withdrawal":
+                    refused = self._refuse_limit(conn, account, WITHDRAWAL, amount, posted_at)
+                    if refused:
+                        outcomes.append((line, "rejected", refused))
+                        continue
+                    if amount_minor > account["balance_minor"]:
+                        outcomes.append((line, "rejected", "Insufficient funds."))
+                        continue
+                    account["balance_minor"] -= amount_minor
+                    balance_updates.append((-amount_minor, account["user_id"]))
+                    transaction_rows.append(minor_posting_row(account["user_id"], None, WITHDRAWAL, amount_minor, posted_at, account["balance_minor"]))
+                    self.service._record_limits(conn, account["user_id"], WITHDRAWAL, amount, posted_at)
+
+                else:
+                    recipient = accounts.get(recipient_account)
+                    if recipient is None:
+                        outcomes.append((line, "rejected", "Recipient cannot be found."))
+                        continue
+                    refused = self._refuse_limit(conn, account, TRANSFER_OUT, amount, posted_at)
+                    if refused:
+                        outcomes.append((line, "rejected", refused))
+                        continue
+                    if amount_minor > account["balance_minor"]:
+                        outcomes.append((line, "rejected", "Insufficient funds."))
+                        continue
+                    account["balance_minor"] -= amount_minor
+                    recipient["balance_minor"] += amount_minor
+                    balance_updates.append((-amount_minor, account["user_id"]))
+                    balance_updates.append((amount_minor, recipient["user_id"]))
+                    transaction_rows.append(minor_posting_row(account["user_id"], recipient["user_id"], TRANSFER_OUT, amount_minor, posted_at, account["balance_minor"]))
+                    transaction_rows.append(minor_posting_row(recipient["user_id"], account["user_id"], TRANSFER_IN, amount_minor, posted_at, recipient["balance_minor"]))
+                    self.service._record_limits(conn, account["user_id"], TRANSFER_OUT, amount, posted_at)
+
+                outcomes.append((line, "posted", None))
+
+            cursor.executemany("UPDATE users SET balance_minor = balance_minor + ? WHERE user_id = ?", balance_updates)
+            cursor.executemany(POSTING_INSERT, transaction_rows)
+            if self.service.cache is not None:
+                touched = {user_id for _, user_id in balance_updates}
+                self.service.db.after_commit(lambda: self.service.cache.invalidate(*touched))
+            self.service._journal()
+            return outcomes
+
+        outcomes = self.service.db.run(post)
+
+        # Only report postings once the batch has committed
+        for line, status, reason in outcomes:
+            report.add(line, status, reason)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Post deposits, withdrawals and transfers from a CSV or JSONL file.")
+    parser.add_argument("path", help="CSV (with header) or JSONL file of postings")
+    parser.add_argument("--db", default="users.db", help="database file (default: users.db)")
+    parser.add_argument("--batch-size", type=int, default=5_000, help="rows per transaction (default: 5000)")
+    parser.add_argument("--report", help="write the per-row results to this CSV file")
+    parser.add_argument("--no-limits", action="store_true", help="do not enforce the default withdrawal and transfer limits (hivebank.limits)")
+    args = parser.parse_args(argv)
+
+    service = BankService(args.db, limits=None if args.no_limits else TransactionLimits())
+    try:
+        report = BulkImporter(service, args.batch_size).import_file(args.path)
+    finally:
+        service.close()
+
+    if args.report:
+        report.write_csv(args.report)
+    print(f"Posted: {report.posted}  Rejected: {report.rejected}")
+    return 0 if report.rejected == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
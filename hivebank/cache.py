@@ -0,0 +1,124 @@
+import threading
+
+from collections import OrderedDict
+
+# In-process read-through cache for account lookups.
+#
+# Two LRU maps, each holding at most max_entries:
+#   user_id        -> account details (full_name, username, account_number, email, balance)
+#   account_number -> (user_id, full_name) for recipient lookups
+# Names, usernames, emails and account numbers never change once an account exists, so only the
+# balance needs care. BankService updates it after every posting commits, with the id of the
+# posting's ledger row as its version. Postings commit one at a time, so a higher id always means a
+# newer balance, and updates arriving out of order cannot roll a balance back.
+#
+# A reader that misses takes a token() before querying and hands it back to fill_account(). The
+# fill is dropped if a posting may have touched that account since the token was taken (including
+# one whose cache entry was evicted or invalidated in the meantime), so a slow reader can never put
+# a balance older than the last committed posting into the cache.
+#
+# The cache only sees postings made through this process's BankService. Code that changes balances
+# behind its back must call invalidate() (BulkImporter does), and another process writing to the
+# same database makes cached balances stale, so use one only where this process owns the writes.
+
+
+class AccountCache:
+    def __init__(self, max_entries=10_000):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        # user_id -> [details or None, balance, version, written_at]
+        self._users = OrderedDict()
+        self._recipients = OrderedDict()
+        # Bumped by every balance update and invalidation
+        self._clock = 0
+        # Newest clock value of any update that has since left the cache
+        self._forgotten = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    def token(self):
+        with self._lock:
+            return self._clock
+
+    def _evict(self):
+        while len(self._users) > self.max_entries:
+            _, entry = self._users.popitem(last=False)
+            self._forgotten = max(self._forgotten, entry[3])
+
+    # Account details for user_id, or None on a miss
+    def account(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or entry[0] is None:
+                self.misses += 1
+                return None
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return {**entry[0], "balance": entry[1]}
+
+    def fill_account(self, details, token):
+        user_id = details["user_id"]
+        profile = {key: value for key, value in details.items() if key != "balance"}
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                # A posting already put a newer balance here; the profile fields never change
+                entry[0] = profile
+                return
+            if self._forgotten > token:
+                return
+            self._users[user_id] = [profile, details["balance"], 0, 0]
+            self._evict()
+
+    # (user_id, full_name) owning account_number, or None on a miss
+    def recipient(self, account_number):
+        with self._lock:
+            recipient = self._recipients.get(account_number)
+            if recipient is None:
+                self.misses += 1
+                return None
+            self._recipients.move_to_end(account_number)
+            self.hits += 1
+            return recipient
+
+    def fill_recipient(self, account_number, user_id, full_name):
+        with self._lock:
+            self._recipients[account_number] = (user_id, full_name)
+            self._recipients.move_to_end(account_number)
+            while len(self._recipients) > self.max_entries:
+                self._recipients.popitem(last=False)
+
+    # Records a committed balance; version is the id of the ledger row that produced it
+    def update_balance(self, user_id, balance, version):
+        with self._lock:
+            self._clock += 1
+            entry = self._users.get(user_id)
+            if entry is None:
+                self._users[user_id] = [None, balance, version, self._clock]
+                self._evict()
+            elif version > entry[2]:
+                entry[1], entry[2], entry[3] = balance, version, self._clock
+                self._users.move_to_end(user_id)
+            else:
+                entry[3] = self._clock
+
+    # Forgets cached balances, e.g. after they were changed without going through BankService
+    def invalidate(self, *user_ids):
+        with self._lock:
+            self._clock += 1
+            for user_id in user_ids:
+                self._users.pop(user_id, None)
+            self._forgotten = self._clock
+
+    def clear(self):
+        with self._lock:
+            self._clock += 1
+            self._users.clear()
+            self._recipients.clear()
+            self._forgotten = self._clock
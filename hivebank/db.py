@@ -0,0 +1,165 @@
+import random
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+
+from .metrics import InstrumentedConnection
+
+
+# True for SQLITE_BUSY / SQLITE_LOCKED and their extended codes
+def is_busy(exc):
+    code = getattr(exc, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(exc)
+    return "locked" in message or "busy" in message
+
+
+class ConnectionManager:
+    # Hands out one long-lived SQLite connection per thread instead of opening a new one per call.
+    # Every connection is opened in WAL mode with the tuning pragmas below, and keeps its own
+    # prepared statement cache, so repeated queries are compiled once per thread.
+    # Pass a hivebank.metrics.Metrics as metrics to time every statement and lock wait.
+    def __init__(
+        self,
+        path="users.db",
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        cache_size=-20_000,
+        mmap_size=256 * 1024 * 1024,
+        busy_timeout=5_000,
+        statement_cache_size=256,
+        busy_retries=5,
+        retry_backoff=0.005,
+        metrics=None,
+    ):
+        self.path = path
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.statement_cache_size = statement_cache_size
+        self.busy_retries = busy_retries
+        self.retry_backoff = retry_backoff
+        self.retry_count = 0
+        self.metrics = metrics
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _open(self):
+        # isolation_level=None leaves transaction control to transaction() below
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+            factory=sqlite3.Connection if self.metrics is None else InstrumentedConnection,
+        )
+        if self.metrics is not None:
+            conn.metrics = self.metrics
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    # Returns this thread's connection, opening it on first use
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        return conn
+
+    # Runs the block inside one transaction on this thread's connection.
+    # Nested calls join the outer transaction instead of starting a new one.
+    @contextmanager
+    def transaction(self, mode="DEFERRED"):
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+
+        if self.metrics is None:
+            conn.execute(f"BEGIN {mode}")
+        else:
+            started = time.perf_counter()
+            try:
+                conn.execute(f"BEGIN {mode}")
+            finally:
+                self.metrics.observe_lock_wait(time.perf_counter() - started)
+        self._local.after_commit = []
+        self._local.on_rollback = []
+        try:
+            yield conn
+        except BaseException:
+            self._local.after_commit = []
+            conn.rollback()
+            callbacks, self._local.on_rollback = self._local.on_rollback, []
+            for callback in reversed(callbacks):
+                callback()
+            raise
+        else:
+            conn.commit()
+            self._local.on_rollback = []
+            callbacks, self._local.after_commit = self._local.after_commit, []
+            for callback in callbacks:
+                callback()
+
+    # Calls callback once this thread's current transaction commits (or right away outside one).
+    # Callbacks of a transaction that rolls back, or is retried, are dropped.
+    def after_commit(self, callback):
+        pending = getattr(self._local, "after_commit", None)
+        if pending is not None and self.connection().in_transaction:
+            pending.append(callback)
+        else:
+            callback()
+
+    # Calls callback if this thread's current transaction rolls back (including before run() retries
+    # it), newest first, to undo in-memory changes made inside the transaction. Outside one it is dropped.
+    def on_rollback(self, callback):
+        pending = getattr(self._local, "on_rollback", None)
+        if pending is not None and self.connection().in_transaction:
+            pending.append(callback)
+
+    # Runs work(conn) in its own transaction, retrying the whole transaction with jittered exponential
+    # backoff when SQLite reports the database busy, at most busy_retries times.
+    # Write paths use mode="IMMEDIATE" so the write lock is taken at BEGIN, before anything is read,
+    # and two writers can never both read a balance and then fail to upgrade to a write.
+    def run(self, work, mode="IMMEDIATE"):
+        conn = self.connection()
+        if conn.in_transaction:
+            return work(conn)
+
+        attempt = 0
+        while True:
+            try:
+                with self.transaction(mode) as conn:
+                    return work(conn)
+            except sqlite3.OperationalError as exc:
+                if not is_busy(exc) or attempt >= self.busy_retries:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.retry_count += 1
+                backoff = self.retry_backoff * (2 ** attempt) * random.random()
+                if self.metrics is not None:
+                    self.metrics.observe_busy_retry(backoff)
+                time.sleep(backoff)
+
+    # Closes every connection this manager opened, in all threads
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
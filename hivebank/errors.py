@@ -0,0 +1,69 @@
+import math
+
+# Typed errors raised by the headless banking service.
+# Front-ends (the CLI, scripts, servers) catch these and decide how to show them.
+
+class BankError(Exception):
+    pass
+
+
+# Raised when an argument fails one of the sign up / amount / PIN rules
+class ValidationError(BankError):
+    def __init__(self, field, message):
+        super().__init__(message)
+        self.field = field
+
+
+# Raised when a username/email and password pair does not match any account
+class AuthenticationError(BankError):
+    pass
+
+
+class UserNotFoundError(BankError):
+    pass
+
+
+class RecipientNotFoundError(BankError):
+    pass
+
+
+class InvalidPinError(BankError):
+    pass
+
+
+# Raised when too many failed login or PIN attempts were made; try again after retry_after seconds
+class ThrottledError(BankError):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many failed attempts. Try again in {math.ceil(retry_after)} second(s).")
+        self.retry_after = retry_after
+
+
+class InsufficientFundsError(BankError):
+    def __init__(self, balance):
+        super().__init__("Insufficient funds.")
+        self.balance = balance
+
+
+# Raised when a withdrawal or transfer would break one of the account's transaction limits.
+# available is how much more the limit allows right now (None for a limit on the number of postings).
+class LimitExceededError(BankError):
+    def __init__(self, limit, available):
+        super().__init__(f"This would exceed your {limit} limit.")
+        self.limit = limit
+        self.available = available
+
+
+# Raised when one read needs more yearly archives (hivebank.archive) at once than SQLite can attach
+# to a connection
+class TooManyArchivesError(BankError):
+    def __init__(self, needed, limit):
+        super().__init__(f"This needs {needed} yearly archives at once, but SQLite can only attach {limit}. Narrow the date range.")
+        self.needed = needed
+        self.limit = limit
+
+
+# Raised when a username or email is already taken
+class DuplicateUserError(BankError):
+    def __init__(self, field):
+        super().__init__(f"{field.capitalize()} already exists.")
+        self.field = field
@@ -0,0 +1,156 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import Future
+
+# Group commit for postings.
+#
+# Each BankService posting normally commits its own transaction, so every deposit pays for a full
+# commit (an fsync with synchronous=FULL). A GroupCommitWriter owns one writer thread that takes
+# postings from many callers and applies up to max_batch of them, or whatever arrived within
+# max_delay seconds of the first, in a single transaction.
+#
+# Every posting runs the ordinary BankService method inside its own SAVEPOINT, so a refused posting
+# (insufficient funds, unknown recipient, bad amount) is rolled back on its own and fails only its
+# own future; the rest of the batch still commits. Works with a single-file BankService; with
+# sharding, use one writer per shard's BankService. Futures resolve after COMMIT returns, so a
+# resolved posting is as durable as the database's synchronous setting makes any commit.
+#
+#   writer = GroupCommitWriter(service, max_batch=256, max_delay=0.002)
+#   future = writer.submit_deposit(user_id, 500)
+#   balance = future.result()
+
+
+class _Posting:
+    __slots__ = ("method", "args", "future")
+
+    def __init__(self, method, args):
+        self.method = method
+        self.args = args
+        self.future = Future()
+
+
+class GroupCommitWriter:
+    def __init__(self, service, max_batch=256, max_delay=0.002):
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        self.service = service
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.postings = 0
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="hivebank-group-commit", daemon=True)
+        self._thread.start()
+
+    def _submit(self, method, *args):
+        posting = _Posting(method, args)
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("GroupCommitWriter is closed.")
+            self._queue.put(posting)
+        return posting.future
+
+    # Each submit_* returns a Future with the same result (or error) as the BankService method
+    def submit_deposit(self, user_id, amount):
+        return self._submit(self.service.deposit, user_id, amount)
+
+    def submit_withdrawal(self, user_id, amount):
+        return self._submit(self.service.withdrawal, user_id, amount)
+
+    def submit_transfer(self, user_id, recipient_account, amount):
+        return self._submit(self.service.transfer, user_id, recipient_account, amount)
+
+    # Blocking versions, so the writer can stand in for BankService's posting methods
+    def deposit(self, user_id, amount):
+        return self.submit_deposit(user_id, amount).result()
+
+    def withdrawal(self, user_id, amount):
+        return self.submit_withdrawal(user_id, amount).result()
+
+    def transfer(self, user_id, recipient_account, amount):
+        return self.submit_transfer(user_id, recipient_account, amount).result()
+
+    @property
+    def average_batch(self):
+        return self.postings / self.batches if self.batches else 0.0
+
+    # Stops accepting postings, commits everything already queued and stops the writer thread
+    def close(self):
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    # ------------------------------------------------------------ writer thread
+
+    def _run(self):
+        while True:
+            posting = self._queue.get()
+            if posting is None:
+                return
+            batch, stop = self._collect(posting)
+            self._commit(batch)
+            if stop:
+                return
+
+    # Gathers postings until the batch is full or max_delay has passed since the first one
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                posting = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if posting is None:
+                return batch, True
+            batch.append(posting)
+        return batch, False
+
+    def _commit(self, batch):
+        batch = [posting for posting in batch if posting.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        def apply(conn):
+            outcomes = []
+            for posting in batch:
+                conn.execute("SAVEPOINT posting")
+                try:
+                    result = posting.method(*posting.args)
+                except sqlite3.Error:
+                    # Database trouble (busy, disk full) fails or retries the whole batch
+                    raise
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO posting")
+                    conn.execute("RELEASE posting")
+                    outcomes.append((False, exc))
+                else:
+                    conn.execute("RELEASE posting")
+                    outcomes.append((True, result))
+            return outcomes
+
+        try:
+            # The postings' own db.run calls join this transaction; a busy database retries the batch
+            outcomes = self.service.db.run(apply)
+        except BaseException as exc:
+            for posting in batch:
+                posting.future.set_exception(exc)
+            return
+
+        self.batches += 1
+        self.postings += len(batch)
+        for posting, (succeeded, value) in zip(batch, outcomes):
+            if succeeded:
+                posting.future.set_result(value)
+            else:
+                posting.future.set_exception(value)
@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+
+from .metrics import timed
+
+# Salted, tunable password and PIN hashing.
+#
+# Stored hashes are self-describing strings:
+#   scrypt$<n>$<r>$<p>$<salt>$<hash>
+#   pbkdf2_sha256$<iterations>$<salt>$<hash>
+# with salt and hash in unpadded base64. Rows written before this module existed hold a bare
+# SHA-256 hex digest; those still verify, and are reported as needing an upgrade so the service
+# can rehash them on the next successful login.
+#
+# KDFs are deliberately slow, so the work runs on a process pool (workers > 0) and a burst of
+# logins is spread over every core instead of queueing behind one.
+
+ALGORITHMS = ("scrypt", "pbkdf2_sha256")
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _derive(algorithm, params, secret, salt):
+    if algorithm == "scrypt":
+        n, r, p = params
+        return hashlib.scrypt(secret.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=KEY_BYTES)
+    (iterations,) = params
+    return hashlib.pbkdf2_hmac("sha256", secret.encode(), salt, iterations, dklen=KEY_BYTES)
+
+
+def _encode(algorithm, params, salt, key):
+    return "$".join([algorithm, *(str(value) for value in params), _b64encode(salt), _b64encode(key)])
+
+
+# Runs in the worker processes: hashes one secret with a fresh salt
+def _hash_job(algorithm, params, secret):
+    salt = os.urandom(SALT_BYTES)
+    return _encode(algorithm, params, salt, _derive(algorithm, params, secret, salt))
+
+
+# Runs in the worker processes: True when secret matches the stored hash
+def _verify_job(secret, stored):
+    if "$" not in stored:
+        # Legacy unsalted SHA-256
+        return hmac.compare_digest(hashlib.sha256(secret.encode()).hexdigest(), stored)
+
+    algorithm, *fields = stored.split("$")
+    try:
+        if algorithm == "scrypt":
+            params = tuple(int(value) for value in fields[:3])
+        elif algorithm == "pbkdf2_sha256":
+            params = (int(fields[0]),)
+        else:
+            return False
+        salt, key = _b64decode(fields[-2]), _b64decode(fields[-1])
+    except (IndexError, ValueError):
+        return False
+    return hmac.compare_digest(_derive(algorithm, params, secret, salt), key)
+
+
+def _hash_many_job(algorithm, params, secrets):
+    return [_hash_job(algorithm, params, secret) for secret in secrets]
+
+
+class CredentialHasher:
+    # workers=None uses one process per core, workers=0 hashes in the calling thread.
+    # The pool is only started on first use, so importing or constructing this is free.
+    def __init__(self, algorithm="scrypt", n=2 ** 14, r=8, p=1, iterations=600_000, workers=None, metrics=None):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.params = (n, r, p) if algorithm == "scrypt" else (iterations,)
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.metrics = metrics
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        if not self.workers:
+            return None
+        with self._lock:
+            if self._pool is None:
+                # Imported on first use, so start-up does not load multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(self.workers)
+            return self._pool
+
+    def _call(self, job, *args):
+        pool = self._executor()
+        if pool is None:
+            return job(*args)
+        return pool.submit(job, *args).result()
+
+    @timed("hasher.hash")
+    def hash(self, secret):
+        return self._call(_hash_job, self.algorithm, self.params, secret)
+
+    # Hashes a list of secrets, spread across the pool in chunks
+    @timed("hasher.hash_many")
+    def hash_many(self, secrets):
+        secrets = list(secrets)
+        pool = self._executor()
+        if pool is None or len(secrets) < 2:
+            return _hash_many_job(self.algorithm, self.params, secrets)
+
+        size = max(1, -(-len(secrets) // (self.workers * 4)))
+        chunks = [secrets[start:start + size] for start in range(0, len(secrets), size)]
+        futures = [pool.submit(_hash_many_job, self.algorithm, self.params, chunk) for chunk in chunks]
+        return [hashed for future in futures for hashed in future.result()]
+
+    @timed("hasher.verify")
+    def verify(self, secret, stored):
+        return self._call(_verify_job, secret, stored)
+
+    # True when stored was written by a different algorithm or cost than the current settings
+    def needs_upgrade(self, stored):
+        prefix = "$".join([self.algorithm, *(str(value) for value in self.params)]) + "$"
+        return not stored.startswith(prefix)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
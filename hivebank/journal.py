@@ -0,0 +1,359 @@
+import json
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from .db import ConnectionManager
+
+# Append-only event journal and the read replica it feeds.
+#
+# The journal file starts with MAGIC and holds one record per event:
+#
+#   <I length> <I crc32> <q users_mark> <q postings_mark> <payload: length bytes of JSON> <I length>
+#
+# crc32 covers the two marks and the payload. users_mark and postings_mark are the highest user_id
+# and transaction_id journaled up to and including this record, and the trailing length lets the
+# last record be read from the end of the file, so opening a journal of any size reads one record.
+# Events are
+#
+#   {"e": "account", "user_id", "full_name", "username", "email", "account_number", "initial_deposit"}
+#   {"e": "posting", "transaction_id", "user_id", "counterparty_id", "type_code", "amount_minor",
+#    "posted_at", "balance_after_minor", "counterparty_name" (accounts held elsewhere only)}
+#
+# Journal.sync() appends every account and posting committed since the marks of the last record,
+# in user_id and transaction_id order. BankService calls it after each sign-up, posting and bulk
+# import batch commits; accounts opened by other tools (hivebank.onboarding) and anything committed
+# just before a crash are picked up by the next sync, so the database stays the source of truth and
+# the journal never skips or repeats a row. Transaction ids are handed out under the write lock and
+# so grow in commit order. A torn last record (a crash mid-append) is cut off when the journal is
+# opened. With fsync=True every sync is flushed to disk before it returns.
+#
+# Rows hivebank.migrate_ledger moves out of legacy_transactions keep their old, lower ids, which a
+# sync past them would never read. So sync() refuses (JournalError) until the migration has finished
+# and dropped legacy_transactions; the first sync after that starts from id 0 and journals every row.
+#
+# A Replica is an ordinary BankService database that only the journal writes to. catch_up() applies
+# the records after its stored offset, and the new offset, in one transaction, so it is a copy of the
+# primary as of some point in the journal. History, statements and reports can be served from it
+# with their usual code (BankService, hivebank.statements, hivebank.ledger) without touching the
+# primary's write lock or cache.
+# snapshot() writes a copy of the replica, including its journal offset, with the SQLite backup API.
+# A new replica, or a process that needs every balance, starts from the latest snapshot and replays
+# only the journal after it.
+#
+#   journal = Journal("users.journal")
+#   service = BankService("users.db", journal=journal)
+#
+#   python -m hivebank.journal --db users.db --journal users.journal
+#   python -m hivebank.journal --journal users.journal --replica replica.db --follow 1 --snapshot-every 3600 --snapshot-dir snapshots
+
+MAGIC = b"HBJ1"
+HEADER = struct.Struct("<IIqq")
+TRAILER = struct.Struct("<I")
+MARKS = struct.Struct("<qq")
+
+
+class JournalError(Exception):
+    pass
+
+
+def _encode(users_mark, postings_mark, event):
+    payload = json.dumps(event, separators=(",", ":")).encode()
+    marks = MARKS.pack(users_mark, postings_mark)
+    return HEADER.pack(len(payload), zlib.crc32(marks + payload), users_mark, postings_mark) + payload + TRAILER.pack(len(payload))
+
+
+# Yields (offset after the record, users_mark, postings_mark, event) for every intact record from
+# offset on; stops at the end of the file or at the first torn or corrupt record
+def read_journal(path, offset=len(MAGIC)):
+    with open(path, "rb") as journal_file:
+        if journal_file.read(len(MAGIC)) != MAGIC:
+            raise JournalError(f"{path} is not a hivebank journal.")
+        journal_file.seek(offset)
+        while True:
+            header = journal_file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, crc, users_mark, postings_mark = HEADER.unpack(header)
+            payload = journal_file.read(length)
+            trailer = journal_file.read(TRAILER.size)
+            if len(payload) < length or len(trailer) < TRAILER.size or TRAILER.unpack(trailer)[0] != length:
+                return
+            if zlib.crc32(header[8:] + payload) != crc:
+                return
+            offset += HEADER.size + length + TRAILER.size
+            yield offset, users_mark, postings_mark, json.loads(payload)
+
+
+class Journal:
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.users_mark = 0
+        self.postings_mark = 0
+        self.appended = 0
+        # Set once legacy_transactions is gone; it never comes back
+        self._migrated = False
+        self._lock = threading.Lock()
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as journal_file:
+                journal_file.write(MAGIC)
+        self._file = open(path, "r+b")
+        self._recover()
+
+    # Reads the marks from the last record, cutting off a torn one
+    def _recover(self):
+        journal_file = self._file
+        if journal_file.read(len(MAGIC)) != MAGIC:
+            raise JournalError(f"{self.path} is not a hivebank journal.")
+        end = journal_file.seek(0, os.SEEK_END)
+        if end == len(MAGIC):
+            return
+
+        if end >= len(MAGIC) + HEADER.size + TRAILER.size:
+            journal_file.seek(end - TRAILER.size)
+            length = TRAILER.unpack(journal_file.read(TRAILER.size))[0]
+            start = end - TRAILER.size - length - HEADER.size
+            if start >= len(MAGIC):
+                for offset, users_mark, postings_mark, _ in read_journal(self.path, start):
+                    if offset == end:
+                        self.users_mark, self.postings_mark = users_mark, postings_mark
+                        return
+
+        # The last record is torn: keep everything up to the last intact one
+        good = len(MAGIC)
+        for good, self.users_mark, self.postings_mark, _ in read_journal(self.path):
+            pass
+        journal_file.truncate(good)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    # Appends every account and posting db committed since the last record, reading at most batch
+    # rows per table per read transaction; returns how many records were appended. Raises
+    # JournalError while db still has legacy rows to migrate.
+    def sync(self, db, batch=10_000):
+        appended = 0
+        with self._lock:
+            if not self._migrated:
+                if db.connection().execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'legacy_transactions'").fetchone():
+                    raise JournalError(f"{db.path} still has legacy transactions; run hivebank.migrate_ledger before journaling it.")
+                self._migrated = True
+            while True:
+                records, users_mark, postings_mark, more = self._read(db, batch)
+                if records:
+                    self._file.seek(0, os.SEEK_END)
+                    self._file.write(b"".join(records))
+                    self._file.flush()
+                    self.users_mark, self.postings_mark = users_mark, postings_mark
+                    appended += len(records)
+                if not more:
+                    break
+            if appended and self.fsync:
+                os.fsync(self._file.fileno())
+            self.appended += appended
+        return appended
+
+    # Encodes the next accounts and postings after the marks; returns them, the marks after them and
+    # whether a batch was full, so there may be more.
+    # Postings are only read once every committed account is journaled, from the same read
+    # transaction, so an account's record always comes before its first posting.
+    def _read(self, db, batch):
+        with db.transaction() as conn:
+            accounts = conn.execute(
+                "SELECT user_id, full_name, username, email, account_number, initial_deposit FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (self.users_mark, batch),
+            ).fetchall()
+            postings = []
+            if len(accounts) < batch:
+                postings = conn.execute(
+                    "SELECT p.transaction_id, p.user_id, p.counterparty_id, p.type_code, p.amount_minor, p.posted_at, p.balance_after_minor, "
+                    "(SELECT full_name FROM external_accounts WHERE user_id = p.counterparty_id) "
+                    "FROM postings p WHERE p.transaction_id > ? ORDER BY p.transaction_id LIMIT ?",
+                    (self.postings_mark, batch),
+                ).fetchall()
+
+        records = []
+        users_mark, postings_mark = self.users_mark, self.postings_mark
+        for user_id, full_name, username, email, account_number, initial_deposit in accounts:
+            users_mark = user_id
+            records.append(_encode(users_mark, postings_mark, {
+                "e": "account", "user_id": user_id, "full_name": full_name, "username": username,
+                "email": email, "account_number": account_number, "initial_deposit": initial_deposit,
+            }))
+        for transaction_id, user_id, counterparty_id, type_code, amount_minor, posted_at, balance_after_minor, counterparty_name in postings:
+            postings_mark = transaction_id
+            event = {
+                "e": "posting", "transaction_id": transaction_id, "user_id": user_id, "counterparty_id": counterparty_id,
+                "type_code": type_code, "amount_minor": amount_minor, "posted_at": posted_at, "balance_after_minor": balance_after_minor,
+            }
+            if counterparty_name is not None:
+                event["counterparty_name"] = counterparty_name
+            records.append(_encode(users_mark, postings_mark, event))
+        return records, users_mark, postings_mark, len(accounts) == batch or len(postings) == batch
+
+
+class Replica:
+    def __init__(self, path, journal_path):
+        from .schema import migrate
+
+        self.path = path
+        self.journal_path = journal_path
+        self.db = ConnectionManager(path)
+        migrate(self.db)
+        self.db.run(self._seed_position)
+
+    # journal_position itself is created by hivebank.schema
+    def _seed_position(self, conn):
+        conn.execute(f"INSERT INTO journal_position SELECT {len(MAGIC)}, 0, 0 WHERE NOT EXISTS (SELECT 1 FROM journal_position)")
+
+    def close(self):
+        self.db.close()
+
+    def position(self):
+        return self.db.connection().execute("SELECT journal_offset, users_mark, postings_mark FROM journal_position").fetchone()
+
+    # Applies up to max_records journal records after the stored offset in one transaction;
+    # returns how many were applied
+    def catch_up(self, max_records=50_000):
+        def apply(conn):
+            offset, users_mark, postings_mark = conn.execute("SELECT journal_offset, users_mark, postings_mark FROM journal_position").fetchone()
+            applied = 0
+            for offset, users_mark, postings_mark, event in read_journal(self.journal_path, offset):
+                self._apply(conn, event)
+                applied += 1
+                if applied >= max_records:
+                    break
+            if applied:
+                conn.execute("UPDATE journal_position SET journal_offset = ?, users_mark = ?, postings_mark = ?", (offset, users_mark, postings_mark))
+            return applied
+
+        return self.db.run(apply)
+
+    def _apply(self, conn, event):
+        if event["e"] == "account":
+            # The replica holds no credentials, so nobody can log in to it
+            conn.execute(
+                "INSERT OR IGNORE INTO users (user_id, full_name, username, email, password, pin, initial_deposit, account_number, balance_minor) "
+                "VALUES (?, ?, ?, ?, '!', '!', ?, ?, ?)",
+                (event["user_id"], event["full_name"], event["username"], event["email"], event["initial_deposit"], event["account_number"], event["initial_deposit"] * 100),
+            )
+        elif event["e"] == "posting":
+            conn.execute(
+                "INSERT OR IGNORE INTO postings (transaction_id, user_id, counterparty_id, type_code, amount_minor, posted_at, balance_after_minor) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (event["transaction_id"], event["user_id"], event["counterparty_id"], event["type_code"], event["amount_minor"], event["posted_at"], event["balance_after_minor"]),
+            )
+            if "counterparty_name" in event:
+                conn.execute("INSERT OR IGNORE INTO external_accounts (user_id, full_name) VALUES (?, ?)", (event["counterparty_id"], event["counterparty_name"]))
+            # Postings arrive in transaction_id order, so the last one sets the balance
+            conn.execute("UPDATE users SET balance_minor = ? WHERE user_id = ?", (event["balance_after_minor"], event["user_id"]))
+
+    # Writes a consistent copy of the replica, journal offset included, to path
+    def snapshot(self, path):
+        scratch = path + ".tmp"
+        target = sqlite3.connect(scratch)
+        try:
+            self.db.connection().backup(target)
+        finally:
+            target.close()
+        os.replace(scratch, path)
+        return path
+
+    # Starts a replica at path from a snapshot; call catch_up() to replay the journal after it
+    @classmethod
+    def restore(cls, snapshot_path, path, journal_path):
+        source = sqlite3.connect(snapshot_path)
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        return cls(path, journal_path)
+
+
+# Every account's balance in kobo, rebuilt from a snapshot (or from nothing) plus the journal after it
+def recover_balances(journal_path, snapshot_path=None):
+    balances = {}
+    offset = len(MAGIC)
+    if snapshot_path is not None:
+        conn = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+        try:
+            offset = conn.execute("SELECT journal_offset FROM journal_position").fetchone()[0]
+            balances = dict(conn.execute("SELECT user_id, balance_minor FROM users"))
+        finally:
+            conn.close()
+
+    for _, _, _, event in read_journal(journal_path, offset):
+        if event["e"] == "account":
+            balances.setdefault(event["user_id"], event["initial_deposit"] * 100)
+        elif event["e"] == "posting":
+            balances[event["user_id"]] = event["balance_after_minor"]
+    return balances
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write the posting journal, or keep a read replica up to date from it.")
+    parser.add_argument("--journal", required=True, help="journal file")
+    parser.add_argument("--db", help="primary database: append everything it committed since the last record")
+    parser.add_argument("--replica", help="replica database to bring up to date from the journal")
+    parser.add_argument("--restore", help="start --replica from this snapshot first")
+    parser.add_argument("--follow", type=float, help="keep going, checking for new records every this many seconds")
+    parser.add_argument("--snapshot-every", type=float, help="with --follow, write a snapshot of the replica every this many seconds")
+    parser.add_argument("--snapshot-dir", default=".", help="directory for snapshots (default: current directory)")
+    args = parser.parse_args(argv)
+    if not args.db and not args.replica:
+        parser.error("pass --db, --replica or both")
+
+    primary = journal = replica = None
+    try:
+        if args.db:
+            primary = ConnectionManager(args.db)
+            journal = Journal(args.journal)
+        if args.replica:
+            replica = Replica.restore(args.restore, args.replica, args.journal) if args.restore else Replica(args.replica, args.journal)
+
+        last_snapshot = time.monotonic()
+        while True:
+            if journal is not None:
+                appended = journal.sync(primary)
+                if appended:
+                    print(f"Journaled {appended} record(s) up to transaction {journal.postings_mark}.")
+            if replica is not None:
+                while True:
+                    applied = replica.catch_up()
+                    if not applied:
+                        break
+                    print(f"Replica applied {applied} record(s), now at transaction {replica.position()[2]}.")
+                if args.snapshot_every and time.monotonic() - last_snapshot >= args.snapshot_every:
+                    path = replica.snapshot(os.path.join(args.snapshot_dir, f"snapshot-{replica.position()[2]}.db"))
+                    print(f"Wrote {path}.")
+                    last_snapshot = time.monotonic()
+            if args.follow is None:
+                break
+            time.sleep(args.follow)
+    except KeyboardInterrupt:
+        pass
+    except JournalError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    finally:
+        if journal is not None:
+            journal.close()
+        if primary is not None:
+            primary.close()
+        if replica is not None:
+            replica.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
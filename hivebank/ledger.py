@@ -0,0 +1,138 @@
+import argparse
+import datetime
+import sys
+
+from .errors import TooManyArchivesError, UserNotFoundError
+from .service import BankService, parse_date, to_epoch
+
+# Point-in-time balances from the running-balance ledger.
+#
+# Every ledger row carries balance_after_minor, so the balance of an account at any moment is the
+# balance after its last row at or before that moment: one descent of idx_postings_user_posted
+# instead of a replay of the account's history.
+# balance_snapshots keeps end-of-day balances for reporting, so repeated end-of-day queries and
+# bank-wide runs (interest accrual, regulatory returns) are a primary key lookup.
+# An account whose rows before the moment have all been archived (hivebank.archive) is looked up in
+# the archives, newest first; the hot database is always tried first.
+
+LAST_ROW_BEFORE = """
+    SELECT balance_after_minor, transaction_id FROM {}
+    WHERE user_id = ? AND posted_at < ?
+    ORDER BY posted_at DESC, transaction_id DESC LIMIT 1
+"""
+
+
+# Returns the exclusive posted_at upper bound for "as of moment": a plain date means the end of that day
+def _upper_bound(moment):
+    moment = parse_date(moment)
+    if isinstance(moment, datetime.datetime):
+        return to_epoch(moment) + 1
+    return to_epoch(moment + datetime.timedelta(days=1))
+
+
+# (balance_after_minor, transaction_id) of the account's last row posted before bound, or None
+def last_row_before(service, user_id, bound):
+    conn = service.db.connection()
+    row = conn.execute(LAST_ROW_BEFORE.format("ledger"), (user_id, bound)).fetchone()
+    if row is not None or service.archive_boundary() is None:
+        return row
+    for schemas in service.archive_batches(until=bound):
+        for schema in schemas:
+            row = conn.execute(LAST_ROW_BEFORE.format(f"{schema}.ledger"), (user_id, bound)).fetchone()
+            if row is not None:
+                return row
+    return None
+
+
+# SQL for column of the last row of account u posted before :bound, across the hot ledger and schemas
+def last_row_column(column, schemas):
+    lookups = [
+        f"(SELECT t.{column} FROM {source} t WHERE t.user_id = u.user_id AND t.posted_at < :bound "
+        f"ORDER BY t.posted_at DESC, t.transaction_id DESC LIMIT 1)"
+        for source in ["main.ledger"] + [f"{schema}.ledger" for schema in schemas]
+    ]
+    return f"COALESCE({', '.join(lookups)})" if len(lookups) > 1 else lookups[0]
+
+
+# The account's balance as of moment (a datetime, or a date for its end of day)
+def balance_at(service, user_id, moment):
+    row = last_row_before(service, user_id, _upper_bound(moment))
+    if row is not None:
+        return row[0] / 100
+
+    user = service.db.connection().execute("SELECT initial_deposit FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    if not user:
+        raise UserNotFoundError("Account not found.")
+    return float(user[0])
+
+
+# End-of-day balance, served from balance_snapshots when that day has been snapshotted
+def end_of_day_balance(service, user_id, day):
+    day = parse_date(day)
+    if isinstance(day, datetime.datetime):
+        day = day.date()
+
+    row = service.db.connection().execute(
+        "SELECT balance FROM balance_snapshots WHERE user_id = ? AND snapshot_date = ?",
+        (user_id, day.isoformat()),
+    ).fetchone()
+    if row is not None:
+        return row[0]
+    return balance_at(service, user_id, day)
+
+
+# Yields (user_id, account_number, balance) for every account as of moment, one indexed lookup per account
+def balances_at(service, moment):
+    bound = _upper_bound(moment)
+    balance = last_row_column("balance_after_minor", service.attach_archives(until=bound))
+    return service.db.connection().execute(
+        f"SELECT u.user_id, u.account_number, COALESCE({balance} / 100.0, u.initial_deposit) FROM users u ORDER BY u.user_id",
+        {"bound": bound},
+    )
+
+
+# Stores every account's end-of-day balance for day and returns the number of snapshots written
+def take_snapshots(service, day):
+    day = parse_date(day)
+    if isinstance(day, datetime.datetime):
+        day = day.date()
+    bound = _upper_bound(day)
+    schemas = service.attach_archives(until=bound)
+
+    def snapshot(conn):
+        cursor = conn.execute(
+            f"""
+            INSERT OR REPLACE INTO balance_snapshots (user_id, snapshot_date, balance, transaction_id)
+            SELECT u.user_id, :day,
+                   COALESCE({last_row_column("balance_after_minor", schemas)} / 100.0, u.initial_deposit),
+                   {last_row_column("transaction_id", schemas)}
+            FROM users u
+            """,
+            {"day": day.isoformat(), "bound": bound},
+        )
+        return cursor.rowcount
+
+    return service.db.run(snapshot)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Take end-of-day balance snapshots.")
+    parser.add_argument("--db", default="users.db", help="database file (default: users.db)")
+    parser.add_argument("--date", default=None, help="day to snapshot (YYYY-MM-DD, default: yesterday)")
+    args = parser.parse_args(argv)
+
+    day = args.date or (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+    service = BankService(args.db)
+    try:
+        written = take_snapshots(service, day)
+    except TooManyArchivesError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    finally:
+        service.close()
+    print(f"Snapshotted {written} account(s) for {day}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import threading
+
+from collections import OrderedDict, deque
+
+from .errors import LimitExceededError
+from .service import TRANSFER_OUT, TYPE_CODES, WITHDRAWAL, to_minor
+
+# Rolling-window limits on money leaving an account.
+#
+# Each Limit caps the total amount and/or the number of postings of some transaction types within
+# the last window seconds, e.g. 500,000 withdrawn per day or 5 transfers per 10 minutes. The engine
+# keeps, per account and per limit, a queue of the postings still inside the window with their
+# running total and count. A check drops the postings that have aged out of the front of the queue
+# and compares total + amount against the cap, so each posting is added and dropped once and a check
+# costs the same however long the account's history is.
+#
+# BankService checks before its balance UPDATE and records the posting in the same transaction,
+# with a rollback hook that takes it back out, so a refused, failed or retried posting never counts.
+# Postings commit one at a time, so two postings can never both pass the same remaining allowance.
+#
+# Nothing is persisted. The first time an account is seen, its postings within the longest window
+# are read from the ledger view through idx_postings_user_posted, so a restarted process enforces the
+# same limits it did before, and rows hivebank.migrate_ledger has not moved yet count as well (the
+# view scans legacy_transactions for them until the migration has finished). Only postings made through this process are counted after that; run
+# one posting process per database, or per account partition. At most max_accounts accounts are
+# kept in memory, least recently used first out, and an evicted account is simply read again.
+#
+#   limits = TransactionLimits([
+#       Limit("daily withdrawals", 86_400, max_amount=500_000, transaction_types=[WITHDRAWAL]),
+#       Limit("transfer velocity", 600, max_count=5, transaction_types=[TRANSFER_OUT]),
+#   ])
+#   service = BankService("users.db", limits=limits)
+
+
+class Limit:
+    def __init__(self, name, window, max_amount=None, max_count=None, transaction_types=(WITHDRAWAL, TRANSFER_OUT)):
+        if window <= 0:
+            raise ValueError("window must be positive")
+        if max_amount is None and max_count is None:
+            raise ValueError("a limit needs max_amount, max_count or both")
+        self.name = name
+        self.window = window
+        self.max_amount = max_amount
+        self.max_minor = None if max_amount is None else to_minor(max_amount)
+        self.max_count = max_count
+        self.type_codes = frozenset(TYPE_CODES[transaction_type] for transaction_type in transaction_types)
+
+
+# Hourly and daily caps on money out, and at most 10 transfers in 10 minutes
+DEFAULT_LIMITS = [
+    Limit("hourly withdrawals and transfers", 3_600, max_amount=1_000_000),
+    Limit("daily withdrawals and transfers", 86_400, max_amount=5_000_000),
+    Limit("daily withdrawals", 86_400, max_amount=1_000_000, transaction_types=[WITHDRAWAL]),
+    Limit("transfer velocity", 600, max_count=10, transaction_types=[TRANSFER_OUT]),
+]
+
+
+class _Window:
+    __slots__ = ("postings", "total_minor", "count")
+
+    def __init__(self):
+        # (posted_at, amount_minor), oldest first
+        self.postings = deque()
+        self.total_minor = 0
+        self.count = 0
+
+    def expire(self, since):
+        postings = self.postings
+        while postings and postings[0][0] <= since:
+            self.total_minor -= postings.popleft()[1]
+            self.count -= 1
+
+    def add(self, posted_at, amount_minor):
+        self.postings.append((posted_at, amount_minor))
+        self.total_minor += amount_minor
+        self.count += 1
+
+    # Takes back the newest posting, which must be (posted_at, amount_minor)
+    def remove(self, posted_at, amount_minor):
+        if self.postings and self.postings[-1] == (posted_at, amount_minor):
+            self.postings.pop()
+            self.total_minor -= amount_minor
+            self.count -= 1
+
+
+class TransactionLimits:
+    def __init__(self, limits=None, max_accounts=100_000):
+        self.limits = list(DEFAULT_LIMITS if limits is None else limits)
+        self.max_accounts = max_accounts
+        self.type_codes = frozenset().union(*(limit.type_codes for limit in self.limits))
+        self.longest = max((limit.window for limit in self.limits), default=0)
+        self.refused = 0
+
+        self._lock = threading.Lock()
+        # user_id -> one _Window per limit
+        self._accounts = OrderedDict()
+
+    # Reads user_id's postings within the longest window from the ledger
+    def _load(self, conn, user_id, now):
+        windows = [_Window() for _ in self.limits]
+        codes = sorted(self.type_codes)
+        rows = conn.execute(
+            f"SELECT type_code, amount_minor, posted_at FROM ledger WHERE user_id = ? AND posted_at > ? "
+            f"AND type_code IN ({', '.join('?' * len(codes))}) ORDER BY posted_at, transaction_id",
+            [user_id, now - self.longest] + codes,
+        )
+        for type_code, amount_minor, posted_at in rows:
+            for limit, window in zip(self.limits, windows):
+                if type_code in limit.type_codes:
+                    window.add(posted_at, amount_minor)
+        return windows
+
+    def _windows(self, conn, user_id, now):
+        windows = self._accounts.get(user_id)
+        if windows is None:
+            windows = self._accounts[user_id] = self._load(conn, user_id, now)
+            while len(self._accounts) > self.max_accounts:
+                self._accounts.popitem(last=False)
+        else:
+            self._accounts.move_to_end(user_id)
+        return windows
+
+    # Raises LimitExceededError if posting amount of transaction_type at now would break a limit.
+    # conn is the posting's connection, used the first time the account is seen.
+    def check(self, conn, user_id, transaction_type, amount, now):
+        type_code = TYPE_CODES[transaction_type]
+        if type_code not in self.type_codes:
+            return
+        amount_minor = to_minor(amount)
+        with self._lock:
+            windows = self._windows(conn, user_id, now)
+            for limit, window in zip(self.limits, windows):
+                if type_code not in limit.type_codes:
+                    continue
+                window.expire(now - limit.window)
+                if limit.max_count is not None and window.count + 1 > limit.max_count:
+                    self.refused += 1
+                    raise LimitExceededError(limit.name, None)
+                if limit.max_minor is not None and window.total_minor + amount_minor > limit.max_minor:
+                    self.refused += 1
+                    raise LimitExceededError(limit.name, max(limit.max_minor - window.total_minor, 0) / 100)
+
+    # Counts a posting that passed check(); returns a function that takes it back out
+    def record(self, conn, user_id, transaction_type, amount, now):
+        type_code = TYPE_CODES[transaction_type]
+        if type_code not in self.type_codes:
+            return lambda: None
+        amount_minor = to_minor(amount)
+        with self._lock:
+            windows = [window for limit, window in zip(self.limits, self._windows(conn, user_id, now)) if type_code in limit.type_codes]
+            for window in windows:
+                window.add(now, amount_minor)
+
+        def undo():
+            with self._lock:
+                for window in windows:
+                    window.remove(now, amount_minor)
+        return undo
+
+    # Drops every account's windows, e.g. after postings were made behind this engine's back
+    def clear(self):
+        with self._lock:
+            self._accounts.clear()
@@ -0,0 +1,382 @@
+import bisect
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Optional instrumentation: per-operation latency histograms, per-statement SQL counts and timings,
+# lock/busy wait time and rows touched, exported as Prometheus text or JSON.
+#
+# Nothing here is active unless a Metrics object is handed to BankService (or ConnectionManager /
+# CredentialHasher). Without one, connections are plain sqlite3 connections and each timed method
+# costs a single attribute check, so the disabled overhead is a few tens of nanoseconds per call.
+#
+#   metrics = Metrics()
+#   service = BankService("users.db", metrics=metrics)
+#   metrics.serve(port=9464)          # GET /metrics (Prometheus) or /metrics.json
+#   metrics.write("metrics.prom")     # or "metrics.json"
+#
+# SQLite does not report rows scanned per statement to Python, so every instrumented connection
+# counts virtual machine steps through a progress handler (in units of VM_STEP_INTERVAL
+# instructions). VM steps grow with the rows a statement visits, which is what a missing index
+# shows up as, next to the rows actually returned and changed.
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+VM_STEP_INTERVAL = 100
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # Upper bound of the bucket holding the given quantile; None for an empty histogram
+    def quantile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            total += count
+            yield bound, total
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {_format_bound(bound): total for bound, total in self.cumulative()},
+        }
+
+
+class StatementStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows_returned = 0
+        self.rows_changed = 0
+        self.vm_steps = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@functools.lru_cache(maxsize=2_048)
+def normalize_sql(sql):
+    return " ".join(sql.split())
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.operations = {}
+        self.errors = {}
+        self.statements = {}
+        self.lock_wait = Histogram()
+        self.busy_retries = 0
+        self.busy_backoff_seconds = 0.0
+        self.journal_failures = {}
+        self._http = None
+
+    def observe_operation(self, operation, seconds, error=None):
+        with self._lock:
+            histogram = self.operations.get(operation)
+            if histogram is None:
+                histogram = self.operations[operation] = Histogram()
+            histogram.observe(seconds)
+            if error is not None:
+                key = (operation, error)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def observe_statement(self, sql, seconds, rows_returned=0, rows_changed=0, vm_steps=0, call=True):
+        key = normalize_sql(sql)
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = StatementStats()
+            stats.calls += call
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows_returned += rows_returned
+            stats.rows_changed += rows_changed
+            stats.vm_steps += vm_steps * VM_STEP_INTERVAL
+
+    # Time spent in BEGIN, i.e. waiting for SQLite's write lock
+    def observe_lock_wait(self, seconds):
+        with self._lock:
+            self.lock_wait.observe(seconds)
+
+    def observe_busy_retry(self, backoff):
+        with self._lock:
+            self.busy_retries += 1
+            self.busy_backoff_seconds += backoff
+
+    # A journal sync after a commit that raised error (an exception class name)
+    def observe_journal_failure(self, error):
+        with self._lock:
+            self.journal_failures[error] = self.journal_failures.get(error, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+            self.errors = {}
+            self.statements = {}
+            self.lock_wait = Histogram()
+            self.busy_retries = 0
+            self.busy_backoff_seconds = 0.0
+            self.journal_failures = {}
+
+    # ------------------------------------------------------------------- export
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "operations": {operation: histogram.as_dict() for operation, histogram in sorted(self.operations.items())},
+                "errors": [{"operation": operation, "error": error, "count": count} for (operation, error), count in sorted(self.errors.items())],
+                "statements": {sql: stats.as_dict() for sql, stats in sorted(self.statements.items(), key=lambda item: -item[1].seconds)},
+                "lock_wait": self.lock_wait.as_dict(),
+                "busy": {"retries": self.busy_retries, "backoff_seconds": self.busy_backoff_seconds},
+                "journal_failures": [{"error": error, "count": count} for error, count in sorted(self.journal_failures.items())],
+            }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def prometheus(self):
+        lines = []
+
+        def histogram(name, help_text, histograms):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, values in histograms:
+                prefix = ",".join(f'{key}="{_label(value)}"' for key, value in labels)
+                joiner = "," if prefix else ""
+                for bound, total in values.cumulative():
+                    lines.append(f'{name}_bucket{{{prefix}{joiner}le="{_format_bound(bound)}"}} {total}')
+                suffix = f"{{{prefix}}}" if prefix else ""
+                lines.append(f"{name}_sum{suffix} {values.sum}")
+                lines.append(f"{name}_count{suffix} {values.count}")
+
+        def counter(name, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in samples:
+                suffix = "{" + ",".join(f'{key}="{_label(label)}"' for key, label in labels) + "}" if labels else ""
+                lines.append(f"{name}{suffix} {value}")
+
+        with self._lock:
+            histogram("hivebank_operation_seconds", "Latency of bank operations.", [((("operation", operation),), values) for operation, values in sorted(self.operations.items())])
+            counter("hivebank_operation_errors_total", "Operations that raised, by error type.", [((("operation", operation), ("error", error)), count) for (operation, error), count in sorted(self.errors.items())])
+
+            statements = sorted(self.statements.items())
+            for field, name, help_text in (
+                ("calls", "hivebank_statement_calls_total", "SQL statements executed."),
+                ("seconds", "hivebank_statement_seconds_total", "Time spent executing and fetching each SQL statement."),
+                ("rows_returned", "hivebank_statement_rows_returned_total", "Rows fetched from each SQL statement."),
+                ("rows_changed", "hivebank_statement_rows_changed_total", "Rows inserted, updated or deleted by each SQL statement."),
+                ("vm_steps", "hivebank_statement_vm_steps_total", "Approximate SQLite VM instructions run by each SQL statement; grows with rows scanned."),
+            ):
+                counter(name, help_text, [((("sql", sql),), getattr(stats, field)) for sql, stats in statements])
+
+            histogram("hivebank_lock_wait_seconds", "Time spent waiting in BEGIN for SQLite's lock.", [((), self.lock_wait)])
+            counter("hivebank_busy_retries_total", "Transactions retried because the database was busy.", [((), self.busy_retries)])
+            counter("hivebank_busy_backoff_seconds_total", "Time slept backing off before those retries.", [((), self.busy_backoff_seconds)])
+            counter("hivebank_journal_sync_failures_total", "Journal syncs after a commit that failed, by error type.", [((("error", error),), count) for error, count in sorted(self.journal_failures.items())])
+        return "\n".join(lines) + "\n"
+
+    # Writes JSON when path ends in .json, Prometheus text otherwise; the file is replaced atomically
+    def write(self, path):
+        text = self.to_json() if path.endswith(".json") else self.prometheus()
+        scratch = f"{path}.tmp"
+        with open(scratch, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(text)
+        os.replace(scratch, path)
+
+    # Serves /metrics (Prometheus text) and /metrics.json over HTTP from a daemon thread
+    def serve(self, host="127.0.0.1", port=9464):
+        # Imported here: http.server pulls in email, ssl and socket, which nothing else needs
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.prometheus().encode(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = metrics.to_json().encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._http = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._http.serve_forever, name="hivebank-metrics", daemon=True).start()
+        return self._http
+
+    def close(self):
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+            self._http = None
+
+
+# Decorates a method of an object with a .metrics attribute; records its latency when metrics is set
+def timed(operation):
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                result = method(self, *args, **kwargs)
+            except BaseException as exc:
+                metrics.observe_operation(operation, time.perf_counter() - started, type(exc).__name__)
+                raise
+            metrics.observe_operation(operation, time.perf_counter() - started)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+# ------------------------------------------------------------- SQL instrumentation
+#
+# ConnectionManager opens connections with factory=InstrumentedConnection when it has a Metrics
+# object. Every execute/executemany and every fetch on their cursors is timed and charged to the
+# statement's normalised SQL text, together with rows returned, rows changed and VM steps.
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def _measure(self, sql, call, function, *args):
+        conn = self.connection
+        steps = conn.vm_steps
+        changes = conn.total_changes
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            seconds = time.perf_counter() - started
+            conn.metrics.observe_statement(sql, seconds, rows_changed=conn.total_changes - changes, vm_steps=conn.vm_steps - steps, call=call)
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        return self._measure(sql, True, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        return self._measure(sql, True, super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        self._sql = sql_script
+        return self._measure(sql_script, True, super().executescript, sql_script)
+
+    # Rows after the first are stepped by the fetch calls (and UPDATE ... RETURNING only counts its
+    # changes once fetched), so their cost belongs to the statement too
+    def _fetch(self, function, *args):
+        conn = self.connection
+        steps = conn.vm_steps
+        changes = conn.total_changes
+        started = time.perf_counter()
+        rows = function(*args)
+        seconds = time.perf_counter() - started
+        returned = (rows is not None) if not isinstance(rows, list) else len(rows)
+        conn.metrics.observe_statement(
+            getattr(self, "_sql", ""), seconds, rows_returned=returned, rows_changed=conn.total_changes - changes, vm_steps=conn.vm_steps - steps, call=False
+        )
+        return rows
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        row = self._fetch(super().fetchone)
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = None
+        self.vm_steps = 0
+        self.set_progress_handler(self._step, VM_STEP_INTERVAL)
+
+    def _step(self):
+        self.vm_steps += 1
+        return 0
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute bypasses cursor(), so route it through an instrumented cursor
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            self.metrics.observe_statement("COMMIT", time.perf_counter() - started)
+
+    def rollback(self):
+        started = time.perf_counter()
+        try:
+            super().rollback()
+        finally:
+            self.metrics.observe_statement("ROLLBACK", time.perf_counter() - started)
@@ -0,0 +1,234 @@
+import argparse
+import sys
+import time
+
+from .errors import ValidationError
+from .service import (
+    BankService,
+    LEDGER_VIEW,
+    TRANSFER_OUT,
+    TRANSFER_IN,
+    TYPE_CODES,
+    name_only_counterparty,
+    parse_date,
+    posting_row,
+    to_epoch,
+    to_minor,
+)
+
+# Online migration of a pre-compact transactions table into postings.
+#
+# Opening a BankService on an old database renames transactions to legacy_transactions and points
+# the ledger view at both tables, so the bank keeps serving (new postings already go to postings)
+# while this tool moves the legacy rows across in chunks. Each chunk is one short IMMEDIATE
+# transaction that inserts the converted rows into postings under their original transaction_id and
+# deletes them from legacy_transactions, so every row is in exactly one of the two tables at any
+# moment and readers of the ledger view never see a row twice or miss one. The tool can be stopped
+# and restarted at any point. Once legacy_transactions is empty it is dropped and the view is
+# redefined over postings alone.
+#
+# Legacy rows name the other party of a transfer instead of pointing at it. Its user_id is taken from
+# the matching leg of the same transfer: the row right before or after it, of the opposite type and
+# the same amount, posted within a second of it (the two legs were stamped by separate
+# datetime.now() calls, so their timestamps differ by microseconds). Failing that it comes from a
+# unique full_name in users, and failing both the name is kept as a name-only counterparty in
+# external_accounts. Rows whose timestamp is missing or unreadable are dated like the legacy row
+# before them (or after them, for the very first rows). The tool reports how many rows needed
+# either fallback.
+#
+#   python -m hivebank.migrate_ledger --db users.db --chunk-size 5000 --pause 0.05
+
+# Migrated rows keep their transaction_id
+MIGRATED_INSERT = (
+    "INSERT INTO postings (transaction_id, user_id, counterparty_id, type_code, amount_minor, posted_at, balance_after_minor) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+# Seconds since the epoch (with the fraction) of a legacy ISO timestamp, or None if it has none
+def _seconds(timestamp):
+    if timestamp is None:
+        return None
+    try:
+        moment = parse_date(timestamp)
+    except ValidationError:
+        return None
+    return to_epoch(moment) + getattr(moment, "microsecond", 0) / 1_000_000
+
+
+class LedgerMigration:
+    def __init__(self, service, chunk_size=5_000, pause=0.0):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.service = service
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.migrated = 0
+        # Transfer rows whose counterparty was found by name, and rows kept as name-only counterparties
+        self.by_name = 0
+        self.name_only = 0
+        # Rows with a missing or unreadable timestamp, dated from their neighbours
+        self.undated = 0
+        # full_name -> user_id, or None when the name is not unique
+        self._users_by_name = {}
+
+    def pending(self):
+        conn = self.service.db.connection()
+        if not self._legacy_exists(conn):
+            return 0
+        return conn.execute("SELECT COUNT(*) FROM legacy_transactions").fetchone()[0]
+
+    def _legacy_exists(self, conn):
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'legacy_transactions'").fetchone() is not None
+
+    def _user_by_name(self, cursor, full_name):
+        if full_name not in self._users_by_name:
+            rows = cursor.execute("SELECT user_id FROM users WHERE full_name = ? LIMIT 2", (full_name,)).fetchall()
+            self._users_by_name[full_name] = rows[0][0] if len(rows) == 1 else None
+        return self._users_by_name[full_name]
+
+    # (user_id, how) of the other account of a legacy transfer row; how is "leg", "name" or "name only"
+    def _counterparty(self, cursor, chunk, row, posted_at):
+        transaction_id, user_id, full_name, recipient_name, transaction_type, amount, timestamp, _ = row
+        if transaction_type == TRANSFER_OUT:
+            name, partner_id, partner_type = recipient_name, transaction_id + 1, TRANSFER_IN
+        else:
+            name, partner_id, partner_type = full_name, transaction_id - 1, TRANSFER_OUT
+
+        # Both legs of a transfer were written one after the other, with the same amount and
+        # timestamps microseconds apart
+        if posted_at is not None:
+            partner = chunk.get(partner_id)
+            if partner is not None:
+                partner_at = _seconds(partner[6])
+                if partner[4] == partner_type and to_minor(partner[5]) == to_minor(amount) and partner_at is not None and abs(partner_at - posted_at) < 1:
+                    return partner[1], "leg"
+            else:
+                # Whole seconds on both sides, so legs less than a second apart are at most one apart here
+                found = cursor.execute(
+                    "SELECT user_id FROM ledger WHERE transaction_id = ? AND type_code = ? AND amount_minor = ? AND ABS(posted_at - ?) <= 1",
+                    (partner_id, TYPE_CODES[partner_type], to_minor(amount), int(posted_at)),
+                ).fetchone()
+                if found is not None:
+                    return found[0], "leg"
+
+        if name:
+            user_id = self._user_by_name(cursor, name)
+            if user_id is not None:
+                return user_id, "name"
+        return name_only_counterparty(cursor, name or "Unknown"), "name only"
+
+    # posted_at for a row without a usable timestamp: that of the nearest dated row before it, else after it
+    def _undated_posted_at(self, cursor, transaction_id):
+        for comparison, order in (("<", "DESC"), (">", "ASC")):
+            found = cursor.execute(
+                f"SELECT posted_at FROM ledger WHERE transaction_id {comparison} ? AND posted_at IS NOT NULL ORDER BY transaction_id {order} LIMIT 1",
+                (transaction_id,),
+            ).fetchone()
+            if found is not None:
+                return found[0]
+        return 0
+
+    # Moves the oldest chunk_size legacy rows into postings; returns how many were moved
+    def step(self):
+        def move(conn):
+            if not self._legacy_exists(conn):
+                return 0
+            cursor = conn.cursor()
+            rows = cursor.execute(
+                "SELECT transaction_id, user_id, full_name, recipient_name, transaction_type, amount, timestamp, balance_after "
+                "FROM legacy_transactions ORDER BY transaction_id LIMIT ?",
+                (self.chunk_size,),
+            ).fetchall()
+            if not rows:
+                return 0
+
+            chunk = {row[0]: row for row in rows}
+            postings = []
+            fallbacks = {"leg": 0, "name": 0, "name only": 0, "undated": 0}
+            previous = None
+            for row in rows:
+                transaction_id, user_id, _, _, transaction_type, amount, timestamp, balance_after = row
+                seconds = _seconds(timestamp)
+                if seconds is None:
+                    fallbacks["undated"] += 1
+                    posted_at = previous if previous is not None else self._undated_posted_at(cursor, transaction_id)
+                else:
+                    posted_at = int(seconds)
+                previous = posted_at
+
+                counterparty_id = None
+                if transaction_type in (TRANSFER_OUT, TRANSFER_IN):
+                    counterparty_id, how = self._counterparty(cursor, chunk, row, seconds)
+                    fallbacks[how] += 1
+                postings.append((transaction_id,) + posting_row(user_id, counterparty_id, transaction_type, amount, posted_at, balance_after))
+
+            cursor.executemany(MIGRATED_INSERT, postings)
+            cursor.execute("DELETE FROM legacy_transactions WHERE transaction_id <= ?", (rows[-1][0],))
+            return len(rows), fallbacks
+
+        # Counted only once the chunk has committed, as the transaction may be retried
+        result = self.service.db.run(move)
+        if not result:
+            return 0
+        moved, fallbacks = result
+        self.migrated += moved
+        self.by_name += fallbacks["name"]
+        self.name_only += fallbacks["name only"]
+        self.undated += fallbacks["undated"]
+        return moved
+
+    # Drops the emptied legacy table and points the ledger view at postings alone
+    def finish(self):
+        def swap(conn):
+            if not self._legacy_exists(conn):
+                return False
+            if conn.execute("SELECT 1 FROM legacy_transactions LIMIT 1").fetchone():
+                return False
+            conn.execute("DROP VIEW IF EXISTS ledger")
+            conn.execute(LEDGER_VIEW)
+            conn.execute("DROP TABLE legacy_transactions")
+            return True
+
+        return self.service.db.run(swap)
+
+    # Migrates everything, pausing between chunks so postings from the live bank get the write lock
+    def run(self, progress=None):
+        while self.step():
+            if progress is not None:
+                progress(self.migrated)
+            if self.pause:
+                time.sleep(self.pause)
+        return self.finish()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move a pre-compact transactions table into the compact ledger, online.")
+    parser.add_argument("--db", default="users.db", help="database file (default: users.db)")
+    parser.add_argument("--chunk-size", type=int, default=5_000, help="rows moved per transaction (default: 5000)")
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to wait between chunks (default: 0)")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to return the freed pages to the file system")
+    args = parser.parse_args(argv)
+
+    service = BankService(args.db)
+    try:
+        migration = LedgerMigration(service, args.chunk_size, args.pause)
+        print(f"{migration.pending()} legacy row(s) to migrate.")
+        migration.run(lambda moved: print(f"  {moved} migrated", end="\r", flush=True))
+        # Ends the progress line so the summary does not run into it
+        if migration.migrated:
+            print()
+        print(f"Migrated {migration.migrated} row(s).")
+        if migration.by_name or migration.name_only:
+            print(f"{migration.by_name} transfer row(s) matched their counterparty by name only; {migration.name_only} kept as name-only counterparties.")
+        if migration.undated:
+            print(f"{migration.undated} row(s) had no readable timestamp and were dated from the rows next to them.")
+        if args.vacuum:
+            service.db.connection().execute("VACUUM")
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import argparse
+import csv
+import sys
+
+from .bulk import read_rows
+from .errors import ValidationError
+from .hashing import CredentialHasher
+from .service import BankService
+
+# Batch onboarding of applicants, for example customers migrated from a partner bank.
+#
+# Each record carries first_name, middle_name, last_name, username, email, password, pin and
+# initial_deposit, and goes through the same validation as BankService.sign_up. Per chunk:
+#   1. records are validated and duplicate usernames/emails inside the chunk are flagged;
+#   2. usernames and emails already in the database are found with one set-based query each;
+#   3. the remaining credentials are hashed in one call to the service's CredentialHasher, which
+#      spreads the KDF work over its process pool;
+#   4. account numbers are reserved as one block and the rows are inserted with executemany in one
+#      transaction, after re-checking the duplicates inside it.
+# Every record gets a result: created (with user_id and account_number), rejected (validation)
+# or conflict (username/email already taken).
+
+# SQLite caps the number of ? placeholders per statement
+LOOKUP_CHUNK = 500
+
+APPLICANT_FIELDS = ("first_name", "middle_name", "last_name", "username", "email", "password", "pin", "initial_deposit")
+
+
+class OnboardingReport:
+    def __init__(self):
+        self.created = 0
+        self.rejected = 0
+        self.conflicts = 0
+        self.results = []
+
+    def add(self, record, status, reason=None, user_id=None, account_number=None):
+        if status == "created":
+            self.created += 1
+        elif status == "conflict":
+            self.conflicts += 1
+        else:
+            self.rejected += 1
+        self.results.append({"record": record, "status": status, "reason": reason, "user_id": user_id, "account_number": account_number})
+
+    def write_csv(self, path):
+        with open(path, "w", newline="", encoding="utf-8") as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=["record", "status", "reason", "user_id", "account_number"])
+            writer.writeheader()
+            writer.writerows(self.results)
+
+
+class BatchOnboarder:
+    def __init__(self, service, chunk_size=1_000):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.service = service
+        self.chunk_size = chunk_size
+
+    # Onboards (record_id, applicant) pairs and returns an OnboardingReport
+    def onboard(self, applicants):
+        report = OnboardingReport()
+        chunk = []
+        for record, applicant in applicants:
+            chunk.append((record, applicant))
+            if len(chunk) >= self.chunk_size:
+                self._onboard_chunk(chunk, report)
+                chunk = []
+        if chunk:
+            self._onboard_chunk(chunk, report)
+        return report
+
+    def onboard_file(self, path):
+        return self.onboard(read_rows(path))
+
+    # Runs every sign_up rule and returns the normalised row, or raises ValidationError
+    def _validate(self, applicant):
+        if isinstance(applicant, ValidationError):
+            raise applicant
+        if not isinstance(applicant, dict):
+            raise ValidationError("record", "Record must be an object.")
+
+        missing = [field for field in APPLICANT_FIELDS if applicant.get(field) in (None, "")]
+        if missing:
+            raise ValidationError(missing[0], f"Missing field: {missing[0]}")
+
+        service = self.service
+        # CSV values arrive as text and JSONL numbers as int or float; a fraction such as 2500.75 is
+        # refused by validate_initial_deposit rather than cut down to 2500
+        initial_deposit = applicant["initial_deposit"]
+        if isinstance(initial_deposit, str):
+            try:
+                initial_deposit = int(initial_deposit)
+            except ValueError:
+                raise ValidationError("initial_deposit", "Initial deposit must be integers.") from None
+        elif isinstance(initial_deposit, float) and initial_deposit.is_integer():
+            initial_deposit = int(initial_deposit)
+
+        return {
+            "full_name": service.validate_full_name(str(applicant["first_name"]), str(applicant["middle_name"]), str(applicant["last_name"])),
+            "username": service.validate_username(str(applicant["username"])),
+            "email": service.validate_email(str(applicant["email"])),
+            "password": service.validate_password(str(applicant["password"])),
+            "pin": service.validate_pin(str(applicant["pin"])),
+            "initial_deposit": service.validate_initial_deposit(initial_deposit),
+        }
+
+    # Returns the subset of values already present in users.column
+    def _existing(self, conn, column, values):
+        found = set()
+        values = list(values)
+        for start in range(0, len(values), LOOKUP_CHUNK):
+            chunk = values[start:start + LOOKUP_CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+            found.update(row[0] for row in conn.execute(f"SELECT {column} FROM users WHERE {column} IN ({placeholders})", chunk))
+        return found
+
+    # Drops rows whose username or email is taken, reporting each as a conflict
+    def _drop_conflicts(self, conn, rows, report):
+        taken_usernames = self._existing(conn, "username", [row["username"] for _, row in rows])
+        taken_emails = self._existing(conn, "email", [row["email"] for _, row in rows])
+
+        clean = []
+        for record, row in rows:
+            if row["username"] in taken_usernames:
+                report.add(record, "conflict", "Username already exists.")
+            elif row["email"] in taken_emails:
+                report.add(record, "conflict", "Email already exists.")
+            else:
+                clean.append((record, row))
+        return clean
+
+    def _reserve_account_numbers(self, count):
+        allocator = self.service.account_numbers
+        numbers = allocator.reserve(count)
+        # Accounts opened before the allocator existed may hold some of these numbers
+        while True:
+            taken = self._existing(self.service.db.connection(), "account_number", numbers)
+            if not taken:
+                return numbers
+            numbers = [number for number in numbers if number not in taken] + allocator.reserve(len(taken))
+
+    def _onboard_chunk(self, chunk, report):
+        rows = []
+        seen_usernames = set()
+        seen_emails = set()
+        for record, applicant in chunk:
+            try:
+                row = self._validate(applicant)
+            except ValidationError as exc:
+                report.add(record, "rejected", str(exc))
+                continue
+
+            if row["username"] in seen_usernames:
+                report.add(record, "conflict", "Username appears more than once in the batch.")
+                continue
+            if row["email"] in seen_emails:
+                report.add(record, "conflict", "Email appears more than once in the batch.")
+                continue
+            seen_usernames.add(row["username"])
+            seen_emails.add(row["email"])
+            rows.append((record, row))
+
+        # Cheap pre-check so no hashing is spent on records that are bound to conflict
+        rows = self._drop_conflicts(self.service.db.connection(), rows, report)
+        if not rows:
+            return
+
+        secrets = [secret for _, row in rows for secret in (row["password"], row["pin"])]
+        hashed = self.service.hasher.hash_many(secrets)
+        hashes = list(zip(hashed[0::2], hashed[1::2]))
+
+        account_numbers = self._reserve_account_numbers(len(rows))
+
+        def insert(conn):
+            # Another writer may have taken a username or email since the pre-check
+            conflicts = OnboardingReport()
+            clean = self._drop_conflicts(conn, rows, conflicts)
+            clean_records = {record for record, _ in clean}
+
+            values = []
+            created = []
+            for (record, row), (hashed_password, hashed_pin), account_number in zip(rows, hashes, account_numbers):
+                if record not in clean_records:
+                    continue
+                values.append((row["full_name"], row["username"], row["email"], hashed_password, hashed_pin, row["initial_deposit"], account_number, row["initial_deposit"] * 100))
+                created.append((record, row["username"], account_number))
+
+            conn.executemany("INSERT INTO users (full_name, username, email, password, pin, initial_deposit, account_number, balance_minor) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", values)
+
+            user_ids = {}
+            usernames = [username for _, username, _ in created]
+            for start in range(0, len(usernames), LOOKUP_CHUNK):
+                part = usernames[start:start + LOOKUP_CHUNK]
+                user_ids.update(conn.execute(f"SELECT username, user_id FROM users WHERE username IN ({', '.join('?' * len(part))})", part))
+            return conflicts, [(record, user_ids[username], account_number) for record, username, account_number in created]
+
+        conflicts, created = self.service.db.run(insert)
+        for result in conflicts.results:
+            report.add(result["record"], result["status"], result["reason"])
+        for record, user_id, account_number in created:
+            report.add(record, "created", user_id=user_id, account_number=account_number)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open accounts for a file of applicants (CSV with header or JSONL).")
+    parser.add_argument("path", help="applicants file with " + ", ".join(APPLICANT_FIELDS))
+    parser.add_argument("--db", default="users.db", help="database file (default: users.db)")
+    parser.add_argument("--chunk-size", type=int, default=1_000, help="applicants per transaction (default: 1000)")
+    parser.add_argument("--hash-workers", type=int, default=None, help="processes used to hash credentials (default: one per core)")
+    parser.add_argument("--report", help="write the per-record results to this CSV file")
+    args = parser.parse_args(argv)
+
+    service = BankService(args.db, hasher=CredentialHasher(workers=args.hash_workers))
+    try:
+        report = BatchOnboarder(service, args.chunk_size).onboard_file(args.path)
+    finally:
+        service.close()
+
+    if args.report:
+        report.write_csv(args.report)
+    print(f"Created: {report.created}  Conflicts: {report.conflicts}  Rejected: {report.rejected}")
+    return 0 if report.rejected == 0 and report.conflicts == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import argparse
+import csv
+import datetime
+import os
+import sqlite3
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .errors import TooManyArchivesError
+from .service import BankService, CREDIT_TYPE_CODES, attach_limit
+
+# Balance reconciliation: every account's users.balance must equal its initial_deposit plus the
+# signed sum of its ledger rows (credits add, debits subtract).
+#
+# Sums are kept per account, in kobo, in reconciliation_state, and every run records the highest
+# transaction_id it covered in reconciliation_runs. The next run only reads transactions after that
+# checkpoint and adds them to the stored sums, so a nightly run costs the day's transactions plus
+# one pass over users, not the whole history.
+#
+# Accounts are split into user_id ranges and each range is checked by a worker process in its own
+# read transaction. Postings may land while a run is going on, so each worker also adds the rows
+# committed after the run's high-water mark that its own snapshot can see; the balance it compares
+# against comes from that same snapshot, so in-flight postings never show up as false mismatches.
+# Workers attach the archive files (hivebank.archive) too, so archived rows still count.
+# Both tables are created by hivebank.schema.
+
+SIGNED_MINOR = f"CASE WHEN type_code IN {CREDIT_TYPE_CODES} THEN amount_minor ELSE -amount_minor END"
+
+
+# Signed sums per account of the rows with after < transaction_id <= up_to, in the ledger and the
+# attached archive schemas; a row archived but not yet deleted from postings is counted once
+def _sums(conn, low, high, after, up_to=None, schemas=()):
+    condition = "transaction_id > ? AND user_id BETWEEN ? AND ?"
+    params = [after, low, high]
+    if up_to is not None:
+        condition += " AND transaction_id <= ?"
+        params.append(up_to)
+
+    sums = {}
+    queries = [f"SELECT user_id, SUM({SIGNED_MINOR}) FROM ledger WHERE {condition} GROUP BY user_id"]
+    queries += [
+        f"SELECT user_id, SUM({SIGNED_MINOR}) FROM {schema}.ledger "
+        f"WHERE {condition} AND transaction_id NOT IN (SELECT transaction_id FROM main.postings) GROUP BY user_id"
+        for schema in schemas
+    ]
+    for sql in queries:
+        for user_id, total in conn.execute(sql, params):
+            sums[user_id] = sums.get(user_id, 0) + total
+    return sums
+
+
+# Runs in the worker processes: checks the accounts with low <= user_id <= high.
+# archives is a list of (schema, path) for the archive files (hivebank.archive) to read as well.
+# Returns (accounts checked, new ledger sums to store, mismatches).
+def _reconcile_range(path, low, high, checkpoint, high_water, archives=()):
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        for schema, archive_path in archives:
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (archive_path,))
+        schemas = [schema for schema, _ in archives]
+        conn.execute("BEGIN")
+        stored = {}
+        if checkpoint:
+            stored = dict(conn.execute("SELECT user_id, ledger_minor FROM reconciliation_state WHERE user_id BETWEEN ? AND ?", (low, high)))
+        new = _sums(conn, low, high, checkpoint, high_water, schemas)
+        # Rows committed after the run started, visible to this snapshot's balances
+        tail = _sums(conn, low, high, high_water, schemas=schemas)
+
+        checked = 0
+        updates = []
+        mismatches = []
+        rows = conn.execute("SELECT user_id, account_number, initial_deposit, balance_minor FROM users WHERE user_id BETWEEN ? AND ?", (low, high))
+        for user_id, account_number, initial_deposit, actual in rows:
+            checked += 1
+            ledger = stored.get(user_id, 0) + new.get(user_id, 0)
+            if user_id in new or user_id not in stored:
+                updates.append((user_id, ledger))
+
+            expected = initial_deposit * 100 + ledger + tail.get(user_id, 0)
+            if actual != expected:
+                mismatches.append({
+                    "user_id": user_id,
+                    "account_number": account_number,
+                    "balance": actual / 100,
+                    "expected": expected / 100,
+                    "difference": (actual - expected) / 100,
+                })
+        conn.execute("COMMIT")
+        return checked, updates, mismatches
+    finally:
+        conn.close()
+
+
+class ReconciliationReport:
+    def __init__(self, checkpoint, last_transaction_id):
+        self.checkpoint = checkpoint
+        self.last_transaction_id = last_transaction_id
+        self.accounts = 0
+        self.mismatches = []
+
+    def write_csv(self, path):
+        with open(path, "w", newline="", encoding="utf-8") as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=["user_id", "account_number", "balance", "expected", "difference"])
+            writer.writeheader()
+            writer.writerows(self.mismatches)
+
+
+class Reconciler:
+    # workers=None uses one process per core, workers=0 checks every range in this process
+    def __init__(self, service, workers=None, partitions=None):
+        self.service = service
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.partitions = partitions or max(1, self.workers) * 4
+
+    def checkpoint(self):
+        row = self.service.db.connection().execute("SELECT last_transaction_id FROM reconciliation_runs ORDER BY run_id DESC LIMIT 1").fetchone()
+        return row[0] if row else 0
+
+    # Splits the user_id space into up to self.partitions ranges with about the same number of accounts
+    def _ranges(self):
+        conn = self.service.db.connection()
+        count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        if not count:
+            return []
+        size = -(-count // self.partitions)
+        bounds = [row[0] for row in conn.execute("SELECT user_id FROM (SELECT user_id, ROW_NUMBER() OVER (ORDER BY user_id) - 1 AS position FROM users) WHERE position % ? = 0", (size,))]
+        highest = conn.execute("SELECT MAX(user_id) FROM users").fetchone()[0]
+        return [(low, (bounds[index + 1] - 1) if index + 1 < len(bounds) else highest) for index, low in enumerate(bounds)]
+
+    # Checks every account; full=True ignores the checkpoint and rebuilds the stored sums from scratch
+    def run(self, full=False):
+        db = self.service.db
+        checkpoint = 0 if full else self.checkpoint()
+        # The hot table may have been emptied by the archiver, so the highest id ever handed out comes
+        # from sqlite_sequence; the ledger's MAX covers rows still in legacy_transactions
+        high_water = max(checkpoint, db.connection().execute(
+            "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'postings'), 0), COALESCE((SELECT MAX(transaction_id) FROM ledger), 0))"
+        ).fetchone()[0])
+        report = ReconciliationReport(checkpoint, high_water)
+
+        # Rows after the checkpoint may have been archived since the last run, so every archive is
+        # read; past the checkpoint that is one primary key seek per file. They are read in the same
+        # snapshot as the balances, so they must all be attached at once.
+        archives = [(name, self.service.archive_path(path)) for name, path in db.connection().execute("SELECT name, path FROM archives")]
+        if len(archives) > attach_limit(db.connection()):
+            raise TooManyArchivesError(len(archives), attach_limit(db.connection()))
+        jobs = [(self.service.users_db, low, high, checkpoint, high_water, archives) for low, high in self._ranges()]
+        if self.workers and len(jobs) > 1:
+            with ProcessPoolExecutor(min(self.workers, len(jobs))) as pool:
+                results = list(pool.map(_reconcile_range, *zip(*jobs)))
+        else:
+            results = [_reconcile_range(*job) for job in jobs]
+
+        updates = []
+        for checked, range_updates, mismatches in results:
+            report.accounts += checked
+            updates += range_updates
+            report.mismatches += mismatches
+
+        # The stored sums and the checkpoint move together, so a failed run is simply run again
+        def save(conn):
+            if not checkpoint:
+                conn.execute("DELETE FROM reconciliation_state")
+            conn.executemany("INSERT INTO reconciliation_state (user_id, ledger_minor) VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET ledger_minor = excluded.ledger_minor", updates)
+            conn.execute(
+                "INSERT INTO reconciliation_runs (finished_at, last_transaction_id, accounts, mismatches) VALUES (?, ?, ?, ?)",
+                (datetime.datetime.now().isoformat(), high_water, report.accounts, len(report.mismatches)),
+            )
+
+        db.run(save)
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check every account balance against its transactions.")
+    parser.add_argument("--db", default="users.db", help="database file (default: users.db)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core, 0 runs inline)")
+    parser.add_argument("--partitions", type=int, default=None, help="user_id ranges to split the accounts into (default: 4 per worker)")
+    parser.add_argument("--full", action="store_true", help="ignore the checkpoint and re-read the whole history")
+    parser.add_argument("--report", help="write mismatched accounts to this CSV file")
+    args = parser.parse_args(argv)
+
+    service = BankService(args.db)
+    try:
+        report = Reconciler(service, args.workers, args.partitions).run(full=args.full)
+    except TooManyArchivesError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    finally:
+        service.close()
+
+    if args.report:
+        report.write_csv(args.report)
+    print(f"Accounts: {report.accounts}  Transactions {report.checkpoint + 1}-{report.last_transaction_id}  Mismatches: {len(report.mismatches)}")
+    for mismatch in report.mismatches[:20]:
+        print(f"  {mismatch['account_number']}: balance {mismatch['balance']:,.2f}, ledger says {mismatch['expected']:,.2f}")
+    return 0 if not report.mismatches else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+import sys
+
+from .db import ConnectionManager
+from .service import LEDGER_VIEW, LEGACY_LEDGER_VIEW, is_credit
+
+# Versioned schema migrations.
+#
+# The schema version of a database is its PRAGMA user_version, a field of the file header that
+# SQLite reads without touching any table. Opening a database whose version is SCHEMA_VERSION does
+# nothing else, so start-up costs the same with ten accounts or ten million. An older database is
+# brought up to date by running the missing MIGRATIONS, in order, in one IMMEDIATE transaction that
+# also stores the new version; a process that opens the file at the same time waits for the lock,
+# sees the new version and runs nothing.
+#
+# Migration n (1-based) is MIGRATIONS[n - 1] and takes a cursor inside that transaction. Migrations
+# are append-only: add a function for a schema change, never edit one that has shipped. Databases
+# created before user_version was used are at version 0, in whatever shape the code of their day
+# left them, so migration 1 checks before it changes anything.
+#
+#   python -m hivebank.schema --db users.db
+
+
+# Everything up to the compact ledger, for new databases and unversioned ones of any age
+def _baseline(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        full_name TEXT NOT NULL CHECK (full_name <> ''),
+        username TEXT NOT NULL UNIQUE CHECK (username <> ''),
+        email TEXT NOT NULL UNIQUE CHECK (email <> ''),
+        password TEXT NOT NULL CHECK (password <> ''),
+        pin TEXT NOT NULL,
+        initial_deposit INTEGER NOT NULL CHECK (initial_deposit >= 2000),
+        account_number TEXT NOT NULL UNIQUE,
+        balance REAL NOT NULL DEFAULT 0
+        );
+    """)
+
+    # Before the compact ledger, transactions held names, type strings, REAL amounts and ISO
+    # timestamps. Such a table is renamed to legacy_transactions (instant) and hivebank.migrate_ledger
+    # moves its rows into postings in chunks while the bank stays online.
+    legacy = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transactions'").fetchone()
+    if legacy:
+        # balance_after is the account's balance right after the row was posted
+        columns = [column[1] for column in cursor.execute("PRAGMA table_info(transactions)")]
+        if "balance_after" not in columns:
+            cursor.execute("ALTER TABLE transactions ADD COLUMN balance_after REAL")
+            _backfill_balance_after(cursor)
+        cursor.execute("ALTER TABLE transactions RENAME TO legacy_transactions")
+
+    # The ledger: one row per posting, all integers. counterparty_id is the other account of a
+    # transfer, a user_id in users or, for accounts held elsewhere, in external_accounts. Names
+    # are joined in only when rows are displayed.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS postings (
+        transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(user_id),
+        counterparty_id INTEGER,
+        type_code INTEGER NOT NULL,
+        amount_minor INTEGER NOT NULL CHECK (amount_minor > 0),
+        posted_at INTEGER NOT NULL,
+        balance_after_minor INTEGER NOT NULL
+        );
+    """)
+
+    # History pages walk this index backwards, so a page never scans or sorts other users' rows
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_postings_user_posted ON postings (user_id, posted_at, transaction_id)")
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS external_accounts (
+        user_id INTEGER PRIMARY KEY,
+        full_name TEXT NOT NULL
+        );
+    """)
+
+    if legacy:
+        # New postings continue after the legacy ids, so migrated rows keep theirs
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'postings', seq FROM sqlite_sequence WHERE name = 'legacy_transactions'")
+        cursor.execute("DROP VIEW IF EXISTS ledger")
+    if not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'ledger'").fetchone():
+        migrating = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'legacy_transactions'").fetchone()
+        cursor.execute(LEGACY_LEDGER_VIEW if migrating else LEDGER_VIEW)
+
+    # End-of-day balances per account, taken by hivebank.ledger.take_snapshots
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS balance_snapshots (
+        user_id INTEGER NOT NULL,
+        snapshot_date TEXT NOT NULL,
+        balance REAL NOT NULL,
+        transaction_id INTEGER,
+        PRIMARY KEY (user_id, snapshot_date)
+        ) WITHOUT ROWID;
+    """)
+
+    # Accounts opened before balance was written at sign-up start from their initial deposit.
+    # Sign-up has set it since, so this scan only ever runs once per database.
+    cursor.execute("UPDATE users SET balance = initial_deposit WHERE balance = 0")
+
+
+# Replays every account's history once to fill balance_after on rows written before the column existed
+def _backfill_balance_after(cursor):
+    balances = dict(cursor.execute("SELECT user_id, initial_deposit FROM users").fetchall())
+    updates = []
+    rows = cursor.connection.cursor().execute("SELECT transaction_id, user_id, transaction_type, amount FROM transactions ORDER BY user_id, timestamp, transaction_id")
+    for transaction_id, user_id, trans_type, amount in rows:
+        balance = balances.get(user_id, 0) + (amount if is_credit(trans_type) else -amount)
+        balances[user_id] = balance
+        updates.append((balance, transaction_id))
+        if len(updates) >= 10_000:
+            cursor.executemany("UPDATE transactions SET balance_after = ? WHERE transaction_id = ?", updates)
+            updates = []
+    cursor.executemany("UPDATE transactions SET balance_after = ? WHERE transaction_id = ?", updates)
+
+
+# Archive files written by hivebank.archive; every row below archived_until may have moved there
+def _archives(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS archives (
+        name TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        period_start INTEGER NOT NULL,
+        period_end INTEGER NOT NULL,
+        archived_until INTEGER NOT NULL
+        );
+    """)
+
+
+# Failed login and PIN attempts kept by hivebank.throttle.LoginThrottle across restarts
+def _login_throttle(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS login_throttle (
+        key TEXT PRIMARY KEY,
+        failures INTEGER NOT NULL,
+        lockouts INTEGER NOT NULL,
+        locked_until REAL NOT NULL
+        ) WITHOUT ROWID;
+    """)
+
+
+# Where a hivebank.journal.Replica has read its journal up to; one row, written only on replicas
+def _journal_position(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS journal_position (
+        journal_offset INTEGER NOT NULL,
+        users_mark INTEGER NOT NULL,
+        postings_mark INTEGER NOT NULL
+        );
+    """)
+
+
+# Balances in integer kobo, like the ledger. A REAL balance drifts (0.1 + 0.2 + ... leaves
+# 1999.9999999999998), so a debit of the balance shown could be refused. Every posting now updates
+# and compares balance_minor; balance stays readable as a column computed from it, and writing it
+# fails loudly instead of leaving the two apart.
+def _balance_minor(cursor):
+    cursor.execute("ALTER TABLE users ADD COLUMN balance_minor INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("UPDATE users SET balance_minor = CAST(ROUND(balance * 100) AS INTEGER)")
+    cursor.execute("ALTER TABLE users DROP COLUMN balance")
+    cursor.execute("ALTER TABLE users ADD COLUMN balance REAL GENERATED ALWAYS AS (balance_minor / 100.0) VIRTUAL")
+
+
+# Per-account ledger sums and the run history of hivebank.reconcile, which used to create them itself
+def _reconciliation(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS reconciliation_state (
+        user_id INTEGER PRIMARY KEY,
+        ledger_minor INTEGER NOT NULL
+        );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS reconciliation_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        finished_at TEXT NOT NULL,
+        last_transaction_id INTEGER NOT NULL,
+        accounts INTEGER NOT NULL,
+        mismatches INTEGER NOT NULL
+        );
+    """)
+
+
+# Counter, permutation key and check digit setting of hivebank.accounts.AccountNumberAllocator.
+# Databases it has already numbered accounts in have the table; their row is kept.
+def _account_number_sequence(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS account_number_sequence (
+        name TEXT PRIMARY KEY,
+        next_value INTEGER NOT NULL,
+        key BLOB NOT NULL,
+        check_digit INTEGER NOT NULL
+        );
+    """)
+
+
+# Cross-shard transfers of hivebank.sharding. Every database gets them, and outside a sharded bank
+# they stay empty.
+def _transfer_outbox(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS transfer_outbox (
+        outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        target_shard INTEGER NOT NULL,
+        recipient_user_id INTEGER NOT NULL,
+        sender_user_id INTEGER,
+        sender_name TEXT NOT NULL,
+        recipient_name TEXT NOT NULL,
+        amount REAL NOT NULL CHECK (amount > 0),
+        timestamp TEXT NOT NULL
+        );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS transfer_inbox (
+        source_shard INTEGER NOT NULL,
+        outbox_id INTEGER NOT NULL,
+        PRIMARY KEY (source_shard, outbox_id)
+        ) WITHOUT ROWID;
+    """)
+    # Outboxes created before the compact ledger lack the sender's user_id; their pending rows
+    # keep NULL and are credited with a name-only counterparty
+    columns = [column[1] for column in cursor.execute("PRAGMA table_info(transfer_outbox)")]
+    if "sender_user_id" not in columns:
+        cursor.execute("ALTER TABLE transfer_outbox ADD COLUMN sender_user_id INTEGER")
+
+
+MIGRATIONS = [
+    _baseline,
+    _archives,
+    _login_throttle,
+    _journal_position,
+    _balance_minor,
+    _reconciliation,
+    _account_number_sequence,
+    _transfer_outbox,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+# The catalog.db of a sharded bank: its shard count, and usernames, emails and account numbers
+# across every shard. user_id stays NULL until the account row exists on its shard.
+def _catalog(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS shard_settings (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS directory (
+        directory_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        email TEXT NOT NULL UNIQUE,
+        account_number TEXT NOT NULL UNIQUE,
+        user_id INTEGER UNIQUE,
+        claimed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+
+# The catalog has a schema of its own, versioned the same way
+CATALOG_MIGRATIONS = [
+    _catalog,
+    _account_number_sequence,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Runs the migrations db is missing and returns how many ran; a current database is one header read.
+# migrations is MIGRATIONS for bank databases and CATALOG_MIGRATIONS for a sharded bank's catalog.
+def migrate(db, migrations=MIGRATIONS):
+    latest = len(migrations)
+    version = schema_version(db.connection())
+    if version == latest:
+        return 0
+    if version > latest:
+        raise RuntimeError(f"{db.path} has schema version {version}; this hivebank only knows up to {latest}.")
+
+    def upgrade(conn):
+        # Another process may have migrated while this one waited for the lock
+        current = schema_version(conn)
+        cursor = conn.cursor()
+        for number in range(current + 1, latest + 1):
+            migrations[number - 1](cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+        return max(latest - current, 0)
+
+    return db.run(upgrade)
+
+
+def main(argv=None):
+    # Imported here rather than at the top: BankService imports this module on every start-up
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bring a database up to the current schema version.")
+    parser.add_argument("--db", default="users.db", help="database file (default: users.db)")
+    args = parser.parse_args(argv)
+
+    db = ConnectionManager(args.db)
+    try:
+        before = schema_version(db.connection())
+        ran = migrate(db)
+    except RuntimeError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    print(f"{args.db}: schema version {before + ran} (ran {ran} migration(s)).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
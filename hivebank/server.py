@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import AccountCache
+from .db import ConnectionManager
+from .errors import BankError, ValidationError, InsufficientFundsError, DuplicateUserError, LimitExceededError, ThrottledError
+from .group_commit import GroupCommitWriter
+from .journal import Journal
+from .limits import TransactionLimits
+from .metrics import Metrics
+from .service import BankService, DEFAULT_PAGE_SIZE, TYPE_CODES
+from .sharding import ShardedBankService
+from .throttle import LoginThrottle
+
+# Asyncio network front-end for BankService: a JSON line protocol over TCP.
+#
+# Each request is one JSON object per line and gets exactly one JSON line back:
+#   -> {"id": 1, "op": "log_in", "username_or_email": "ada", "password": "..."}
+#   <- {"id": 1, "ok": true, "result": {"user_id": 7}}
+#   -> {"id": 2, "op": "withdrawal", "amount": 500, "pin": "1234"}
+#   <- {"id": 2, "ok": false, "error": "InsufficientFundsError", "message": "Insufficient funds.", "balance": 120.0}
+#
+# Every connection has its own session (the logged in user). All SQLite and hashing work runs on a
+# bounded thread pool, and a semaphore caps how many requests may wait for it, so one slow client or
+# a burst of logins cannot starve the event loop that serves everyone else.
+
+logger = logging.getLogger("hivebank.server")
+
+MAX_LINE_BYTES = 64 * 1024
+
+
+class Session:
+    def __init__(self, peer):
+        self.peer = peer
+        self.user_id = None
+        # Failed logins and PINs are throttled per client address as well as per account
+        self.source = peer[0] if isinstance(peer, tuple) else None
+
+
+class BankServer:
+    # Pass writer (a GroupCommitWriter) to send deposits, withdrawals and transfers through group commit
+    def __init__(self, service, workers=16, max_pending=1_024, writer=None):
+        self.service = service
+        self.writer = writer
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hivebank")
+        self._pending = asyncio.Semaphore(max_pending)
+        self._server = None
+
+        # op name -> (handler, needs a logged in session)
+        self.operations = {
+            "ping": (self._ping, False),
+            "sign_up": (self._sign_up, False),
+            "log_in": (self._log_in, False),
+            "log_out": (self._log_out, False),
+            "deposit": (self._deposit, True),
+            "withdrawal": (self._withdrawal, True),
+            "transfer": (self._transfer, True),
+            "details": (self._details, True),
+            "history": (self._history, True),
+        }
+
+    async def start(self, host="127.0.0.1", port=8750):
+        self._server = await asyncio.start_server(self._handle_connection, host, port, limit=MAX_LINE_BYTES)
+        return self._server
+
+    async def serve_forever(self, host="127.0.0.1", port=8750):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        self.executor.shutdown(wait=True)
+
+    # Runs a blocking BankService call on the executor
+    async def _call(self, function, *args):
+        async with self._pending:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    # Runs a posting through the group commit writer when there is one, else like _call
+    async def _post(self, name, *args):
+        if self.writer is None:
+            return await self._call(getattr(self.service, name), *args)
+        async with self._pending:
+            return await asyncio.wrap_future(getattr(self.writer, f"submit_{name}")(*args))
+
+    async def _handle_connection(self, reader, writer):
+        session = Session(writer.get_extra_info("peername"))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Line longer than MAX_LINE_BYTES
+                    await self._send(writer, {"ok": False, "error": "ProtocolError", "message": "Request too long."})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                await self._send(writer, await self._dispatch(session, line))
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, response):
+        writer.write(json.dumps(response).encode() + b"\n")
+        await writer.drain()
+
+    async def _dispatch(self, session, line):
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError:
+            return {"ok": False, "error": "ProtocolError", "message": "Request is not valid JSON."}
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "ProtocolError", "message": "Request must be a JSON object."}
+
+        response = {"id": request.get("id")}
+        operation = self.operations.get(request.get("op"))
+        if operation is None:
+            response.update(ok=False, error="ProtocolError", message=f"Unknown op: {request.get('op')!r}")
+            return response
+
+        handler, needs_login = operation
+        if needs_login and session.user_id is None:
+            response.update(ok=False, error="AuthenticationError", message="Please log in first.")
+            return response
+
+        try:
+            result = await handler(session, request)
+        except BankError as exc:
+            response.update(ok=False, error=type(exc).__name__, message=str(exc))
+            if isinstance(exc, ValidationError):
+                response["field"] = exc.field
+            elif isinstance(exc, InsufficientFundsError):
+                response["balance"] = exc.balance
+            elif isinstance(exc, DuplicateUserError):
+                response["field"] = exc.field
+            elif isinstance(exc, LimitExceededError):
+                response["limit"] = exc.limit
+                response["available"] = exc.available
+            elif isinstance(exc, ThrottledError):
+                response["retry_after"] = round(exc.retry_after, 3)
+        except Exception:
+            logger.exception("Request %r from %s failed", request.get("op"), session.peer)
+            response.update(ok=False, error="InternalError", message="Something went wrong.")
+        else:
+            response.update(ok=True, result=result)
+        return response
+
+    # ------------------------------------------------------------------ operations
+
+    def _param(self, request, name, kind=str):
+        value = request.get(name)
+        if value is None:
+            raise ValidationError(name, f"Missing field: {name}")
+        if kind is float:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValidationError(name, "Please, enter a valid number.")
+        elif not isinstance(value, kind):
+            raise ValidationError(name, f"Invalid {name}.")
+        return value
+
+    async def _ping(self, session, request):
+        return "pong"
+
+    async def _sign_up(self, session, request):
+        fields = ("first_name", "middle_name", "last_name", "username", "email", "password", "pin")
+        args = [self._param(request, field) for field in fields]
+        args.append(self._param(request, "initial_deposit", int))
+        return await self._call(self.service.sign_up, *args)
+
+    async def _log_in(self, session, request):
+        user_id = await self._call(self.service.log_in, self._param(request, "username_or_email"), self._param(request, "password"), session.source)
+        session.user_id = user_id
+        return {"user_id": user_id}
+
+    async def _log_out(self, session, request):
+        session.user_id = None
+        return None
+
+    async def _deposit(self, session, request):
+        balance = await self._post("deposit", session.user_id, self._param(request, "amount", float))
+        return {"balance": balance}
+
+    async def _withdrawal(self, session, request):
+        amount = self._param(request, "amount", float)
+        await self._call(self.service.verify_pin, session.user_id, self._param(request, "pin"), session.source)
+        balance = await self._post("withdrawal", session.user_id, amount)
+        return {"balance": balance}
+
+    async def _transfer(self, session, request):
+        recipient_account = self._param(request, "recipient_account")
+        amount = self._param(request, "amount", float)
+        await self._call(self.service.verify_pin, session.user_id, self._param(request, "pin"), session.source)
+        return await self._post("transfer", session.user_id, recipient_account, amount)
+
+    async def _details(self, session, request):
+        return await self._call(self.service.account_details, session.user_id)
+
+    async def _history(self, session, request):
+        limit = DEFAULT_PAGE_SIZE if request.get("limit") is None else self._param(request, "limit", int)
+        transaction_types = None
+        if request.get("transaction_types") is not None:
+            transaction_types = self._param(request, "transaction_types", list)
+            if not all(isinstance(name, str) and name in TYPE_CODES for name in transaction_types):
+                raise ValidationError("transaction_types", f"transaction_types must be a list of {', '.join(TYPE_CODES)}.")
+        return await self._call(
+            self.service.transaction_page,
+            session.user_id,
+            limit,
+            request.get("cursor"),
+            request.get("from_date"),
+            request.get("to_date"),
+            transaction_types,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve HiveBank over a JSON line protocol on TCP.")
+    parser.add_argument("--db", default="users.db", help="database file, or directory with --shards (default: users.db)")
+    parser.add_argument("--shards", type=int, help="serve a sharded bank with this many shard files in the --db directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8750)
+    parser.add_argument("--workers", type=int, default=16, help="threads running database work (default: 16)")
+    parser.add_argument("--max-pending", type=int, default=1_024, help="requests allowed to queue for a worker (default: 1024)")
+    parser.add_argument("--cache-size", type=int, default=0, help="accounts kept in the in-memory account cache (default: 0, off)")
+    parser.add_argument("--group-commit", action="store_true", help="commit postings in groups from one writer thread (single database only)")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port (/metrics and /metrics.json)")
+    parser.add_argument("--lockout-after", type=int, default=3, help="failed logins or PINs in a row that lock an account (default: 3, 0 turns throttling off)")
+    parser.add_argument("--lockout-seconds", type=float, default=60.0, help="first lockout, doubling with each further one (default: 60)")
+    parser.add_argument("--journal", help="append every account and posting to this journal file (hivebank.journal; single database only)")
+    parser.add_argument("--no-limits", action="store_true", help="do not enforce the default withdrawal and transfer limits (hivebank.limits)")
+    args = parser.parse_args(argv)
+    if args.group_commit and args.shards:
+        parser.error("--group-commit cannot be combined with --shards")
+    if args.journal and args.shards:
+        parser.error("--journal cannot be combined with --shards")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    metrics = None
+    if args.metrics_port is not None:
+        metrics = Metrics()
+        metrics.serve(args.host, args.metrics_port)
+        logger.info("Metrics on http://%s:%s/metrics", args.host, args.metrics_port)
+    throttle = None
+    limits = None if args.no_limits else TransactionLimits()
+    if args.shards:
+        if args.lockout_after > 0:
+            throttle = LoginThrottle(args.lockout_after, args.lockout_seconds)
+        service = ShardedBankService(args.db, args.shards, metrics=metrics, throttle=throttle, limits=limits)
+    else:
+        cache = AccountCache(args.cache_size) if args.cache_size > 0 else None
+        db = ConnectionManager(args.db, metrics=metrics)
+        # Lockouts are stored in the database, so restarting the server does not lift them
+        if args.lockout_after > 0:
+            throttle = LoginThrottle(args.lockout_after, args.lockout_seconds, db=db)
+        journal = Journal(args.journal) if args.journal else None
+        service = BankService(args.db, db=db, metrics=metrics, cache=cache, throttle=throttle, limits=limits, journal=journal)
+
+    writer = GroupCommitWriter(service) if args.group_commit else None
+
+    async def serve():
+        server = BankServer(service, args.workers, args.max_pending, writer)
+        try:
+            logger.info("Serving on %s:%s", args.host, args.port)
+            await server.serve_forever(args.host, args.port)
+        finally:
+            server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if writer is not None:
+            writer.close()
+        service.close()
+        if metrics is not None:
+            metrics.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
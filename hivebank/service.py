@@ -0,0 +1,719 @@
+import os
+import sqlite3
+import re
+import math
+import logging
+import datetime
+
+from .accounts import AccountNumberAllocator
+from .db import ConnectionManager
+from .hashing import CredentialHasher
+from .journal import JournalError
+from .metrics import timed
+from .errors import (
+    ValidationError,
+    AuthenticationError,
+    UserNotFoundError,
+    RecipientNotFoundError,
+    InvalidPinError,
+    InsufficientFundsError,
+    DuplicateUserError,
+    TooManyArchivesError,
+)
+
+logger = logging.getLogger("hivebank.service")
+
+# Validation patterns are compiled once and shared by every caller
+NAME_PATTERN = re.compile(r"^[A-Za-z]+(?:[-'][A-Za-z]+)*$")
+USERNAME_PATTERN = re.compile(r"^(?=.{3,20}$)[A-Za-z][A-Za-z0-9]*$")
+EMAIL_PATTERN = re.compile(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}")
+PASSWORD_PATTERN = re.compile(r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,32}$")
+
+MINIMUM_INITIAL_DEPOSIT = 2000
+
+# Largest single amount, so balances in kobo stay far inside SQLite's 64-bit INTEGER and every
+# amount is exact as a float (below 2**53 kobo)
+MAXIMUM_AMOUNT = 1_000_000_000
+
+# transaction_type values shown in history and statements; the ledger stores them as TYPE_CODES
+DEPOSIT = "CR-Deposit"
+WITHDRAWAL = "DR-Withdrawal"
+TRANSFER_OUT = "DR-Transfer To"
+TRANSFER_IN = "CR-Transfer From"
+
+# Compact ledger encoding of the transaction types; credits are the codes in CREDIT_TYPE_CODES
+TYPE_CODES = {DEPOSIT: 1, WITHDRAWAL: 2, TRANSFER_OUT: 3, TRANSFER_IN: 4}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+CREDIT_TYPE_CODES = (TYPE_CODES[DEPOSIT], TYPE_CODES[TRANSFER_IN])
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 500
+
+# Timestamps are stored as whole seconds since 1970-01-01 of the local wall-clock time
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# The ledger is the postings table, plus, while hivebank.migrate_ledger is still moving them across,
+# the rows of a pre-compact database in legacy_transactions converted on the fly. Readers always
+# query ledger, so they see every row exactly once during and after the migration.
+LEDGER_VIEW = """
+    CREATE VIEW ledger AS
+    SELECT transaction_id, user_id, counterparty_id, NULL AS counterparty_name, type_code, amount_minor, posted_at, balance_after_minor
+    FROM postings
+"""
+
+LEGACY_LEDGER_VIEW = LEDGER_VIEW + """
+    UNION ALL
+    SELECT transaction_id, user_id, NULL,
+           CASE transaction_type WHEN 'DR-Transfer To' THEN recipient_name WHEN 'CR-Transfer From' THEN full_name END,
+           CASE transaction_type WHEN 'CR-Deposit' THEN 1 WHEN 'DR-Withdrawal' THEN 2 WHEN 'DR-Transfer To' THEN 3 WHEN 'CR-Transfer From' THEN 4 ELSE 0 END,
+           CAST(ROUND(amount * 100) AS INTEGER), CAST(strftime('%s', timestamp) AS INTEGER), CAST(ROUND(balance_after * 100) AS INTEGER)
+    FROM legacy_transactions
+"""
+
+# The other party's name for a ledger row l; only evaluated for rows that are actually displayed
+COUNTERPARTY_NAME = """COALESCE(
+    (SELECT full_name FROM users WHERE user_id = l.counterparty_id),
+    (SELECT full_name FROM external_accounts WHERE user_id = l.counterparty_id),
+    l.counterparty_name)"""
+
+
+POSTING_INSERT = "INSERT INTO postings (user_id, counterparty_id, type_code, amount_minor, posted_at, balance_after_minor) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+# How many databases SQLite lets conn attach besides main and temp (SQLITE_MAX_ATTACHED, 10 unless
+# SQLite was built otherwise)
+def attach_limit(conn):
+    if hasattr(conn, "getlimit"):
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    return 10
+
+
+# Turns "YYYY-MM-DD" into a date and longer ISO strings into datetimes
+def parse_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        if len(value) == 10:
+            return datetime.date.fromisoformat(value)
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValidationError("date", f"Invalid date: {value!r}") from None
+
+
+def is_credit(transaction_type):
+    return transaction_type.startswith("CR")
+
+
+# Naira to integer kobo
+def to_minor(amount):
+    return round(amount * 100)
+
+
+# Seconds since EPOCH for a datetime, a date (its midnight) or an ISO string
+def to_epoch(moment):
+    if isinstance(moment, int):
+        return moment
+    moment = parse_date(moment)
+    if not isinstance(moment, datetime.datetime):
+        moment = datetime.datetime.combine(moment, datetime.time())
+    return (moment.replace(tzinfo=None) - EPOCH) // datetime.timedelta(seconds=1)
+
+
+def from_epoch(seconds):
+    return (EPOCH + datetime.timedelta(seconds=seconds)).isoformat()
+
+
+# One postings row for POSTING_INSERT
+def posting_row(user_id, counterparty_id, transaction_type, amount, posted_at, balance_after):
+    return minor_posting_row(user_id, counterparty_id, transaction_type, to_minor(amount), posted_at, to_minor(balance_after))
+
+
+# One postings row for POSTING_INSERT from an amount and balance already in kobo
+def minor_posting_row(user_id, counterparty_id, transaction_type, amount_minor, posted_at, balance_after_minor):
+    return (user_id, counterparty_id, TYPE_CODES[transaction_type], amount_minor, posted_at, balance_after_minor)
+
+
+# (sender, recipient) names of a ledger row as the legacy rows stored them, for narration()
+def parties(transaction_type, own_name, counterparty_name):
+    if transaction_type == TRANSFER_OUT:
+        return own_name, counterparty_name
+    if transaction_type == TRANSFER_IN:
+        return counterparty_name, own_name
+    return own_name, None
+
+
+# Remembers the name of an account held in another database (another shard), so rows naming it as
+# counterparty can still be displayed
+def remember_external_account(cursor, user_id, full_name):
+    cursor.execute("INSERT OR IGNORE INTO external_accounts (user_id, full_name) VALUES (?, ?)", (user_id, full_name))
+
+
+# A counterparty known only by name (legacy rows whose account cannot be identified) gets a negative
+# id in external_accounts, shared by every row naming it
+def name_only_counterparty(cursor, full_name):
+    row = cursor.execute("SELECT user_id FROM external_accounts WHERE full_name = ? AND user_id < 0", (full_name,)).fetchone()
+    if row:
+        return row[0]
+    user_id = cursor.execute("SELECT MIN(COALESCE(MIN(user_id), 0), 0) - 1 FROM external_accounts").fetchone()[0]
+    cursor.execute("INSERT INTO external_accounts (user_id, full_name) VALUES (?, ?)", (user_id, full_name))
+    return user_id
+
+
+# The human readable description of a transaction row, as shown in history and statements
+def narration(transaction_type, sender, recipient):
+    if transaction_type == DEPOSIT:
+        return f"Deposit by {sender}"
+    if transaction_type == TRANSFER_IN:
+        return f"Transfer from {sender}"
+    if transaction_type == WITHDRAWAL:
+        return f"Withdrawal by {sender}"
+    if transaction_type == TRANSFER_OUT:
+        return f"Transfer to {recipient}"
+    return transaction_type
+
+
+class BankService:
+    # Headless banking operations: every method takes plain arguments and either
+    # returns a result or raises one of the errors in hivebank.errors.
+    # Nothing here prompts, prints or sleeps.
+
+    # Pass db to share a tuned ConnectionManager, otherwise one with the default pragmas is opened.
+    # Pass account_numbers to configure the AccountNumberAllocator (block size, check digit).
+    # Pass hasher to choose the KDF, its cost and the size of the hashing process pool.
+    # Pass metrics (a hivebank.metrics.Metrics) to record operation latencies; it is also handed to
+    # the ConnectionManager and CredentialHasher this creates, so SQL and hashing time show up too.
+    # Pass cache (a hivebank.cache.AccountCache) to serve account details and recipient lookups from
+    # memory; postings keep its balances current.
+    # Pass throttle (a hivebank.throttle.LoginThrottle) to limit failed logins and PIN checks; a
+    # throttled attempt raises ThrottledError without checking the password or PIN.
+    # Pass limits (a hivebank.limits.TransactionLimits) to cap withdrawals and outgoing transfers
+    # over rolling windows; a posting that would break one raises LimitExceededError.
+    # Pass journal (a hivebank.journal.Journal) to append every new account and posting to it once
+    # their transaction has committed.
+    def __init__(self, users_db="users.db", db=None, account_numbers=None, hasher=None, metrics=None, cache=None, throttle=None, limits=None, journal=None):
+        self.users_db = users_db
+        self.metrics = metrics
+        self.cache = cache
+        self.throttle = throttle
+        self.limits = limits
+        self.journal = journal
+        self._journal_failing = False
+        self.db = db or ConnectionManager(users_db, metrics=metrics)
+        self._create_tables()
+        self.account_numbers = account_numbers or AccountNumberAllocator(self.db)
+        self.hasher = hasher or CredentialHasher(metrics=metrics)
+
+    def close(self):
+        self.hasher.close()
+        self.db.close()
+
+    # Brings the database schema up to date (hivebank.schema). A current database costs one
+    # PRAGMA user_version read however many rows it holds. Imported here, as hivebank.schema
+    # imports this module.
+    def _create_tables(self):
+        from .schema import migrate
+        migrate(self.db)
+
+    # ---------------------------------------------------------------- validation
+
+    def validate_name(self, name, label="Name"):
+        name = name.strip().capitalize()
+        if not name:
+            raise ValidationError("name", "This field cannot be blank.")
+        if not NAME_PATTERN.fullmatch(name):
+            raise ValidationError("name", f"{label} must contain only letters (you may include '-' or apostrophe).")
+        return name
+
+    def validate_full_name(self, first_name, middle_name, last_name):
+        first_name = self.validate_name(first_name, "First name")
+        middle_name = self.validate_name(middle_name, "Middle name")
+        last_name = self.validate_name(last_name, "Last name")
+
+        combined_names = first_name + last_name + middle_name
+        if len(combined_names) < 4 or len(combined_names) > 255:
+            raise ValidationError("name", "Full name must be between 4 and 255 characters long.")
+
+        return f"{first_name} {middle_name} {last_name}"
+
+    def validate_username(self, username):
+        username = username.strip()
+        if not username:
+            raise ValidationError("username", "This field cannot be blank.")
+        if not USERNAME_PATTERN.fullmatch(username):
+            raise ValidationError("username", "Invalid username. Must start with a letter and be 3-20 letters/numbers only.")
+        return username
+
+    def validate_email(self, email):
+        email = email.strip()
+        if not email:
+            raise ValidationError("email", "This field cannot be blank.")
+        if not EMAIL_PATTERN.fullmatch(email):
+            raise ValidationError("email", "Invalid email")
+        return email
+
+    def validate_password(self, password):
+        password = password.strip()
+        if not password:
+            raise ValidationError("password", "This field cannot be blank.")
+        if not PASSWORD_PATTERN.fullmatch(password):
+            raise ValidationError("password", "Invalid password. Must include upper, lower, number, symbol, and be 8-32 chars long.")
+        return password
+
+    def validate_pin(self, pin):
+        if len(pin) != 4 or not pin.isdigit():
+            raise ValidationError("pin", "Invalid PIN. Please enter a 4-digit number.")
+        return pin
+
+    def validate_initial_deposit(self, initial_deposit):
+        if isinstance(initial_deposit, bool) or not isinstance(initial_deposit, int):
+            raise ValidationError("initial_deposit", "Initial deposit must be integers.")
+        if initial_deposit < MINIMUM_INITIAL_DEPOSIT:
+            raise ValidationError("initial_deposit", f"Initial deposit must be a minimum of ₦{MINIMUM_INITIAL_DEPOSIT}.")
+        if initial_deposit > MAXIMUM_AMOUNT:
+            raise ValidationError("initial_deposit", f"Initial deposit cannot be more than ₦{MAXIMUM_AMOUNT:,}.")
+        return initial_deposit
+
+    def validate_amount(self, amount):
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount):
+            raise ValidationError("amount", "Please, enter a valid number.")
+        # The ledger keeps whole kobo, so amounts are rounded to two decimals before anything is posted
+        amount = round(float(amount), 2)
+        if amount <= 0:
+            raise ValidationError("amount", "The amount must be greater than 0.")
+        if amount > MAXIMUM_AMOUNT:
+            raise ValidationError("amount", f"The amount cannot be more than ₦{MAXIMUM_AMOUNT:,}.")
+        return amount
+
+    def is_valid_login_id(self, username_or_email):
+        return bool(USERNAME_PATTERN.fullmatch(username_or_email) or EMAIL_PATTERN.fullmatch(username_or_email))
+
+    # ------------------------------------------------------------------- helpers
+
+    def _now(self):
+        return to_epoch(datetime.datetime.now())
+
+    # ------------------------------------------------------------------ accounts
+
+    # Validates every field, stores the new account and returns its user_id and account_number
+    @timed("sign_up")
+    def sign_up(self, first_name, middle_name, last_name, username, email, password, pin, initial_deposit):
+        full_name = self.validate_full_name(first_name, middle_name, last_name)
+        username = self.validate_username(username)
+        email = self.validate_email(email)
+        password = self.validate_password(password)
+        pin = self.validate_pin(pin)
+        initial_deposit = self.validate_initial_deposit(initial_deposit)
+
+        hashed_password, hashed_pin = self.hasher.hash_many([password, pin])
+
+        def insert(conn):
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO users (full_name, username, email, password, pin, initial_deposit, account_number, balance_minor) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (full_name, username, email, hashed_password, hashed_pin, initial_deposit, account_number, initial_deposit * 100))
+            self._journal()
+            return {"user_id": cursor.lastrowid, "full_name": full_name, "account_number": account_number}
+
+        while True:
+            account_number = self.account_numbers.allocate()
+            try:
+                return self.db.run(insert)
+            except sqlite3.IntegrityError as exc:
+                exc = str(exc)
+                if exc == "UNIQUE constraint failed: users.email":
+                    raise DuplicateUserError("email") from None
+                if exc == "UNIQUE constraint failed: users.username":
+                    raise DuplicateUserError("username") from None
+                # Only accounts opened before the allocator existed can hold a number it hands out
+                if exc == "UNIQUE constraint failed: users.account_number":
+                    continue
+                raise
+
+    # Checks secret against a stored hash and, when it matches a legacy or outdated hash,
+    # rewrites it with the current KDF settings
+    def _check_secret(self, user_id, column, secret, stored):
+        if not self.hasher.verify(secret, stored):
+            return False
+
+        if self.hasher.needs_upgrade(stored):
+            upgraded = self.hasher.hash(secret)
+            # Only replace the hash we verified, in case it changed meanwhile
+            self.db.run(lambda conn: conn.execute(f"UPDATE users SET {column} = ? WHERE user_id = ? AND {column} = ?", (upgraded, user_id, stored)))
+        return True
+
+    # Returns the user_id whose username or email and password match.
+    # source (e.g. the client's address) is throttled on its own as well as the account.
+    @timed("log_in")
+    def log_in(self, username_or_email, password, source=None):
+        username_or_email = username_or_email.strip()
+        cursor = self.db.connection().cursor()
+        cursor.execute("SELECT user_id, password FROM users WHERE username = ? OR email = ?", (username_or_email, username_or_email))
+        user = cursor.fetchone()
+
+        # Unknown logins are throttled by name, so probing for accounts is limited too
+        key = f"login:{user[0]}" if user else f"login:{username_or_email.lower()}"
+        if self.throttle is not None:
+            self.throttle.check(key, source)
+        if not user or not self._check_secret(user[0], "password", password.strip(), user[1]):
+            if self.throttle is not None:
+                self.throttle.failure(key, source, persist=user is not None)
+            raise AuthenticationError("Invalid credentials")
+        if self.throttle is not None:
+            self.throttle.success(key)
+        return user[0]
+
+    @timed("verify_pin")
+    def verify_pin(self, user_id, pin, source=None):
+        cursor = self.db.connection().cursor()
+        cursor.execute("SELECT pin FROM users WHERE user_id = ?", (user_id,))
+        result = cursor.fetchone()
+
+        if not result:
+            raise UserNotFoundError("User not found.")
+        key = f"pin:{user_id}"
+        if self.throttle is not None:
+            self.throttle.check(key, source)
+        if not self._check_secret(user_id, "pin", pin.strip(), result[0]):
+            if self.throttle is not None:
+                self.throttle.failure(key, source)
+            raise InvalidPinError("Incorrect PIN.")
+        if self.throttle is not None:
+            self.throttle.success(key)
+        return True
+
+    @timed("account_details")
+    def account_details(self, user_id):
+        if self.cache is not None:
+            details = self.cache.account(user_id)
+            if details is not None:
+                return details
+            token = self.cache.token()
+
+        cursor = self.db.connection().cursor()
+        cursor.execute("SELECT full_name, username, account_number, email, balance_minor FROM users WHERE user_id = ?", (user_id,))
+        user = cursor.fetchone()
+
+        if not user:
+            raise UserNotFoundError("Account not found.")
+
+        full_name, username, account_number, email, balance_minor = user
+        details = {
+            "user_id": user_id,
+            "full_name": full_name,
+            "username": username,
+            "account_number": account_number,
+            "email": email,
+            "balance": balance_minor / 100,
+        }
+        if self.cache is not None:
+            self.cache.fill_account(details, token)
+        return details
+
+    # Resolves a recipient account number for user_id, refusing transfers to self
+    @timed("find_recipient")
+    def find_recipient(self, user_id, recipient_account):
+        recipient_account = recipient_account.strip()
+        if not recipient_account:
+            raise ValidationError("recipient_account", "This field cannot be blank.")
+
+        recipient = self.cache.recipient(recipient_account) if self.cache is not None else None
+        if recipient is None:
+            cursor = self.db.connection().cursor()
+            cursor.execute("SELECT user_id, full_name FROM users WHERE account_number = ?", (recipient_account,))
+            recipient = cursor.fetchone()
+
+            if not recipient:
+                raise RecipientNotFoundError("Recipient cannot be found.")
+            if self.cache is not None:
+                self.cache.fill_recipient(recipient_account, recipient[0], recipient[1])
+
+        if recipient[0] == user_id:
+            raise ValidationError("recipient_account", "You cannot transfer money to yourself.")
+        return {"user_id": recipient[0], "full_name": recipient[1], "account_number": recipient_account}
+
+    # ---------------------------------------------------------------- postings
+    #
+    # Every posting runs in its own BEGIN IMMEDIATE transaction (see ConnectionManager.run) and changes
+    # balances with relative, conditional UPDATEs: a debit only applies while balance >= amount, so two
+    # concurrent withdrawals can never both pass a stale balance check or overwrite each other.
+    # Balances are compared and changed in integer kobo (balance_minor), so they never drift.
+
+    # Hands a posting's new balance to the cache once the posting's transaction has committed
+    def _cache_balance(self, user_id, balance, transaction_id):
+        if self.cache is not None:
+            self.db.after_commit(lambda: self.cache.update_balance(user_id, balance, transaction_id))
+
+    # Refuses a debit that would break a transaction limit; called before the balance is touched
+    def _check_limits(self, conn, user_id, transaction_type, amount, posted_at):
+        if self.limits is not None:
+            self.limits.check(conn, user_id, transaction_type, amount, posted_at)
+
+    # Appends what the current transaction posted to the journal once it commits. A journal that
+    # cannot be written (e.g. a full disk), or cannot start until the legacy ledger is migrated, does
+    # not fail a committed posting; the next sync catches up.
+    def _journal(self):
+        if self.journal is not None:
+            self.db.after_commit(self._sync_journal)
+
+    # Every failure is counted in metrics; only the first of a run of them is logged, so a journal
+    # that stays broken does not log once per posting
+    def _sync_journal(self):
+        try:
+            self.journal.sync(self.db)
+        except (OSError, JournalError) as exc:
+            if self.metrics is not None:
+                self.metrics.observe_journal_failure(type(exc).__name__)
+            if not self._journal_failing:
+                self._journal_failing = True
+                logger.exception("Journal %s is behind the database; later syncs will retry", self.journal.path)
+            return
+        if self._journal_failing:
+            self._journal_failing = False
+            logger.info("Journal %s has caught up", self.journal.path)
+
+    # Counts a debit towards the limits, and takes it back out if the transaction rolls back
+    def _record_limits(self, conn, user_id, transaction_type, amount, posted_at):
+        if self.limits is not None:
+            self.db.on_rollback(self.limits.record(conn, user_id, transaction_type, amount, posted_at))
+
+    # Raises the right error for a debit whose conditional UPDATE matched no row
+    def _refuse_debit(self, cursor, user_id):
+        user = cursor.execute("SELECT balance_minor FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if not user:
+            raise UserNotFoundError("User not found.")
+        raise InsufficientFundsError(user[0] / 100)
+
+    # Adds amount to the user's balance, logs the transaction and returns the new balance
+    @timed("deposit")
+    def deposit(self, user_id, amount):
+        amount = self.validate_amount(amount)
+        amount_minor = to_minor(amount)
+
+        def post(conn):
+            cursor = conn.cursor()
+            user = cursor.execute("UPDATE users SET balance_minor = balance_minor + ? WHERE user_id = ? RETURNING balance_minor", (amount_minor, user_id)).fetchone()
+            if not user:
+                raise UserNotFoundError("User not found.")
+
+            balance = user[0] / 100
+            cursor.execute(POSTING_INSERT, minor_posting_row(user_id, None, DEPOSIT, amount_minor, self._now(), user[0]))
+            self._cache_balance(user_id, balance, cursor.lastrowid)
+            self._journal()
+            return balance
+
+        return self.db.run(post)
+
+    # Subtracts amount from the user's balance, logs the transaction and returns the new balance
+    @timed("withdrawal")
+    def withdrawal(self, user_id, amount):
+        amount = self.validate_amount(amount)
+        amount_minor = to_minor(amount)
+
+        def post(conn):
+            cursor = conn.cursor()
+            posted_at = self._now()
+            self._check_limits(conn, user_id, WITHDRAWAL, amount, posted_at)
+            user = cursor.execute(
+                "UPDATE users SET balance_minor = balance_minor - ? WHERE user_id = ? AND balance_minor >= ? RETURNING balance_minor", (amount_minor, user_id, amount_minor)
+            ).fetchone()
+            if not user:
+                self._refuse_debit(cursor, user_id)
+
+            balance = user[0] / 100
+            cursor.execute(POSTING_INSERT, minor_posting_row(user_id, None, WITHDRAWAL, amount_minor, posted_at, user[0]))
+            self._record_limits(conn, user_id, WITHDRAWAL, amount, posted_at)
+            self._cache_balance(user_id, balance, cursor.lastrowid)
+            self._journal()
+            return balance
+
+        return self.db.run(post)
+
+    # Moves amount from user_id to the owner of recipient_account and returns the sender's new balance
+    @timed("transfer")
+    def transfer(self, user_id, recipient_account, amount):
+        amount = self.validate_amount(amount)
+        amount_minor = to_minor(amount)
+        recipient = self.find_recipient(user_id, recipient_account)
+
+        def post(conn):
+            cursor = conn.cursor()
+            posted_at = self._now()
+            self._check_limits(conn, user_id, TRANSFER_OUT, amount, posted_at)
+            sender = cursor.execute(
+                "UPDATE users SET balance_minor = balance_minor - ? WHERE user_id = ? AND balance_minor >= ? RETURNING balance_minor", (amount_minor, user_id, amount_minor)
+            ).fetchone()
+            if not sender:
+                self._refuse_debit(cursor, user_id)
+
+            # Raising here rolls the debit back as well
+            credited = cursor.execute("UPDATE users SET balance_minor = balance_minor + ? WHERE user_id = ? RETURNING balance_minor", (amount_minor, recipient["user_id"])).fetchone()
+            if not credited:
+                raise RecipientNotFoundError("Recipient cannot be found.")
+
+            sender_balance = sender[0] / 100
+            recipient_balance = credited[0] / 100
+
+            # This logs the sender (---> money leaving) and recipient (---> money entering) transactions
+            cursor.execute(POSTING_INSERT, minor_posting_row(user_id, recipient["user_id"], TRANSFER_OUT, amount_minor, posted_at, sender[0]))
+            self._record_limits(conn, user_id, TRANSFER_OUT, amount, posted_at)
+            self._cache_balance(user_id, sender_balance, cursor.lastrowid)
+            cursor.execute(POSTING_INSERT, minor_posting_row(recipient["user_id"], user_id, TRANSFER_IN, amount_minor, posted_at, credited[0]))
+            self._cache_balance(recipient["user_id"], recipient_balance, cursor.lastrowid)
+            self._journal()
+            return {"balance": sender_balance, "recipient": recipient}
+
+        return self.db.run(post)
+
+    # ----------------------------------------------------------------- archives
+    #
+    # hivebank.archive moves ledger rows older than a cut-off into one file per year. Every archived
+    # row was posted before archive_boundary(), so readers only open archives when the range they
+    # need reaches below it.
+
+    # posted_at below which rows may be archived, or None when nothing has been
+    def archive_boundary(self):
+        return self.db.connection().execute("SELECT MAX(archived_until) FROM archives").fetchone()[0]
+
+    def archive_path(self, path):
+        return path if os.path.isabs(path) else os.path.join(os.path.dirname(os.path.abspath(self.users_db)), path)
+
+    # (name, path) of the archives that can hold rows posted in [since, until), newest first
+    def _archives(self, conn, since, until):
+        return conn.execute(
+            "SELECT name, path FROM archives WHERE (? IS NULL OR period_end > ?) AND (? IS NULL OR period_start < ?) ORDER BY period_start DESC",
+            (since, since, until, until),
+        ).fetchall()
+
+    # Attaches archives to conn, detaching any other archive first to stay under SQLite's limit
+    def _attach(self, conn, archives):
+        needed = {name for name, _ in archives}
+        attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+        for other in attached:
+            if other.startswith("archive_") and other not in needed:
+                conn.execute(f"DETACH DATABASE {other}")
+        for name, path in archives:
+            if name not in attached:
+                conn.execute(f"ATTACH DATABASE ? AS {name}", (self.archive_path(path),))
+        return [name for name, _ in archives]
+
+    # Attaches the archives that can hold rows posted in [since, until) (None for unbounded) to this
+    # thread's connection and returns their schema names, newest first. Raises TooManyArchivesError
+    # when they are more than SQLite can attach at once; readers that take one archive at a time
+    # use archive_batches() instead. Must run outside a transaction.
+    def attach_archives(self, since=None, until=None):
+        conn = self.db.connection()
+        archives = self._archives(conn, since, until)
+        limit = attach_limit(conn)
+        if len(archives) > limit:
+            raise TooManyArchivesError(len(archives), limit)
+        return self._attach(conn, archives)
+
+    # Yields the schema names of the archives that can hold rows posted in [since, until), newest
+    # first, in lists no longer than SQLite can attach at once; each list is attached (and the one
+    # before it detached) when it is yielded. Must run outside a transaction.
+    def archive_batches(self, since=None, until=None):
+        conn = self.db.connection()
+        archives = self._archives(conn, since, until)
+        limit = attach_limit(conn)
+        for start in range(0, len(archives), limit):
+            yield self._attach(conn, archives[start:start + limit])
+
+    # ------------------------------------------------------------------ history
+
+    # Returns one page of the user's transactions, newest first, and the cursor for the next page.
+    # from_date/to_date accept dates, datetimes or ISO strings; a plain date as to_date covers that whole day.
+    # transaction_types limits the page to the given transaction_type values.
+    @timed("transaction_page")
+    def transaction_page(self, user_id, limit=DEFAULT_PAGE_SIZE, cursor=None, from_date=None, to_date=None, transaction_types=None):
+        if isinstance(limit, bool) or not isinstance(limit, int) or not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValidationError("limit", f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+
+        conditions = ["user_id = ?"]
+        params = [user_id]
+        # The page covers posted_at in [since, until)
+        since = until = None
+
+        if cursor is not None:
+            before_posted_at, before_id = self._decode_cursor(cursor)
+            conditions.append("(posted_at, transaction_id) < (?, ?)")
+            params += [before_posted_at, before_id]
+            until = before_posted_at + 1
+
+        if from_date is not None:
+            since = to_epoch(from_date)
+            conditions.append("posted_at >= ?")
+            params.append(since)
+
+        if to_date is not None:
+            to_date = parse_date(to_date)
+            if isinstance(to_date, datetime.datetime):
+                conditions.append("posted_at <= ?")
+                params.append(to_epoch(to_date))
+                until = min(until or math.inf, to_epoch(to_date) + 1)
+            else:
+                conditions.append("posted_at < ?")
+                params.append(to_epoch(to_date + datetime.timedelta(days=1)))
+                until = min(until or math.inf, to_epoch(to_date + datetime.timedelta(days=1)))
+
+        if transaction_types:
+            type_codes = [TYPE_CODES.get(transaction_type, 0) for transaction_type in transaction_types]
+            conditions.append(f"type_code IN ({', '.join('?' * len(type_codes))})")
+            params += type_codes
+
+        # One extra row tells us whether another page exists without a COUNT(*)
+        params.append(limit + 1)
+        conn = self.db.connection()
+        sql = (
+            f"SELECT transaction_id, type_code, amount_minor, posted_at, {COUNTERPARTY_NAME} "
+            f"FROM {{}} l WHERE {' AND '.join(conditions)} ORDER BY posted_at DESC, transaction_id DESC LIMIT ?"
+        )
+        rows = conn.execute(sql.format("ledger"), params).fetchall()
+
+        # Archived rows are older than every hot one, so they are only needed when the page runs
+        # past the archive boundary and the range reaches below it
+        boundary = self.archive_boundary()
+        if boundary is not None and (len(rows) <= limit or rows[-1][3] < boundary) and (since is None or since < boundary):
+            for schemas in self.archive_batches(since, until):
+                for schema in schemas:
+                    rows += conn.execute(sql.format(f"{schema}.ledger"), params).fetchall()
+            # A row copied to an archive but not yet deleted here is listed once
+            rows = sorted({row[0]: row for row in rows}.values(), key=lambda row: (row[3], row[0]), reverse=True)[:limit + 1]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1][3]}|{rows[-1][0]}"
+
+        transactions = []
+        if rows:
+            own_name = conn.execute("SELECT full_name FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            own_name = own_name[0] if own_name else None
+            for transaction_id, type_code, amount_minor, posted_at, counterparty in rows:
+                trans_type = TYPE_NAMES.get(type_code, str(type_code))
+                sender, recipient = parties(trans_type, own_name, counterparty)
+                transactions.append({
+                    "transaction_id": transaction_id,
+                    "sender": sender,
+                    "recipient": recipient,
+                    "transaction_type": trans_type,
+                    "amount": amount_minor / 100,
+                    "timestamp": from_epoch(posted_at),
+                })
+        return {"transactions": transactions, "next_cursor": next_cursor}
+
+    # Returns all of the user's matching transactions, newest first, fetched page by page
+    @timed("transaction_history")
+    def transaction_history(self, user_id, from_date=None, to_date=None, transaction_types=None):
+        transactions = []
+        cursor = None
+        while True:
+            page = self.transaction_page(user_id, MAX_PAGE_SIZE, cursor, from_date, to_date, transaction_types)
+            transactions += page["transactions"]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return transactions
+
+    def _decode_cursor(self, cursor):
+        try:
+            posted_at, transaction_id = cursor.rsplit("|", 1)
+            return int(posted_at), int(transaction_id)
+        except (AttributeError, ValueError):
+            raise ValidationError("cursor", "Invalid page cursor.") from None
@@ -0,0 +1,314 @@
+import logging
+import os
+import sqlite3
+
+from .accounts import AccountNumberAllocator
+from .db import ConnectionManager
+from .errors import ValidationError, DuplicateUserError, AuthenticationError, RecipientNotFoundError, UserNotFoundError
+from .hashing import CredentialHasher
+from .metrics import timed
+from .schema import CATALOG_MIGRATIONS, migrate
+from .service import BankService, TRANSFER_OUT, TRANSFER_IN, POSTING_INSERT, minor_posting_row, remember_external_account, name_only_counterparty, to_epoch, from_epoch, to_minor
+
+# Accounts spread over several SQLite files, so postings on different shards never wait for the same
+# write lock and write throughput grows with the number of shards.
+#
+#   <directory>/catalog.db     usernames, emails and account numbers of every account (sign up and
+#                              login only), plus the shared account number sequence
+#   <directory>/shard-NN.db    an ordinary BankService database holding a subset of the accounts
+#
+# Routing needs no lookup: an account lives on shard int(account_number) % shards, and its user_id is
+# chosen so that user_id % shards names the same shard. Everything keyed by one account (deposit,
+# withdrawal, details, history, PIN checks, same-shard transfers) runs unchanged on that shard's
+# BankService.
+#
+# Transfers between shards use a transactional outbox:
+#   1. on the sender's shard, one transaction debits the sender, logs the "DR-Transfer To" row and
+#      records the credit in transfer_outbox;
+#   2. on the recipient's shard, one transaction records (source shard, outbox_id) in
+#      transfer_inbox, credits the recipient and logs the "CR-Transfer From" row; a credit whose
+#      inbox key already exists is skipped, so delivering twice is harmless;
+#   3. the outbox row is deleted.
+# A crash or error between 1 and 3 leaves the outbox row behind, and deliver_pending() (run on
+# start-up) finishes it, so a committed debit is always credited exactly once.
+
+logger = logging.getLogger("hivebank.sharding")
+
+CATALOG_FILE = "catalog.db"
+
+# A catalog claim this old without a user_id belongs to a sign up that died half way
+STALE_SIGN_UP_SECONDS = 300
+
+
+def shard_file(index):
+    return f"shard-{index:02d}.db"
+
+
+class ShardedBankService:
+    # Opens (or creates) a sharded bank in directory. shards is fixed when the directory is created.
+    # connection_options are passed to every ConnectionManager (synchronous, busy_timeout, ...).
+    # throttle (a hivebank.throttle.LoginThrottle) and limits (a hivebank.limits.TransactionLimits)
+    # are shared by every shard; user_ids are unique across shards, so their records never collide.
+    # recover=False skips deliver_pending(), for processes opening a bank that another process has
+    # just recovered (see hivebank.workers).
+    def __init__(self, directory, shards=4, hasher=None, metrics=None, throttle=None, limits=None, recover=True, **connection_options):
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.metrics = metrics
+        self.throttle = throttle
+        self.hasher = hasher or CredentialHasher(metrics=metrics)
+
+        self.catalog = ConnectionManager(os.path.join(directory, CATALOG_FILE), metrics=metrics, **connection_options)
+        try:
+            migrate(self.catalog, CATALOG_MIGRATIONS)
+            self.shard_count = self.catalog.run(lambda conn: self._create_catalog(conn, shards))
+        except ValueError:
+            self.catalog.close()
+            raise
+        self.account_numbers = AccountNumberAllocator(self.catalog)
+
+        self.shards = []
+        for index in range(self.shard_count):
+            path = os.path.join(directory, shard_file(index))
+            db = ConnectionManager(path, metrics=metrics, **connection_options)
+            shard = BankService(path, db=db, account_numbers=self.account_numbers, hasher=self.hasher, metrics=metrics, throttle=throttle, limits=limits)
+            self.shards.append(shard)
+
+        if recover:
+            self.deliver_pending()
+
+    # The catalog's tables come from hivebank.schema.CATALOG_MIGRATIONS
+    def _create_catalog(self, conn, shards):
+        conn.execute("INSERT OR IGNORE INTO shard_settings (name, value) VALUES ('shards', ?)", (shards,))
+        stored = conn.execute("SELECT value FROM shard_settings WHERE name = 'shards'").fetchone()[0]
+        if stored != shards:
+            raise ValueError(f"{self.directory} was created with {stored} shards, not {shards}.")
+        return stored
+
+    def close(self):
+        for shard in self.shards:
+            shard.db.close()
+        self.catalog.close()
+        self.hasher.close()
+
+    # Validators do not touch storage, so any shard's BankService answers them
+    def __getattr__(self, name):
+        if name.startswith("validate_") or name == "is_valid_login_id":
+            return getattr(self.shards[0], name)
+        raise AttributeError(name)
+
+    # ------------------------------------------------------------------ routing
+
+    def shard_index_for_user(self, user_id):
+        return user_id % self.shard_count
+
+    def shard_index_for_account(self, account_number):
+        return int(account_number) % self.shard_count
+
+    def shard_for_user(self, user_id):
+        if isinstance(user_id, bool) or not isinstance(user_id, int) or user_id < 1:
+            raise UserNotFoundError("User not found.")
+        return self.shards[self.shard_index_for_user(user_id)]
+
+    def shard_for_account(self, account_number):
+        account_number = account_number.strip()
+        if not account_number:
+            raise ValidationError("recipient_account", "This field cannot be blank.")
+        if not account_number.isdigit():
+            raise RecipientNotFoundError("Recipient cannot be found.")
+        return self.shards[self.shard_index_for_account(account_number)]
+
+    # ----------------------------------------------------------------- accounts
+
+    # Same rules and result as BankService.sign_up. The username and email are claimed in the catalog
+    # first, so they stay unique across shards, then the account row is written on its shard.
+    @timed("sign_up")
+    def sign_up(self, first_name, middle_name, last_name, username, email, password, pin, initial_deposit):
+        full_name = self.validate_full_name(first_name, middle_name, last_name)
+        username = self.validate_username(username)
+        email = self.validate_email(email)
+        password = self.validate_password(password)
+        pin = self.validate_pin(pin)
+        initial_deposit = self.validate_initial_deposit(initial_deposit)
+
+        hashed_password, hashed_pin = self.hasher.hash_many([password, pin])
+        account_number = self.account_numbers.allocate()
+        index = self.shard_index_for_account(account_number)
+
+        def claim(conn):
+            try:
+                conn.execute("INSERT INTO directory (username, email, account_number) VALUES (?, ?, ?)", (username, email, account_number))
+            except sqlite3.IntegrityError as exc:
+                if str(exc) == "UNIQUE constraint failed: directory.username":
+                    raise DuplicateUserError("username") from None
+                if str(exc) == "UNIQUE constraint failed: directory.email":
+                    raise DuplicateUserError("email") from None
+                raise
+
+        # The next user_id after the shard's highest one that routes back to this shard
+        def insert(conn):
+            highest = conn.execute("SELECT MAX(user_id) FROM users").fetchone()[0] or 0
+            user_id = highest + ((index - highest) % self.shard_count or self.shard_count)
+            conn.execute(
+                "INSERT INTO users (user_id, full_name, username, email, password, pin, initial_deposit, account_number, balance_minor) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, full_name, username, email, hashed_password, hashed_pin, initial_deposit, account_number, initial_deposit * 100),
+            )
+            return user_id
+
+        self.catalog.run(claim)
+        try:
+            user_id = self.shards[index].db.run(insert)
+        except BaseException:
+            self.catalog.run(lambda conn: conn.execute("DELETE FROM directory WHERE account_number = ?", (account_number,)))
+            raise
+        self.catalog.run(lambda conn: conn.execute("UPDATE directory SET user_id = ? WHERE account_number = ?", (user_id, account_number)))
+        return {"user_id": user_id, "full_name": full_name, "account_number": account_number}
+
+    def log_in(self, username_or_email, password, source=None):
+        login = username_or_email.strip()
+        row = self.catalog.connection().execute("SELECT user_id FROM directory WHERE username = ? OR email = ?", (login, login)).fetchone()
+        if not row or row[0] is None:
+            # Throttled by name like BankService.log_in does for logins it cannot find
+            if self.throttle is not None:
+                self.throttle.check(f"login:{login.lower()}", source)
+                self.throttle.failure(f"login:{login.lower()}", source, persist=False)
+            raise AuthenticationError("Invalid credentials")
+        return self.shard_for_user(row[0]).log_in(login, password, source)
+
+    def verify_pin(self, user_id, pin, source=None):
+        return self.shard_for_user(user_id).verify_pin(user_id, pin, source)
+
+    def account_details(self, user_id):
+        return self.shard_for_user(user_id).account_details(user_id)
+
+    def find_recipient(self, user_id, recipient_account):
+        return self.shard_for_account(recipient_account).find_recipient(user_id, recipient_account)
+
+    # ----------------------------------------------------------------- postings
+
+    def deposit(self, user_id, amount):
+        return self.shard_for_user(user_id).deposit(user_id, amount)
+
+    def withdrawal(self, user_id, amount):
+        return self.shard_for_user(user_id).withdrawal(user_id, amount)
+
+    def transfer(self, user_id, recipient_account, amount):
+        source = self.shard_for_user(user_id)
+        target = self.shard_for_account(recipient_account)
+        if source is target:
+            return source.transfer(user_id, recipient_account, amount)
+        return self._cross_shard_transfer(user_id, recipient_account, amount)
+
+    @timed("cross_shard_transfer")
+    def _cross_shard_transfer(self, user_id, recipient_account, amount):
+        result, message = self._debit_cross_shard(user_id, recipient_account, amount)
+        try:
+            self._deliver(self.shard_index_for_user(user_id), message)
+        except Exception:
+            # The debit is committed and the credit is still in the outbox; deliver_pending() finishes it
+            logger.exception("Credit for outbox entry %s is pending", message[0])
+        return result
+
+    # Step 1 of a cross-shard transfer: debits the sender and queues the credit in the outbox in one
+    # transaction on the sender's shard. Returns the transfer's result and the outbox message.
+    def _debit_cross_shard(self, user_id, recipient_account, amount):
+        source_index = self.shard_index_for_user(user_id)
+        target_index = self.shard_index_for_account(recipient_account.strip())
+        source = self.shards[source_index]
+        amount = source.validate_amount(amount)
+        amount_minor = to_minor(amount)
+        recipient = self.shards[target_index].find_recipient(user_id, recipient_account)
+
+        def debit(conn):
+            cursor = conn.cursor()
+            posted_at = source._now()
+            source._check_limits(conn, user_id, TRANSFER_OUT, amount, posted_at)
+            sender = cursor.execute(
+                "UPDATE users SET balance_minor = balance_minor - ? WHERE user_id = ? AND balance_minor >= ? RETURNING full_name, balance_minor",
+                (amount_minor, user_id, amount_minor),
+            ).fetchone()
+            if not sender:
+                source._refuse_debit(cursor, user_id)
+
+            sender_name, sender_balance = sender[0], sender[1] / 100
+            cursor.execute(POSTING_INSERT, minor_posting_row(user_id, recipient["user_id"], TRANSFER_OUT, amount_minor, posted_at, sender[1]))
+            source._record_limits(conn, user_id, TRANSFER_OUT, amount, posted_at)
+            remember_external_account(cursor, recipient["user_id"], recipient["full_name"])
+            # The outbox is a queue, not the ledger, so it keeps a readable timestamp
+            timestamp = from_epoch(posted_at)
+            cursor.execute(
+                "INSERT INTO transfer_outbox (target_shard, recipient_user_id, sender_user_id, sender_name, recipient_name, amount, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (target_index, recipient["user_id"], user_id, sender_name, recipient["full_name"], amount, timestamp),
+            )
+            return sender_balance, (cursor.lastrowid, target_index, recipient["user_id"], user_id, sender_name, recipient["full_name"], amount, timestamp)
+
+        balance, message = source.db.run(debit)
+        return {"balance": balance, "recipient": recipient}, message
+
+    # Applies one outbox entry on its target shard (at most once) and then removes it from the outbox
+    def _deliver(self, source_index, message):
+        self._credit(source_index, message)
+        self._clear_outbox(source_index, [message[0]])
+
+    # Step 2: credits the recipient on the target shard, unless this outbox entry was credited before
+    def _credit(self, source_index, message):
+        outbox_id, target_index, recipient_id, sender_id, sender_name, recipient_name, amount, timestamp = message
+        amount_minor = to_minor(amount)
+
+        def credit(conn):
+            cursor = conn.cursor()
+            cursor.execute("INSERT OR IGNORE INTO transfer_inbox (source_shard, outbox_id) VALUES (?, ?)", (source_index, outbox_id))
+            if cursor.rowcount == 0:
+                return
+            credited = cursor.execute("UPDATE users SET balance_minor = balance_minor + ? WHERE user_id = ? RETURNING balance_minor", (amount_minor, recipient_id)).fetchone()
+            if not credited:
+                raise RecipientNotFoundError("Recipient cannot be found.")
+            if sender_id is None:
+                counterparty_id = name_only_counterparty(cursor, sender_name)
+            else:
+                counterparty_id = sender_id
+                remember_external_account(cursor, sender_id, sender_name)
+            cursor.execute(POSTING_INSERT, minor_posting_row(recipient_id, counterparty_id, TRANSFER_IN, amount_minor, to_epoch(timestamp), credited[0]))
+
+        self.shards[target_index].db.run(credit)
+
+    # Step 3: removes credited entries from the source shard's outbox
+    def _clear_outbox(self, source_index, outbox_ids):
+        self.shards[source_index].db.run(lambda conn: conn.executemany("DELETE FROM transfer_outbox WHERE outbox_id = ?", [(outbox_id,) for outbox_id in outbox_ids]))
+
+    # Finishes cross-shard credits and sign ups that were interrupted; returns how many were repaired.
+    # Safe to run while other processes are posting: a credit delivered twice is skipped by the inbox,
+    # and only sign up claims older than STALE_SIGN_UP_SECONDS are touched.
+    def deliver_pending(self):
+        repaired = 0
+        for source_index, shard in enumerate(self.shards):
+            pending = shard.db.connection().execute(
+                "SELECT outbox_id, target_shard, recipient_user_id, sender_user_id, sender_name, recipient_name, amount, timestamp FROM transfer_outbox ORDER BY outbox_id"
+            ).fetchall()
+            for message in pending:
+                self._deliver(source_index, message)
+                repaired += 1
+
+        # A directory row without user_id is a sign up that stopped before or after writing the account
+        unfinished = self.catalog.connection().execute(
+            "SELECT account_number FROM directory WHERE user_id IS NULL AND claimed_at < datetime('now', ?)", (f"-{STALE_SIGN_UP_SECONDS} seconds",)
+        ).fetchall()
+        for (account_number,) in unfinished:
+            shard = self.shards[self.shard_index_for_account(account_number)]
+            row = shard.db.connection().execute("SELECT user_id FROM users WHERE account_number = ?", (account_number,)).fetchone()
+            if row:
+                self.catalog.run(lambda conn: conn.execute("UPDATE directory SET user_id = ? WHERE account_number = ?", (row[0], account_number)))
+            else:
+                self.catalog.run(lambda conn: conn.execute("DELETE FROM directory WHERE account_number = ? AND user_id IS NULL", (account_number,)))
+            repaired += 1
+        return repaired
+
+    # ------------------------------------------------------------------ history
+
+    def transaction_page(self, user_id, *args, **kwargs):
+        return self.shard_for_user(user_id).transaction_page(user_id, *args, **kwargs)
+
+    def transaction_history(self, user_id, *args, **kwargs):
+        return self.shard_for_user(user_id).transaction_history(user_id, *args, **kwargs)
@@ -0,0 +1,243 @@
+import argparse
+import csv
+import datetime
+import heapq
+import json
+import sys
+
+from .errors import TooManyArchivesError, UserNotFoundError
+from .ledger import last_row_before, last_row_column
+from .service import BankService, COUNTERPARTY_NAME, CREDIT_TYPE_CODES, TYPE_NAMES, parse_date, is_credit, narration, parties, to_epoch, from_epoch
+
+# Account statements streamed straight from the database cursor.
+#
+# A statement is a stream of events:
+#   ("opening", account, balance)
+#   ("line", account, row, balance_after_row)
+#   ("closing", account, balance)
+# produced by the generators below and consumed by one of the writers. Nothing holds more than
+# one row at a time, so memory stays flat however many transactions a period has.
+# Periods that reach below the archive boundary also read the archive files (hivebank.archive) and
+# merge their rows in; each source is already in order, so the merge holds no more than one row each.
+
+STATEMENT_FIELDS = ["account_number", "full_name", "record", "transaction_id", "date", "time", "description", "transaction_type", "debit", "credit", "balance"]
+
+
+# Returns the [start, end) posted_at bounds for a statement covering from_date to to_date inclusive
+def period_bounds(from_date, to_date):
+    start = parse_date(from_date)
+    end = parse_date(to_date)
+    if not isinstance(end, datetime.datetime):
+        end = end + datetime.timedelta(days=1)
+    return to_epoch(start), to_epoch(end)
+
+
+# Folds one account's ledger rows (oldest first, all before end) into statement events.
+# Balances are summed in kobo; rows before start only move the opening balance.
+def _account_events(account, opening_minor, rows, start):
+    balance = opening_minor
+    opened = False
+
+    for transaction_id, type_code, amount_minor, posted_at, counterparty in rows:
+        signed = amount_minor if type_code in CREDIT_TYPE_CODES else -amount_minor
+
+        if posted_at < start:
+            balance += signed
+            continue
+
+        if not opened:
+            yield ("opening", account, balance / 100)
+            opened = True
+
+        balance += signed
+        trans_type = TYPE_NAMES.get(type_code, str(type_code))
+        sender, recipient = parties(trans_type, account["full_name"], counterparty)
+        yield ("line", account, (transaction_id, sender, recipient, trans_type, amount_minor / 100, from_epoch(posted_at)), balance / 100)
+
+    if not opened:
+        yield ("opening", account, balance / 100)
+    yield ("closing", account, balance / 100)
+
+
+def statement_events(service, user_id, from_date, to_date):
+    start, end = period_bounds(from_date, to_date)
+    conn = service.db.connection()
+
+    user = conn.execute("SELECT account_number, full_name, initial_deposit FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    if not user:
+        raise UserNotFoundError("Account not found.")
+
+    account_number, full_name, initial_deposit = user
+    account = {"user_id": user_id, "account_number": account_number, "full_name": full_name}
+
+    # The opening balance comes from the ledger, so only the period itself is read
+    last_row = last_row_before(service, user_id, start)
+    opening_minor = last_row[0] if last_row is not None else initial_deposit * 100
+
+    rows = _period_rows(
+        service,
+        f"SELECT transaction_id, type_code, amount_minor, posted_at, {COUNTERPARTY_NAME} FROM {{}} l "
+        "WHERE user_id = ? AND posted_at >= ? AND posted_at < ? ORDER BY posted_at, transaction_id",
+        (user_id, start, end),
+        start,
+        end,
+        key=lambda row: (row[3], row[0]),
+    )
+    yield from _account_events(account, opening_minor, rows, start)
+
+
+# Runs sql (with {} for the ledger) against the hot ledger and every archive holding rows in
+# [start, end), merging the ordered results by key and dropping rows seen in an earlier source
+def _period_rows(service, sql, params, start, end, key):
+    conn = service.db.connection()
+    boundary = service.archive_boundary()
+    if boundary is None or start >= boundary:
+        return conn.execute(sql.format("ledger"), params)
+
+    sources = [conn.cursor().execute(sql.format("main.ledger"), params)]
+    for schema in service.attach_archives(start, end):
+        sources.append(conn.cursor().execute(sql.format(f"{schema}.ledger"), params))
+
+    def merged():
+        last = None
+        for row in heapq.merge(*sources, key=key):
+            # A row still in both places comes out twice in a row
+            if key(row) != last:
+                last = key(row)
+                yield row
+    return merged()
+
+
+# Statements for every account from one ordered pass over users and one over the period's ledger rows
+def all_statement_events(service, from_date, to_date):
+    start, end = period_bounds(from_date, to_date)
+    conn = service.db.connection()
+
+    # Each opening balance is one index lookup per account, across the archives when they hold it
+    opening = last_row_column("balance_after_minor", service.attach_archives(until=start))
+    users = conn.execute(
+        f"SELECT u.user_id, u.account_number, u.full_name, COALESCE({opening}, u.initial_deposit * 100) FROM users u ORDER BY u.user_id",
+        {"bound": start},
+    )
+    # A second cursor on the same connection walks the period's rows in (user_id, posted_at) order
+    rows = _period_rows(
+        service,
+        f"SELECT user_id, transaction_id, type_code, amount_minor, posted_at, {COUNTERPARTY_NAME} FROM {{}} l "
+        "WHERE posted_at >= ? AND posted_at < ? ORDER BY user_id, posted_at, transaction_id",
+        (start, end),
+        start,
+        end,
+        key=lambda row: (row[0], row[4], row[1]),
+    )
+
+    pending = next(rows, None)
+    for user_id, account_number, full_name, opening_minor in users:
+        # Rows for users that no longer exist are skipped
+        while pending is not None and pending[0] < user_id:
+            pending = next(rows, None)
+
+        def account_rows():
+            nonlocal pending
+            while pending is not None and pending[0] == user_id:
+                yield pending[1:]
+                pending = next(rows, None)
+
+        account = {"user_id": user_id, "account_number": account_number, "full_name": full_name}
+        yield from _account_events(account, opening_minor, account_rows(), start)
+
+
+# ---------------------------------------------------------------------- writers
+
+def _record(event):
+    kind, account = event[0], event[1]
+    record = dict.fromkeys(STATEMENT_FIELDS)
+    record["account_number"] = account["account_number"]
+    record["full_name"] = account["full_name"]
+    record["record"] = kind
+
+    if kind == "line":
+        (transaction_id, sender, recipient, trans_type, amount, timestamp), balance = event[2], event[3]
+        record["transaction_id"] = transaction_id
+        record["date"] = timestamp[:10]
+        record["time"] = timestamp[11:19]
+        record["description"] = narration(trans_type, sender, recipient)
+        record["transaction_type"] = trans_type
+        record["credit" if is_credit(trans_type) else "debit"] = round(amount, 2)
+    else:
+        record["description"] = "Opening balance" if kind == "opening" else "Closing balance"
+        balance = event[2]
+
+    record["balance"] = round(balance, 2)
+    return record
+
+
+def write_csv(events, out):
+    writer = csv.DictWriter(out, fieldnames=STATEMENT_FIELDS)
+    writer.writeheader()
+    for event in events:
+        writer.writerow(_record(event))
+
+
+def write_jsonl(events, out):
+    for event in events:
+        out.write(json.dumps(_record(event)) + "\n")
+
+
+def write_text(events, out):
+    for event in events:
+        kind, account = event[0], event[1]
+        if kind == "opening":
+            out.write(f"STATEMENT  {account['account_number']}  {account['full_name']}\n")
+            out.write(f"{'Opening balance':<58}₦{event[2]:>14,.2f}\n")
+        elif kind == "line":
+            record = _record(event)
+            amount = record["credit"] if record["credit"] is not None else -record["debit"]
+            out.write(f"{record['date']} {record['time'][:5]}  {record['description'][:40]:<40} {amount:>+12,.2f} ₦{record['balance']:>14,.2f}\n")
+        else:
+            out.write(f"{'Closing balance':<58}₦{event[2]:>14,.2f}\n\n")
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "text": write_text}
+
+
+def export_statement(service, user_id, out, from_date, to_date, fmt="csv"):
+    WRITERS[fmt](statement_events(service, user_id, from_date, to_date), out)
+
+
+def export_all_statements(service, out, from_date, to_date, fmt="csv"):
+    WRITERS[fmt](all_statement_events(service, from_date, to_date), out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export account statements for a period.")
+    parser.add_argument("--db", default="users.db", help="database file (default: users.db)")
+    parser.add_argument("--from", dest="from_date", required=True, help="first day of the period (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="to_date", required=True, help="last day of the period (YYYY-MM-DD)")
+    parser.add_argument("--account", help="export only this account number (default: every account)")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    service = BankService(args.db)
+    out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        if args.account:
+            user = service.db.connection().execute("SELECT user_id FROM users WHERE account_number = ?", (args.account,)).fetchone()
+            if not user:
+                print("Account not found.", file=sys.stderr)
+                return 1
+            export_statement(service, user[0], out, args.from_date, args.to_date, args.format)
+        else:
+            export_all_statements(service, out, args.from_date, args.to_date, args.format)
+    except TooManyArchivesError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
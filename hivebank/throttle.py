@@ -0,0 +1,161 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+from .errors import ThrottledError
+
+# Login and PIN throttling that never sleeps.
+#
+# Two independent limits, both checked before any password or PIN is hashed:
+#   per account  every max_failures failed attempts in a row lock the account's login (or PIN) for
+#                base_lockout seconds, doubling with each further lockout up to max_lockout. A
+#                success clears the account's record.
+#   per source   each source (a client address) has a token bucket of source_burst failures that
+#                refills at source_rate per second, so one address guessing across many accounts
+#                is held back as well. Successful attempts cost nothing.
+# A throttled attempt raises ThrottledError with retry_after straight away; callers show it and move
+# on, so an attacker only ever delays their own requests.
+#
+# Every check and update is a dictionary lookup under one lock, and both maps are LRU-bounded by
+# max_entries. Locked account records are kept in a map of their own that is never evicted from, so
+# a flood of new keys cannot lift a lockout and eviction never has to step over locked records. A
+# record moves back to the LRU map when its lockout has ended and it is next touched, or in a sweep
+# that runs each time the locked map has doubled in size, so that map only holds more than
+# max_entries records while that many keys are locked at once. Pass
+# db (a ConnectionManager on a BankService database) to keep account records in the login_throttle
+# table, so a restart does not lift a lockout: they are loaded once at start-up and written only when
+# an attempt fails or a failing account logs in, so honest logins never touch the database. Records
+# for logins that match no account (failure(..., persist=False)) and source buckets stay in memory,
+# so attacker-chosen names cannot grow the table, and rows that no longer matter are deleted when
+# the records are loaded.
+#
+#   db = ConnectionManager("users.db")
+#   service = BankService("users.db", db=db, throttle=LoginThrottle(max_failures=3, base_lockout=60, db=db))
+
+
+class LoginThrottle:
+    def __init__(self, max_failures=3, base_lockout=60.0, max_lockout=3_600.0, source_rate=0.5, source_burst=20, max_entries=100_000, db=None, clock=time.time):
+        if max_failures < 1:
+            raise ValueError("max_failures must be at least 1")
+        if source_burst < 1 or source_rate <= 0:
+            raise ValueError("source_burst must be at least 1 and source_rate positive")
+        self.max_failures = max_failures
+        self.base_lockout = base_lockout
+        self.max_lockout = max_lockout
+        self.source_rate = source_rate
+        self.source_burst = source_burst
+        self.max_entries = max_entries
+        self.db = db
+        self.clock = clock
+        self.rejected = 0
+
+        self._lock = threading.Lock()
+        # key -> [failures since the last lockout, lockouts so far, locked_until], least recently
+        # used first; records that were locked when last stored are in _locked instead
+        self._accounts = OrderedDict()
+        self._locked = {}
+        self._sweep_at = max_entries
+        # source -> [tokens, updated_at]
+        self._sources = OrderedDict()
+        # Stored records are read on first use, once BankService has created the table
+        self._loaded = db is None
+
+    def _load(self):
+        self._loaded = True
+        # Records whose lockout ended more than max_lockout ago no longer matter
+        expired = self.clock() - self.max_lockout
+        self.db.run(lambda conn: conn.execute("DELETE FROM login_throttle WHERE locked_until <= ? AND failures = 0", (expired,)))
+        rows = self.db.connection().execute(
+            "SELECT key, failures, lockouts, locked_until FROM login_throttle WHERE locked_until > ? OR failures > 0",
+            (expired,),
+        )
+        now = self.clock()
+        for key, failures, lockouts, locked_until in rows:
+            self._store(key, [failures, lockouts, locked_until], now)
+
+    # Stores value as the newest entry of table and evicts the oldest ones past max_entries
+    def _remember(self, table, key, value):
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    # Stores an account record in _locked while it is locked, else in the LRU map
+    def _store(self, key, record, now):
+        if record[2] <= now:
+            self._remember(self._accounts, key, record)
+            return
+        self._locked[key] = record
+        if len(self._locked) > self._sweep_at:
+            # Lockouts that have ended go back to the LRU map
+            for ended in [key for key, record in self._locked.items() if record[2] <= now]:
+                self._remember(self._accounts, ended, self._locked.pop(ended))
+            self._sweep_at = max(self.max_entries, 2 * len(self._locked))
+
+    def _save(self, key, record):
+        if self.db is None:
+            return
+        if record is None:
+            self.db.run(lambda conn: conn.execute("DELETE FROM login_throttle WHERE key = ?", (key,)))
+        else:
+            self.db.run(lambda conn: conn.execute(
+                "INSERT INTO login_throttle (key, failures, lockouts, locked_until) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET failures = excluded.failures, lockouts = excluded.lockouts, locked_until = excluded.locked_until",
+                (key,) + tuple(record),
+            ))
+
+    # Source tokens as of now, refilled since the bucket was last touched
+    def _tokens(self, source, now):
+        bucket = self._sources.get(source)
+        if bucket is None:
+            return self.source_burst
+        return min(self.source_burst, bucket[0] + (now - bucket[1]) * self.source_rate)
+
+    # Raises ThrottledError if key (e.g. "login:42") or source may not try again yet
+    def check(self, key, source=None):
+        now = self.clock()
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            record = self._locked.get(key)
+            if record is not None and record[2] > now:
+                self.rejected += 1
+                raise ThrottledError(record[2] - now)
+            if source is not None and self._tokens(source, now) < 1:
+                self.rejected += 1
+                raise ThrottledError((1 - self._tokens(source, now)) / self.source_rate)
+
+    # Records a failed attempt; returns the seconds key is now locked for (0 if it is not).
+    # persist=False keeps the record in memory only, for keys that match no account.
+    def failure(self, key, source=None, persist=True):
+        now = self.clock()
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if source is not None:
+                self._remember(self._sources, source, [self._tokens(source, now) - 1, now])
+
+            record = self._locked.pop(key, None) or self._accounts.pop(key, None)
+            # Lockouts stop doubling once the last one ended max_lockout ago
+            if record is None or (record[1] and record[2] <= now - self.max_lockout):
+                record = [0, 0, 0.0]
+            record[0] += 1
+            locked_for = 0
+            if record[0] >= self.max_failures:
+                locked_for = min(self.base_lockout * 2 ** record[1], self.max_lockout)
+                record = [0, record[1] + 1, now + locked_for]
+            self._store(key, record, now)
+            saved = list(record)
+        if persist:
+            self._save(key, saved)
+        return locked_for
+
+    # Clears key's record after a successful attempt
+    def success(self, key):
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            record = self._locked.pop(key, None) or self._accounts.pop(key, None)
+        if record is not None:
+            self._save(key, None)
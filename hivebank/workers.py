@@ -0,0 +1,468 @@
+import argparse
+import logging
+import multiprocessing
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+
+from .bulk import BulkImportReport, parse_row, read_rows
+from .errors import BankError, UserNotFoundError, ValidationError
+from .limits import DEFAULT_LIMITS, TransactionLimits
+from .sharding import ShardedBankService
+
+# Multi-process posting for batch settlement.
+#
+# A PostingWorkerPool starts one worker process per shard of a hivebank.sharding bank and
+# partitions postings the way the bank already places accounts: by int(account_number) % shards,
+# the same shard as user_id % shards. Each worker is then the only writer of its shard file, so
+# workers never wait for each other's write locks, and an account's postings are applied in the
+# order they were submitted. (A single-file bank has one write lock that processes could only take
+# turns on, so the pool needs a sharded one.) Workers apply their queue like a GroupCommitWriter:
+# up to max_batch postings per transaction, each in its own SAVEPOINT, so a refused posting only
+# fails itself.
+#
+# A transfer to an account in another partition goes through the bank's transfer outbox with an
+# ordered handoff:
+#   1. the pool queues the transfer on the sender's worker and a credit marker on the recipient's
+#      worker, each in submission order;
+#   2. the sender's worker debits the sender and writes the outbox entry, and once that commits it
+#      hands the entry (or the refusal) to the recipient's worker;
+#   3. the recipient's worker credits the recipient through the inbox (so at most once) once the
+#      handoff has arrived;
+#   4. when the run finishes, the pool clears credited entries from the outboxes.
+# Until its handoff arrives, a marker holds back only the postings queued after it that touch the
+# same account; the worker carries on with the rest. So every account sees its postings, incoming
+# credits included, in submission order, and the results are the same as posting the file one row
+# at a time. A worker that has nothing else to do has committed and handed over everything it
+# posted, and a marker only waits for a posting queued before it, so workers cannot wait for each
+# other in a cycle. After a crash the debits' outbox entries are still there, and deliver_pending()
+# credits the missing ones when the bank is next opened.
+#
+# Withdrawals and transfers are held to the same transaction limits as hivebank.bulk and the server
+# (DEFAULT_LIMITS unless the pool is given other Limit rules, or None). Every worker keeps its own
+# TransactionLimits, which is exact because each account is only ever debited by its own worker.
+#
+# The pool sends rows to the workers in chunks of chunk_size, on one queue per worker that also
+# carries the handoffs, and stops reading once max_pending items are queued but not yet applied.
+# Workers report after every commit; stats() gives, per worker, the postings applied, postings per
+# second, time spent posting and waiting for handoffs, and queue depth.
+#
+#   python -m hivebank.workers settlement.csv --db bank-data --shards 4 --progress 5 --report results.csv
+
+logger = logging.getLogger("hivebank.workers")
+
+
+# Partition of an account number, or None if it cannot name an account
+def partition_of(account_number, partitions):
+    if not (account_number.isascii() and account_number.isdigit()):
+        return None
+    return int(account_number) % partitions
+
+
+class _Worker:
+    def __init__(self, index, bank, queues, results, max_batch):
+        self.index = index
+        self.bank = bank
+        self.shard = bank.shards[index]
+        self.partitions = bank.shard_count
+        self.queue = queues[index]
+        self.queues = queues
+        self.results = results
+        self.max_batch = max_batch
+        # sequence -> (source partition, outbox message or None if the debit was refused)
+        self.arrived = {}
+        self.waited = 0.0
+
+    def run(self):
+        pending = []
+        stopping = self._receive(pending, block=True)
+        while pending or not stopping:
+            if not pending:
+                stopping = self._receive(pending, block=True)
+            elif not self._commit(pending):
+                # Everything left waits for a handoff, and everything posted here is committed and
+                # handed over, so no worker is waiting on this one
+                started = time.perf_counter()
+                stopping = self._receive(pending, block=True) or stopping
+                self.waited += time.perf_counter() - started
+            stopping = self._receive(pending, block=False) or stopping
+
+    # Takes every message waiting on this worker's queue (blocking for the first one if block):
+    # chunks of postings from the pool and handoffs from other workers. Returns True once the pool
+    # has sent the stop message.
+    def _receive(self, pending, block):
+        stopping = False
+        while True:
+            try:
+                message = self.queue.get() if block else self.queue.get_nowait()
+            except queue.Empty:
+                return stopping
+            block = False
+            if message is None:
+                stopping = True
+            elif message[0] == "chunk":
+                pending.extend(message[1])
+            else:
+                _, sequence, source, outbox_message = message
+                self.arrived[sequence] = (source, outbox_message)
+
+    # The partition to hand a transfer over to, or None if it is posted here alone
+    def _handoff_target(self, posting_type, recipient_account):
+        if posting_type != "transfer":
+            return None
+        target = partition_of(recipient_account, self.partitions)
+        return None if target is None or target == self.index else target
+
+    # Accounts on this shard an item posts to
+    def _accounts(self, item):
+        if item[0] == "credit":
+            return (item[2],)
+        posting_type, account_number, recipient_account = item[3], item[4], item[6]
+        if posting_type == "transfer" and self._handoff_target(posting_type, recipient_account) is None:
+            return (account_number, recipient_account)
+        return (account_number,)
+
+    # Applies up to max_batch pending items in one transaction and returns how many it applied.
+    # A credit whose handoff has not arrived is skipped, and so is every later item that touches an
+    # account a skipped item touches, so each account's postings still apply in submission order.
+    def _commit(self, pending):
+        started = time.perf_counter()
+
+        # Rebuilt from scratch if the transaction has to be retried
+        def apply(conn):
+            outcomes = []
+            handoffs = []
+            credited = []
+            applied = []
+            blocked = set()
+            for position, item in enumerate(pending):
+                if len(applied) >= self.max_batch:
+                    break
+                accounts = self._accounts(item)
+                if blocked.intersection(accounts) or (item[0] == "credit" and item[1] not in self.arrived):
+                    blocked.update(accounts)
+                    continue
+                applied.append(position)
+
+                if item[0] == "credit":
+                    source, message = self.arrived[item[1]]
+                    if message is not None and self._credit(conn, source, message):
+                        credited.append((source, message[0]))
+                    continue
+
+                _, sequence, line, posting_type, account_number, amount, recipient_account = item
+                target = self._handoff_target(posting_type, recipient_account)
+                conn.execute("SAVEPOINT posting")
+                try:
+                    message = self._post(conn, posting_type, account_number, amount, recipient_account, target)
+                except BankError as exc:
+                    conn.execute("ROLLBACK TO posting")
+                    conn.execute("RELEASE posting")
+                    outcomes.append((line, "rejected", str(exc)))
+                    message = None
+                else:
+                    conn.execute("RELEASE posting")
+                    outcomes.append((line, "posted", None))
+                if target is not None:
+                    handoffs.append((target, sequence, message))
+            return applied, outcomes, handoffs, credited
+
+        applied, outcomes, handoffs, credited = self.shard.db.run(apply)
+        if not applied:
+            return 0
+        busy = time.perf_counter() - started
+
+        for position in applied:
+            item = pending[position]
+            if item[0] == "credit":
+                del self.arrived[item[1]]
+        applied = set(applied)
+        pending[:] = [item for position, item in enumerate(pending) if position not in applied]
+        # Only committed debits are handed over
+        for target, sequence, message in handoffs:
+            self.queues[target].put(("handoff", sequence, self.index, message))
+        self.results.put(("batch", self.index, len(applied), outcomes, credited, busy, self.waited, time.process_time()))
+        self.waited = 0.0
+        return len(applied)
+
+    def _post(self, conn, posting_type, account_number, amount, recipient_account, target):
+        user = conn.execute("SELECT user_id FROM users WHERE account_number = ?", (account_number,)).fetchone()
+        if not user:
+            raise UserNotFoundError("User not found.")
+        if posting_type == "deposit":
+            self.shard.deposit(user[0], amount)
+        elif posting_type == "withdrawal":
+            self.shard.withdrawal(user[0], amount)
+        elif target is None:
+            self.shard.transfer(user[0], recipient_account, amount)
+        else:
+            return self.bank._debit_cross_shard(user[0], recipient_account, amount)[1]
+        return None
+
+    # Credits one handed-over transfer; a credit that fails stays in the sender's outbox
+    def _credit(self, conn, source, message):
+        conn.execute("SAVEPOINT credit")
+        try:
+            self.bank._credit(source, message)
+        except BankError:
+            conn.execute("ROLLBACK TO credit")
+            conn.execute("RELEASE credit")
+            logger.exception("Credit for outbox entry %s of shard %s is pending", message[0], source)
+            return False
+        conn.execute("RELEASE credit")
+        return True
+
+
+def _run_worker(index, directory, shards, connection_options, queues, results, max_batch, limits):
+    try:
+        limits = None if limits is None else TransactionLimits(limits)
+        bank = ShardedBankService(directory, shards, limits=limits, recover=False, **connection_options)
+        try:
+            _Worker(index, bank, queues, results, max_batch).run()
+        finally:
+            bank.close()
+    except BaseException:
+        results.put(("error", index, traceback.format_exc()))
+        raise
+    results.put(("exit", index))
+
+
+class PostingWorkerPool:
+    # Opens (or creates) the sharded bank in directory and finishes anything an earlier run left in
+    # its outboxes. limits is a list of hivebank.limits.Limit rules for withdrawals and transfers, or
+    # None for no limits. connection_options are passed to every ConnectionManager.
+    def __init__(self, directory, shards=4, max_batch=256, chunk_size=64, max_pending=100_000, limits=DEFAULT_LIMITS, **connection_options):
+        if max_batch < 1 or chunk_size < 1:
+            raise ValueError("max_batch and chunk_size must be at least 1")
+        self.directory = directory
+        self.max_batch = max_batch
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending
+        self.limits = None if limits is None else list(limits)
+        self.connection_options = connection_options
+
+        self.bank = ShardedBankService(directory, shards, **connection_options)
+        self.partitions = self.bank.shard_count
+        # Workers open their own connections; none may be inherited across fork
+        self.bank.close()
+
+        self.report = BulkImportReport()
+        self.leftover = 0
+        self.processes = []
+        self._sequence = 0
+        self._buffers = [[] for _ in range(self.partitions)]
+        self._queued = [0] * self.partitions
+        self._applied = [0] * self.partitions
+        self._postings = [0] * self.partitions
+        self._credits = [0] * self.partitions
+        self._batches = [0] * self.partitions
+        self._busy = [0.0] * self.partitions
+        self._waiting = [0.0] * self.partitions
+        self._cpu = [0.0] * self.partitions
+        self._max_depth = [0] * self.partitions
+        # source partition -> outbox ids credited by other workers
+        self._credited = [[] for _ in range(self.partitions)]
+        self._failure = None
+        self._lock = threading.Lock()
+        self._progress = threading.Condition(self._lock)
+
+    def start(self):
+        # One queue per worker carries both the pool's chunks and other workers' handoffs
+        self._queues = [multiprocessing.Queue() for _ in range(self.partitions)]
+        self._results = multiprocessing.Queue()
+        for index in range(self.partitions):
+            process = multiprocessing.Process(
+                target=_run_worker,
+                args=(index, self.directory, self.partitions, self.connection_options, self._queues, self._results, self.max_batch, self.limits),
+                name=f"hivebank-posting-{index}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        self.started_at = time.monotonic()
+        self._collector = threading.Thread(target=self._collect, name="hivebank-posting-results", daemon=True)
+        self._collector.start()
+
+    # Parses and queues one row. Rows must be submitted in the order they are to be posted.
+    def submit(self, line, row):
+        try:
+            posting_type, account_number, amount, recipient_account = parse_row(self.bank, row)
+        except ValidationError as exc:
+            with self._lock:
+                self.report.add(line, "rejected", str(exc))
+            return
+        source = partition_of(account_number, self.partitions)
+        if source is None:
+            with self._lock:
+                self.report.add(line, "rejected", "User not found.")
+            return
+
+        self._sequence += 1
+        self._buffers[source].append(("post", self._sequence, line, posting_type, account_number, amount, recipient_account))
+        full = len(self._buffers[source]) >= self.chunk_size
+        if posting_type == "transfer":
+            target = partition_of(recipient_account, self.partitions)
+            if target is not None and target != source:
+                self._buffers[target].append(("credit", self._sequence, recipient_account))
+                full = full or len(self._buffers[target]) >= self.chunk_size
+        if full:
+            self._flush()
+
+    # Sends every buffered chunk, so no marker is ever queued ahead of its transfer's debit, then
+    # waits while more than max_pending rows are queued
+    def _flush(self):
+        with self._lock:
+            for index, buffer in enumerate(self._buffers):
+                if buffer:
+                    self._queues[index].put(("chunk", buffer))
+                    self._queued[index] += len(buffer)
+                    self._max_depth[index] = max(self._max_depth[index], self._queued[index] - self._applied[index])
+                    self._buffers[index] = []
+            while self._failure is None and sum(self._queued) - sum(self._applied) > self.max_pending:
+                self._progress.wait(0.5)
+            if self._failure is not None:
+                raise RuntimeError(self._failure)
+
+    def _collect(self):
+        running = self.partitions
+        while running:
+            try:
+                message = self._results.get(timeout=0.5)
+            except queue.Empty:
+                dead = [index for index, process in enumerate(self.processes) if process.exitcode not in (None, 0)]
+                if not dead:
+                    continue
+                message = ("error", dead[0], f"exited with code {self.processes[dead[0]].exitcode}")
+
+            with self._lock:
+                if message[0] == "batch":
+                    _, index, used, outcomes, credited, busy, waited, cpu = message
+                    self._applied[index] += used
+                    self._postings[index] += len(outcomes)
+                    self._credits[index] += len(credited)
+                    self._batches[index] += 1
+                    self._busy[index] += busy
+                    self._waiting[index] += waited
+                    self._cpu[index] = cpu
+                    for line, status, reason in outcomes:
+                        self.report.add(line, status, reason)
+                    for source, outbox_id in credited:
+                        self._credited[source].append(outbox_id)
+                elif message[0] == "exit":
+                    running -= 1
+                else:
+                    self._failure = f"Posting worker {message[1]} failed:\n{message[2]}"
+                    running = 0
+                self._progress.notify_all()
+
+    # Per-worker counters: postings applied, incoming credits, postings per second since start,
+    # seconds spent in transactions, CPU seconds used, seconds spent waiting for handoffs, and
+    # queued items (postings and credits) not yet applied
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        with self._lock:
+            return [
+                {
+                    "worker": index,
+                    "postings": self._postings[index],
+                    "credits": self._credits[index],
+                    "batches": self._batches[index],
+                    "postings_per_second": self._postings[index] / elapsed,
+                    "busy_seconds": self._busy[index],
+                    "cpu_seconds": self._cpu[index],
+                    "handoff_wait_seconds": self._waiting[index],
+                    "queue_depth": self._queued[index] - self._applied[index],
+                    "max_queue_depth": self._max_depth[index],
+                }
+                for index in range(self.partitions)
+            ]
+
+    # Posts everything submitted, stops the workers, clears credited outbox entries and returns the
+    # BulkImportReport, in line order
+    def finish(self):
+        try:
+            self._flush()
+            for worker_queue in self._queues:
+                worker_queue.put(None)
+            self._collector.join()
+            if self._failure is not None:
+                raise RuntimeError(self._failure)
+            for process in self.processes:
+                process.join()
+        finally:
+            for process in self.processes:
+                if process.is_alive():
+                    process.terminate()
+
+        for source, outbox_ids in enumerate(self._credited):
+            if outbox_ids:
+                self.bank._clear_outbox(source, outbox_ids)
+        # Credits that failed are retried here, and stay pending if they fail again
+        try:
+            self.leftover = self.bank.deliver_pending()
+        except (BankError, sqlite3.Error):
+            logger.exception("Some transfer credits are still pending")
+        finally:
+            self.bank.close()
+        self.report.results.sort(key=lambda result: result["line"])
+        return self.report
+
+    # Posts (line_number, row) pairs with the workers; progress(stats()) is called every progress_every seconds
+    def import_rows(self, rows, progress=None, progress_every=5.0):
+        self.start()
+        next_progress = time.monotonic() + progress_every
+        for line, row in rows:
+            self.submit(line, row)
+            if progress is not None and time.monotonic() >= next_progress:
+                progress(self.stats())
+                next_progress = time.monotonic() + progress_every
+        report = self.finish()
+        if progress is not None:
+            progress(self.stats())
+        return report
+
+    def import_file(self, path, progress=None, progress_every=5.0):
+        return self.import_rows(read_rows(path), progress, progress_every)
+
+
+def print_stats(stats):
+    for worker in stats:
+        print(
+            f"  worker {worker['worker']}: {worker['postings']} postings ({worker['postings_per_second']:,.0f}/s), "
+            f"{worker['credits']} credits, {worker['batches']} batches, busy {worker['busy_seconds']:.1f}s, cpu {worker['cpu_seconds']:.1f}s, "
+            f"waiting {worker['handoff_wait_seconds']:.1f}s, queue {worker['queue_depth']} (max {worker['max_queue_depth']})"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Post a settlement file with one worker process per shard of a sharded bank.")
+    parser.add_argument("path", help="CSV (with header) or JSONL file of postings, as for hivebank.bulk")
+    parser.add_argument("--db", required=True, help="sharded bank directory")
+    parser.add_argument("--shards", type=int, required=True, help="number of shards (one worker each)")
+    parser.add_argument("--max-batch", type=int, default=256, help="postings per transaction (default: 256)")
+    parser.add_argument("--progress", type=float, help="print per-worker throughput and queue depth every this many seconds")
+    parser.add_argument("--report", help="write the per-row results to this CSV file")
+    parser.add_argument("--no-limits", action="store_true", help="do not enforce the default withdrawal and transfer limits (hivebank.limits)")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    pool = PostingWorkerPool(args.db, args.shards, max_batch=args.max_batch, limits=None if args.no_limits else DEFAULT_LIMITS)
+    try:
+        report = pool.import_file(args.path, print_stats if args.progress else None, args.progress or 5.0)
+    except RuntimeError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+
+    if args.report:
+        report.write_csv(args.report)
+    print(f"Posted: {report.posted}  Rejected: {report.rejected}  in {time.monotonic() - started:.1f}s")
+    if not args.progress:
+        print_stats(pool.stats())
+    return 0 if report.rejected == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hivebank import BankService, CredentialHasher
+from hivebank.sharding import ShardedBankService
+
+# Credentials are never checked in these tests, so the cheapest KDF setting keeps sign ups fast
+FAST_HASHER = CredentialHasher(n=2, workers=0)
+
+
+# Signs up count accounts with opening_balance each and returns their account numbers
+def seed_accounts(bank, count, opening_balance=5_000):
+    return [
+        bank.sign_up("Test", "Bank", "User", f"user{i}", f"user{i}@example.com", "Passw0rd!", "1234", opening_balance)["account_number"]
+        for i in range(count)
+    ]
+
+
+# Signs up one account called name with the minimum opening deposit
+def sign_up(bank, name, initial_deposit=2_000):
+    return bank.sign_up("Test", "Bank", "User", name, f"{name}@example.com", "Passw0rd!", "1234", initial_deposit)
+
+
+# Balance of every account in a sharded bank, by account number
+def balances(bank):
+    result = {}
+    for shard in bank.shards:
+        result.update(shard.db.connection().execute("SELECT account_number, ROUND(balance, 2) FROM users"))
+    return result
+
+
+@pytest.fixture
+def sharded_bank(tmp_path):
+    bank = ShardedBankService(str(tmp_path / "bank"), 2, hasher=FAST_HASHER)
+    yield bank
+    bank.close()
+
+
+@pytest.fixture
+def bank(tmp_path):
+    service = BankService(str(tmp_path / "users.db"), hasher=FAST_HASHER)
+    yield service
+    service.close()
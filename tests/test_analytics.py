@@ -0,0 +1,44 @@
+import pytest
+
+from hivebank.migrate_ledger import LedgerMigration
+
+from conftest import sign_up
+from test_migrate_ledger import TWIN_ACCOUNTS, TWIN_TRANSFERS, legacy_database
+
+
+def test_counterparties_with_the_same_name_are_kept_apart(bank, tmp_path):
+    pytest.importorskip("numpy")
+    from hivebank.analytics import TransactionStore
+
+    # sign_up gives every account the same full name
+    ann, bob, carol = sign_up(bank, "ann"), sign_up(bank, "bob"), sign_up(bank, "carol")
+    bank.transfer(ann["user_id"], bob["account_number"], 30)
+    bank.transfer(ann["user_id"], carol["account_number"], 20)
+    bank.transfer(carol["user_id"], ann["account_number"], 5)
+
+    store = TransactionStore(str(tmp_path / "analytics"))
+    store.refresh(bank)
+    expected = [
+        {"counterparty_id": bob["user_id"], "name": "Test Bank User", "sent_to": 30.0, "received_from": 0.0, "transfers": 1},
+        {"counterparty_id": carol["user_id"], "name": "Test Bank User", "sent_to": 20.0, "received_from": 5.0, "transfers": 2},
+    ]
+    assert store.top_counterparties(ann["user_id"]) == expected
+    # And again once read back from disk
+    assert TransactionStore(str(tmp_path / "analytics")).top_counterparties(ann["user_id"]) == expected
+
+
+def test_legacy_rows_without_an_id_fall_back_to_their_name(tmp_path):
+    pytest.importorskip("numpy")
+    from hivebank.analytics import TransactionStore
+
+    service = legacy_database(str(tmp_path / "users.db"), TWIN_ACCOUNTS, TWIN_TRANSFERS)
+    # Before the migration Ben's two counterparties are only known as "Ada Eze Obi"
+    store = TransactionStore()
+    store.refresh(service)
+    assert [(row["counterparty_id"], row["transfers"]) for row in store.top_counterparties(3)] == [(None, 2)]
+
+    LedgerMigration(service).run()
+    store = TransactionStore()
+    store.refresh(service)
+    assert [(row["counterparty_id"], row["transfers"]) for row in store.top_counterparties(3)] == [(1, 1), (2, 1)]
+    service.close()
@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+from hivebank.archive import Archiver
+from hivebank.errors import TooManyArchivesError
+from hivebank.ledger import balance_at, balances_at
+from hivebank.reconcile import Reconciler
+from hivebank.service import attach_limit, to_epoch
+
+from conftest import sign_up
+
+# More yearly archives than SQLite attaches to one connection by default
+YEARS = list(range(2010, 2024))
+
+
+# Posts one deposit on 1 March of every year in YEARS and archives them all
+def archived_bank(bank):
+    ann = sign_up(bank, "ann")
+    for year in YEARS:
+        bank._now = lambda: to_epoch(datetime.date(year, 3, 1))
+        bank.deposit(ann["user_id"], year - 2000)
+    del bank._now
+    moved = Archiver(bank, max_age_days=1, chunk_size=3).run(datetime.date(2025, 1, 1))
+    assert moved == len(YEARS)
+    return ann
+
+
+def test_more_archives_than_sqlite_can_attach_are_read_in_batches(bank):
+    assert len(YEARS) > attach_limit(bank.db.connection())
+    ann = archived_bank(bank)
+
+    history = bank.transaction_history(ann["user_id"])
+    assert [row["amount"] for row in history] == [year - 2000 for year in reversed(YEARS)]
+    assert balance_at(bank, ann["user_id"], datetime.date(2010, 12, 31)) == 2_010
+    assert balance_at(bank, ann["user_id"], datetime.date(2024, 1, 1)) == 2_000 + sum(year - 2000 for year in YEARS)
+
+
+def test_analytics_loads_every_archive_in_batches(bank):
+    pytest.importorskip("numpy")
+    from hivebank.analytics import TransactionStore
+
+    archived_bank(bank)
+    assert TransactionStore().refresh(bank) == len(YEARS)
+
+
+def test_reads_that_need_every_archive_at_once_fail_clearly(bank):
+    archived_bank(bank)
+    conn = bank.db.connection()
+    archives = conn.execute("SELECT COUNT(*) FROM archives").fetchone()[0]
+
+    with pytest.raises(TooManyArchivesError) as refused:
+        list(balances_at(bank, datetime.date(2024, 1, 1)))
+    assert refused.value.needed == archives
+    with pytest.raises(TooManyArchivesError):
+        Reconciler(bank, workers=0).run()
+    # A range that covers fewer years still works
+    since = to_epoch(datetime.date(2020, 1, 1))
+    assert len(bank.attach_archives(since)) == conn.execute("SELECT COUNT(*) FROM archives WHERE period_end > ?", (since,)).fetchone()[0]
@@ -0,0 +1,167 @@
+import datetime
+import logging
+import os
+
+from hivebank import BankService, Journal, Metrics, Replica
+from hivebank.archive import Archiver
+from hivebank.journal import HEADER, MAGIC, read_journal, recover_balances
+from hivebank.migrate_ledger import LedgerMigration
+from hivebank.service import to_epoch
+
+from conftest import FAST_HASHER, sign_up
+from test_migrate_ledger import legacy_database
+
+
+def primary_with_journal(tmp_path):
+    journal = Journal(str(tmp_path / "users.journal"))
+    bank = BankService(str(tmp_path / "users.db"), hasher=FAST_HASHER, journal=journal)
+    return bank, journal
+
+
+def rows(db):
+    conn = db.connection()
+    return (
+        conn.execute("SELECT user_id, account_number, balance_minor FROM users ORDER BY user_id").fetchall(),
+        conn.execute("SELECT transaction_id, user_id, counterparty_id, type_code, amount_minor, posted_at, balance_after_minor FROM postings ORDER BY transaction_id").fetchall(),
+    )
+
+
+def post_some(bank, ann, bob):
+    bank.deposit(ann["user_id"], 120.50)
+    bank.transfer(ann["user_id"], bob["account_number"], 75.25)
+    bank.withdrawal(bob["user_id"], 10)
+
+
+def test_replica_catches_up_with_the_primary_in_steps(tmp_path):
+    bank, journal = primary_with_journal(tmp_path)
+    ann, bob = sign_up(bank, "ann"), sign_up(bank, "bob")
+    post_some(bank, ann, bob)
+    replica = Replica(str(tmp_path / "replica.db"), journal.path)
+
+    assert replica.catch_up() == 2 + 4
+    assert rows(replica.db) == rows(bank.db)
+
+    post_some(bank, ann, bob)
+    assert replica.catch_up(max_records=1) == 1
+    assert replica.catch_up() == 3
+    assert replica.catch_up() == 0
+    assert rows(replica.db) == rows(bank.db)
+    assert replica.position()[2] == journal.postings_mark
+    replica.close()
+    bank.close()
+    journal.close()
+
+
+def test_a_corrupt_record_stops_the_replay_before_it(tmp_path):
+    bank, journal = primary_with_journal(tmp_path)
+    ann, bob = sign_up(bank, "ann"), sign_up(bank, "bob")
+    post_some(bank, ann, bob)
+    bank.close()
+    journal.close()
+
+    offsets = [len(MAGIC)] + [offset for offset, _, _, _ in read_journal(journal.path)]
+    # Flip one byte in the payload of the fourth record
+    with open(journal.path, "r+b") as journal_file:
+        journal_file.seek(offsets[3] + HEADER.size)
+        byte = journal_file.read(1)
+        journal_file.seek(offsets[3] + HEADER.size)
+        journal_file.write(bytes([byte[0] ^ 0x01]))
+
+    assert len(list(read_journal(journal.path))) == 3
+    replica = Replica(str(tmp_path / "replica.db"), journal.path)
+    assert replica.catch_up() == 3
+    assert replica.position()[0] == offsets[3]
+    replica.close()
+
+
+def test_a_torn_last_record_is_cut_off_and_written_again(tmp_path):
+    bank, journal = primary_with_journal(tmp_path)
+    ann, bob = sign_up(bank, "ann"), sign_up(bank, "bob")
+    post_some(bank, ann, bob)
+    bank.close()
+    journal.close()
+
+    # A crash half way through appending the last record
+    size = os.path.getsize(journal.path)
+    with open(journal.path, "r+b") as journal_file:
+        journal_file.truncate(size - 5)
+
+    bank, journal = primary_with_journal(tmp_path)
+    assert journal.sync(bank.db) == 1
+    assert os.path.getsize(journal.path) == size
+    replica = Replica(str(tmp_path / "replica.db"), journal.path)
+    replica.catch_up()
+    assert rows(replica.db) == rows(bank.db)
+    replica.close()
+    bank.close()
+    journal.close()
+
+
+def test_balances_recover_from_a_snapshot_and_the_journal_after_it(tmp_path):
+    bank, journal = primary_with_journal(tmp_path)
+    ann, bob = sign_up(bank, "ann"), sign_up(bank, "bob")
+    post_some(bank, ann, bob)
+    replica = Replica(str(tmp_path / "replica.db"), journal.path)
+    replica.catch_up()
+    snapshot = replica.snapshot(str(tmp_path / "snapshot.db"))
+    replica.close()
+
+    post_some(bank, ann, bob)
+    carol = sign_up(bank, "carol")
+    bank.transfer(carol["user_id"], ann["account_number"], 1.01)
+
+    expected = dict(bank.db.connection().execute("SELECT user_id, balance_minor FROM users"))
+    assert recover_balances(journal.path, snapshot) == expected
+    restored = Replica.restore(snapshot, str(tmp_path / "restored.db"), journal.path)
+    restored.catch_up()
+    assert rows(restored.db) == rows(bank.db)
+    restored.close()
+    bank.close()
+    journal.close()
+
+
+def test_failed_syncs_are_counted_and_logged_once(tmp_path, caplog):
+    metrics = Metrics()
+    journal = Journal(str(tmp_path / "users.journal"))
+    bank = legacy_database(str(tmp_path / "users.db"), [("Ada Eze Obi", 5_000.0)], [
+        (1, "Ada Eze Obi", None, "CR-Deposit", 10.0, "2025-11-02T12:30:00"),
+    ])
+    bank.journal, bank.metrics = journal, metrics
+
+    # The journal waits for the legacy ledger to be migrated
+    with caplog.at_level(logging.INFO, logger="hivebank.service"):
+        for _ in range(3):
+            bank.deposit(1, 10)
+        LedgerMigration(bank).run()
+        bank.deposit(1, 10)
+
+    assert metrics.journal_failures == {"JournalError": 3}
+    assert [(record.levelname, record.exc_info is not None) for record in caplog.records] == [("ERROR", True), ("INFO", False)]
+    assert journal.postings_mark == bank.db.connection().execute("SELECT MAX(transaction_id) FROM postings").fetchone()[0]
+    bank.close()
+    journal.close()
+
+
+def test_rows_are_only_archived_once_journaled(tmp_path):
+    journal = Journal(str(tmp_path / "users.journal"))
+    bank = BankService(str(tmp_path / "users.db"), hasher=FAST_HASHER)
+    ann, bob = sign_up(bank, "ann"), sign_up(bank, "bob")
+    bank._now = lambda: to_epoch(datetime.date(2024, 3, 1))
+    post_some(bank, ann, bob)
+    journal.sync(bank.db)
+    # Posted behind the journal's back, so it has not seen these yet
+    post_some(bank, ann, bob)
+
+    archiver = Archiver(bank, max_age_days=30, journal=journal)
+    cutoff = archiver.cutoff(datetime.date(2025, 1, 1))
+    archiver._prepare([2024])
+    bank.db.run(lambda conn: archiver._register(conn, [2024], cutoff))
+    assert archiver.step(cutoff) == 4
+    assert archiver.step(cutoff) == 0
+
+    # A run syncs the journal first, then archives the rest
+    assert archiver.run(datetime.date(2025, 1, 1)) == 4
+    events = [event for _, _, _, event in read_journal(journal.path) if event["e"] == "posting"]
+    assert len(events) == 8
+    bank.close()
+    journal.close()
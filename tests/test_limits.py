@@ -0,0 +1,113 @@
+import datetime
+
+import pytest
+
+from hivebank import BankService
+from hivebank.bulk import BulkImporter
+from hivebank.errors import InsufficientFundsError, LimitExceededError
+from hivebank.limits import Limit, TransactionLimits
+from hivebank.service import TRANSFER_OUT, WITHDRAWAL, to_epoch
+
+from conftest import FAST_HASHER, sign_up
+from test_migrate_ledger import legacy_database
+
+DAILY_WITHDRAWALS = Limit("daily withdrawals", 86_400, max_amount=1_000, transaction_types=[WITHDRAWAL])
+TRANSFER_VELOCITY = Limit("transfer velocity", 600, max_count=3, transaction_types=[TRANSFER_OUT])
+
+
+# A bank whose clock is whatever clock[0] holds
+def limited_bank(path, clock):
+    bank = BankService(path, hasher=FAST_HASHER, limits=TransactionLimits([DAILY_WITHDRAWALS, TRANSFER_VELOCITY]))
+    bank._now = lambda: clock[0]
+    return bank
+
+
+def test_amount_limit_refuses_the_excess_and_reports_what_is_left(tmp_path):
+    clock = [1_700_000_000]
+    bank = limited_bank(str(tmp_path / "users.db"), clock)
+    ann = sign_up(bank, "ann", 5_000)
+
+    bank.withdrawal(ann["user_id"], 600)
+    with pytest.raises(LimitExceededError) as refused:
+        bank.withdrawal(ann["user_id"], 500)
+    assert refused.value.limit == "daily withdrawals"
+    assert refused.value.available == 400
+    bank.withdrawal(ann["user_id"], 400)
+
+    # A day later the first withdrawal has left the window
+    clock[0] += 86_400
+    bank.withdrawal(ann["user_id"], 600)
+    bank.close()
+
+
+def test_count_limit_ignores_refused_and_rolled_back_postings(tmp_path):
+    clock = [1_700_000_000]
+    bank = limited_bank(str(tmp_path / "users.db"), clock)
+    ann, bob = sign_up(bank, "ann"), sign_up(bank, "bob")
+
+    bank.transfer(ann["user_id"], bob["account_number"], 10)
+    # Passes the limit check, then fails on the balance and rolls back
+    with pytest.raises(InsufficientFundsError):
+        bank.transfer(ann["user_id"], bob["account_number"], 5_000)
+    bank.transfer(ann["user_id"], bob["account_number"], 10)
+    bank.transfer(ann["user_id"], bob["account_number"], 10)
+    with pytest.raises(LimitExceededError) as refused:
+        bank.transfer(ann["user_id"], bob["account_number"], 10)
+    assert refused.value.limit == "transfer velocity"
+    assert bank.limits.refused == 1
+    bank.close()
+
+
+def test_a_restarted_bank_reads_the_window_back_from_the_ledger(tmp_path):
+    clock = [1_700_000_000]
+    path = str(tmp_path / "users.db")
+    bank = limited_bank(path, clock)
+    ann = sign_up(bank, "ann", 5_000)
+    bank.withdrawal(ann["user_id"], 900)
+    bank.close()
+
+    clock[0] += 60
+    bank = limited_bank(path, clock)
+    with pytest.raises(LimitExceededError):
+        bank.withdrawal(ann["user_id"], 200)
+    bank.withdrawal(ann["user_id"], 100)
+    bank.close()
+
+
+def test_bulk_batch_refuses_rows_past_the_limit_and_posts_the_rest(tmp_path):
+    clock = [1_700_000_000]
+    bank = limited_bank(str(tmp_path / "users.db"), clock)
+    ann, bob = sign_up(bank, "ann", 5_000), sign_up(bank, "bob")
+    rows = [
+        {"type": "withdrawal", "account_number": ann["account_number"], "amount": 700},
+        {"type": "withdrawal", "account_number": ann["account_number"], "amount": 400},
+        {"type": "deposit", "account_number": ann["account_number"], "amount": 50},
+        {"type": "withdrawal", "account_number": ann["account_number"], "amount": 300},
+    ] + [
+        {"type": "transfer", "account_number": ann["account_number"], "recipient_account": bob["account_number"], "amount": 1}
+    ] * 4
+
+    report = BulkImporter(bank, batch_size=len(rows)).import_rows(enumerate(rows, start=1))
+
+    assert [result["status"] for result in report.results] == ["posted", "rejected", "posted", "posted", "posted", "posted", "posted", "rejected"]
+    assert report.results[1]["reason"] == "This would exceed your daily withdrawals limit."
+    assert report.results[7]["reason"] == "This would exceed your transfer velocity limit."
+    assert bank.account_details(ann["user_id"])["balance"] == 5_000 - 700 + 50 - 300 - 3
+
+    # The batch's postings count against later single postings too
+    with pytest.raises(LimitExceededError):
+        bank.withdrawal(ann["user_id"], 1)
+    bank.close()
+
+
+def test_legacy_rows_not_yet_migrated_count_towards_the_window(tmp_path):
+    bank = legacy_database(str(tmp_path / "users.db"), [("Ada Eze Obi", 5_000.0)], [
+        (1, "Ada Eze Obi", None, "DR-Withdrawal", 900.0, "2025-11-02T12:30:00"),
+    ])
+    bank.limits = TransactionLimits([DAILY_WITHDRAWALS])
+    bank._now = lambda: to_epoch(datetime.datetime(2025, 11, 2, 13, 0))
+
+    with pytest.raises(LimitExceededError):
+        bank.withdrawal(1, 200)
+    bank.withdrawal(1, 100)
+    bank.close()
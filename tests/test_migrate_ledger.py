@@ -0,0 +1,113 @@
+import sqlite3
+
+from hivebank import BankService
+from hivebank.migrate_ledger import LedgerMigration
+from hivebank.service import to_epoch
+
+from conftest import FAST_HASHER
+
+# The users and transactions tables as the banking application wrote them before the compact ledger
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    full_name TEXT NOT NULL CHECK (full_name <> ''),
+    username TEXT NOT NULL UNIQUE CHECK (username <> ''),
+    email TEXT NOT NULL UNIQUE CHECK (email <> ''),
+    password TEXT NOT NULL CHECK (password <> ''),
+    pin TEXT NOT NULL,
+    initial_deposit INTEGER NOT NULL CHECK (initial_deposit >= 2000),
+    account_number TEXT NOT NULL UNIQUE,
+    balance REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE transactions (
+    transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    full_name TEXT NOT NULL,
+    recipient_name TEXT,
+    transaction_type TEXT NOT NULL,
+    amount REAL NOT NULL CHECK (amount > 0),
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+"""
+
+
+# A legacy database whose accounts are (full_name, balance) and whose transactions are
+# (user_id, full_name, recipient_name, transaction_type, amount, timestamp)
+def legacy_database(path, accounts, transactions):
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.executemany(
+        "INSERT INTO users (full_name, username, email, password, pin, initial_deposit, account_number, balance) VALUES (?, ?, ?, 'x', 'x', 2000, ?, ?)",
+        [(name, f"user{i}", f"user{i}@example.com", f"{10_000_000 + i}", balance) for i, (name, balance) in enumerate(accounts)],
+    )
+    conn.executemany("INSERT INTO transactions (user_id, full_name, recipient_name, transaction_type, amount, timestamp) VALUES (?, ?, ?, ?, ?, ?)", transactions)
+    conn.commit()
+    conn.close()
+    return BankService(path, hasher=FAST_HASHER)
+
+
+def postings(service):
+    return service.db.connection().execute("SELECT transaction_id, user_id, counterparty_id, type_code, posted_at FROM postings ORDER BY transaction_id").fetchall()
+
+
+# Two accounts share a name, so only the legs of each transfer can tell who the other party was
+TWIN_ACCOUNTS = [("Ada Eze Obi", 3_000.0), ("Ada Eze Obi", 2_500.0), ("Ben Ike Udo", 1_500.0)]
+TWIN_TRANSFERS = [
+    (1, "Ada Eze Obi", "Ben Ike Udo", "DR-Transfer To", 500.0, "2025-11-02T12:43:31.967324"),
+    (3, "Ada Eze Obi", "Ben Ike Udo", "CR-Transfer From", 500.0, "2025-11-02T12:43:31.967878"),
+    (3, "Ben Ike Udo", "Ada Eze Obi", "DR-Transfer To", 250.0, "2025-11-02T13:00:00.999990"),
+    (2, "Ben Ike Udo", "Ada Eze Obi", "CR-Transfer From", 250.0, "2025-11-02T13:00:01.000200"),
+]
+
+
+def test_transfer_legs_are_paired_despite_microsecond_timestamps(tmp_path):
+    service = legacy_database(str(tmp_path / "users.db"), TWIN_ACCOUNTS, TWIN_TRANSFERS)
+    try:
+        migration = LedgerMigration(service)
+        assert migration.run()
+        assert [(row[1], row[2]) for row in postings(service)] == [(1, 3), (3, 1), (3, 2), (2, 3)]
+        assert (migration.by_name, migration.name_only) == (0, 0)
+    finally:
+        service.close()
+
+
+def test_legs_in_different_chunks_are_paired(tmp_path):
+    service = legacy_database(str(tmp_path / "users.db"), TWIN_ACCOUNTS, TWIN_TRANSFERS)
+    try:
+        migration = LedgerMigration(service, chunk_size=1)
+        assert migration.run()
+        assert [(row[1], row[2]) for row in postings(service)] == [(1, 3), (3, 1), (3, 2), (2, 3)]
+    finally:
+        service.close()
+
+
+def test_unpaired_leg_with_a_shared_name_becomes_a_name_only_counterparty(tmp_path):
+    transfers = [(3, "Ben Ike Udo", "Ada Eze Obi", "DR-Transfer To", 250.0, "2025-11-02T13:00:00")]
+    service = legacy_database(str(tmp_path / "users.db"), TWIN_ACCOUNTS, transfers)
+    try:
+        migration = LedgerMigration(service)
+        migration.run()
+        counterparty_id = postings(service)[0][2]
+        assert counterparty_id < 0
+        assert migration.name_only == 1
+    finally:
+        service.close()
+
+
+def test_rows_without_a_timestamp_are_dated_from_their_neighbours(tmp_path):
+    transactions = [
+        (1, "Ada Eze Obi", None, "CR-Deposit", 100.0, "2025-11-02T12:00:00"),
+        (1, "Ada Eze Obi", None, "DR-Withdrawal", 50.0, None),
+        (1, "Ada Eze Obi", None, "CR-Deposit", 10.0, "not a date"),
+    ]
+    service = legacy_database(str(tmp_path / "users.db"), TWIN_ACCOUNTS, transactions)
+    try:
+        migration = LedgerMigration(service, chunk_size=2)
+        assert migration.run()
+        dated = to_epoch("2025-11-02T12:00:00")
+        assert [row[4] for row in postings(service)] == [dated, dated, dated]
+        assert migration.undated == 2
+        assert migration.migrated == 3
+    finally:
+        service.close()
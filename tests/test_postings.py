@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+from hivebank.errors import InsufficientFundsError, UserNotFoundError
+
+from conftest import sign_up
+
+
+# Runs attempt(n) for n in range(attempts) on each of threads threads, all released at once;
+# returns how many attempts succeeded
+def run_concurrently(threads, attempts, attempt):
+    barrier = threading.Barrier(threads)
+    succeeded = []
+
+    def work():
+        barrier.wait()
+        for n in range(attempts):
+            try:
+                attempt(n)
+            except InsufficientFundsError:
+                continue
+            succeeded.append(n)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(succeeded)
+
+
+def posting_count(bank, user_id):
+    return bank.db.connection().execute("SELECT COUNT(*) FROM postings WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def test_concurrent_withdrawals_never_overdraw(bank):
+    ann = sign_up(bank, "ann")
+
+    # 8 threads ask for 4,000 in total from a balance of 2,000
+    succeeded = run_concurrently(8, 50, lambda n: bank.withdrawal(ann["user_id"], 10))
+
+    assert succeeded == 200
+    assert bank.account_details(ann["user_id"])["balance"] == 0
+    # One posting per successful withdrawal, and none for refused ones
+    assert posting_count(bank, ann["user_id"]) == 200
+
+
+def test_concurrent_transfers_both_ways_conserve_money(bank):
+    ann, bob = sign_up(bank, "ann"), sign_up(bank, "bob")
+
+    def attempt(n):
+        if n % 2:
+            bank.transfer(ann["user_id"], bob["account_number"], 75)
+        else:
+            bank.transfer(bob["user_id"], ann["account_number"], 50)
+
+    run_concurrently(6, 60, attempt)
+
+    ann_balance = bank.account_details(ann["user_id"])["balance"]
+    bob_balance = bank.account_details(bob["user_id"])["balance"]
+    assert ann_balance >= 0 and bob_balance >= 0
+    assert ann_balance + bob_balance == 4_000
+
+
+def test_refused_debit_leaves_balance_and_ledger_untouched(bank):
+    ann = sign_up(bank, "ann")
+
+    with pytest.raises(InsufficientFundsError):
+        bank.withdrawal(ann["user_id"], 2_000.01)
+    with pytest.raises(UserNotFoundError):
+        bank.withdrawal(ann["user_id"] + 1, 1)
+
+    assert bank.account_details(ann["user_id"])["balance"] == 2_000
+    assert posting_count(bank, ann["user_id"]) == 0
@@ -0,0 +1,43 @@
+import sqlite3
+
+import pytest
+
+from hivebank.errors import InsufficientFundsError, ValidationError
+from hivebank.service import MAXIMUM_AMOUNT
+
+from conftest import sign_up
+
+
+def test_balances_do_not_drift_below_the_amount_shown(bank):
+    ann, bob = sign_up(bank, "ann"), sign_up(bank, "bob")
+    bank.deposit(ann["user_id"], 0.1)
+    bank.deposit(ann["user_id"], 0.2)
+    bank.transfer(ann["user_id"], bob["account_number"], 0.3)
+
+    assert bank.account_details(ann["user_id"])["balance"] == 2_000
+    assert bank.withdrawal(ann["user_id"], 2_000.00) == 0
+    with pytest.raises(InsufficientFundsError):
+        bank.withdrawal(ann["user_id"], 0.01)
+
+
+def test_balance_column_is_computed_from_kobo(bank):
+    ann = sign_up(bank, "ann")
+    bank.deposit(ann["user_id"], 0.07)
+
+    conn = bank.db.connection()
+    assert conn.execute("SELECT balance_minor, balance FROM users").fetchone() == (200_007, 2_000.07)
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("UPDATE users SET balance = 1")
+
+
+def test_amounts_above_the_maximum_are_refused(bank):
+    ann = sign_up(bank, "ann")
+
+    for amount in (1e20, MAXIMUM_AMOUNT + 0.01):
+        with pytest.raises(ValidationError) as refused:
+            bank.deposit(ann["user_id"], amount)
+        assert refused.value.field == "amount"
+    with pytest.raises(ValidationError):
+        sign_up(bank, "bob", 10 ** 20)
+
+    assert bank.deposit(ann["user_id"], MAXIMUM_AMOUNT) == 2_000 + MAXIMUM_AMOUNT
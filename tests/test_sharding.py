@@ -0,0 +1,75 @@
+from hivebank.service import TRANSFER_IN, TRANSFER_OUT, TYPE_CODES
+from hivebank.sharding import ShardedBankService
+
+from conftest import FAST_HASHER, balances, seed_accounts
+
+
+# Returns a sender and a recipient (user_id, account_number) that live on different shards
+def cross_shard_pair(bank):
+    accounts = seed_accounts(bank, 24)
+    sender = next(account for account in accounts if bank.shard_index_for_account(account) == 0)
+    recipient = next(account for account in accounts if bank.shard_index_for_account(account) == 1)
+    user_id = bank.shard_for_account(sender).db.connection().execute("SELECT user_id FROM users WHERE account_number = ?", (sender,)).fetchone()[0]
+    return user_id, sender, recipient
+
+
+def outbox_size(bank, index):
+    return bank.shards[index].db.connection().execute("SELECT COUNT(*) FROM transfer_outbox").fetchone()[0]
+
+
+# Type codes of the account's postings, oldest first
+def posting_types(bank, account_number):
+    return [row[0] for row in bank.shard_for_account(account_number).db.connection().execute(
+        "SELECT type_code FROM postings JOIN users USING (user_id) WHERE account_number = ? ORDER BY transaction_id", (account_number,)
+    )]
+
+
+def test_cross_shard_transfer_moves_money_once(sharded_bank):
+    user_id, sender, recipient = cross_shard_pair(sharded_bank)
+
+    result = sharded_bank.transfer(user_id, recipient, 250)
+
+    assert result["balance"] == 4_750
+    assert balances(sharded_bank)[sender] == 4_750
+    assert balances(sharded_bank)[recipient] == 5_250
+    assert posting_types(sharded_bank, sender) == [TYPE_CODES[TRANSFER_OUT]]
+    assert posting_types(sharded_bank, recipient) == [TYPE_CODES[TRANSFER_IN]]
+    assert outbox_size(sharded_bank, 0) == 0
+
+
+def test_deliver_pending_finishes_a_credit_interrupted_after_the_debit(tmp_path):
+    directory = str(tmp_path / "bank")
+    bank = ShardedBankService(directory, 2, hasher=FAST_HASHER)
+    user_id, sender, recipient = cross_shard_pair(bank)
+    # The process stops after the debit commits and before the credit is applied
+    bank._debit_cross_shard(user_id, recipient, 250)
+    bank.close()
+
+    bank = ShardedBankService(directory, 2, hasher=FAST_HASHER, recover=False)
+    try:
+        assert balances(bank)[sender] == 4_750
+        assert balances(bank)[recipient] == 5_000
+        assert outbox_size(bank, 0) == 1
+
+        assert bank.deliver_pending() == 1
+
+        assert balances(bank)[recipient] == 5_250
+        assert posting_types(bank, recipient) == [TYPE_CODES[TRANSFER_IN]]
+        assert outbox_size(bank, 0) == 0
+        assert bank.deliver_pending() == 0
+    finally:
+        bank.close()
+
+
+def test_replayed_inbox_message_is_credited_once(sharded_bank):
+    user_id, sender, recipient = cross_shard_pair(sharded_bank)
+    _, message = sharded_bank._debit_cross_shard(user_id, recipient, 250)
+
+    # Delivered, then replayed before the outbox was cleared, then replayed again by recovery
+    sharded_bank._credit(0, message)
+    sharded_bank._credit(0, message)
+    assert sharded_bank.deliver_pending() == 1
+
+    assert balances(sharded_bank)[recipient] == 5_250
+    assert posting_types(sharded_bank, recipient) == [TYPE_CODES[TRANSFER_IN]]
+    assert outbox_size(sharded_bank, 0) == 0
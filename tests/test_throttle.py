@@ -0,0 +1,113 @@
+import pytest
+
+from hivebank import BankService, ConnectionManager, LoginThrottle
+from hivebank.errors import AuthenticationError, ThrottledError
+
+from conftest import FAST_HASHER, sign_up
+
+
+# A clock that only moves when the test moves it
+class Clock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_lockouts_double_up_to_the_maximum_and_a_success_clears_them():
+    clock = Clock()
+    throttle = LoginThrottle(max_failures=3, base_lockout=60, max_lockout=200, clock=clock)
+
+    assert [throttle.failure("login:1") for _ in range(3)] == [0, 0, 60]
+    with pytest.raises(ThrottledError) as refused:
+        throttle.check("login:1")
+    assert refused.value.retry_after == 60
+
+    clock.now += 60
+    throttle.check("login:1")
+    assert [throttle.failure("login:1") for _ in range(3)] == [0, 0, 120]
+    clock.now += 120
+    assert [throttle.failure("login:1") for _ in range(3)] == [0, 0, 200]
+
+    clock.now += 200
+    throttle.success("login:1")
+    assert [throttle.failure("login:1") for _ in range(3)] == [0, 0, 60]
+
+
+def test_source_bucket_limits_guessing_across_accounts_and_refills():
+    clock = Clock()
+    throttle = LoginThrottle(max_failures=100, source_rate=0.5, source_burst=4, clock=clock)
+
+    for account in range(4):
+        throttle.check(f"login:{account}", "10.0.0.1")
+        throttle.failure(f"login:{account}", "10.0.0.1")
+    with pytest.raises(ThrottledError) as refused:
+        throttle.check("login:5", "10.0.0.1")
+    assert refused.value.retry_after == 2
+    # Other sources are not held back
+    throttle.check("login:5", "10.0.0.2")
+
+    clock.now += 2
+    throttle.check("login:5", "10.0.0.1")
+    assert throttle.rejected == 1
+
+
+def test_a_flood_of_new_keys_does_not_lift_a_lockout():
+    clock = Clock()
+    throttle = LoginThrottle(max_failures=1, base_lockout=60, max_entries=10, clock=clock)
+
+    throttle.failure("login:victim")
+    for n in range(1_000):
+        throttle.failure(f"login:stranger{n}", persist=False)
+        clock.now += 0.01
+
+    with pytest.raises(ThrottledError):
+        throttle.check("login:victim")
+
+
+def test_lockouts_survive_a_restart_but_unknown_logins_are_not_stored(tmp_path):
+    path = str(tmp_path / "users.db")
+    clock = Clock()
+
+    def open_bank():
+        db = ConnectionManager(path)
+        return BankService(path, db=db, hasher=FAST_HASHER, throttle=LoginThrottle(max_failures=2, base_lockout=60, db=db, clock=clock))
+
+    bank = open_bank()
+    sign_up(bank, "ann")
+    for _ in range(2):
+        with pytest.raises(AuthenticationError):
+            bank.log_in("ann", "wrong")
+        with pytest.raises(AuthenticationError):
+            bank.log_in("nobody", "wrong")
+    stored = [key for key, in bank.db.connection().execute("SELECT key FROM login_throttle")]
+    bank.close()
+
+    assert len(stored) == 1 and stored[0].startswith("login:")
+    bank = open_bank()
+    with pytest.raises(ThrottledError):
+        bank.log_in("ann", "Passw0rd!")
+    clock.now += 60
+    assert bank.log_in("ann", "Passw0rd!") == bank.db.connection().execute("SELECT user_id FROM users").fetchone()[0]
+    bank.close()
+
+
+def test_ended_lockouts_are_swept_back_under_the_bound():
+    clock = Clock()
+    throttle = LoginThrottle(max_failures=1, base_lockout=60, max_entries=10, clock=clock)
+
+    for n in range(25):
+        throttle.failure(f"login:{n}")
+    # All 25 are locked at once, so the bound gives way
+    for n in range(25):
+        with pytest.raises(ThrottledError):
+            throttle.check(f"login:{n}")
+
+    clock.now += 60
+    for n in range(25, 75):
+        throttle.failure(f"login:{n}", persist=False)
+    # The 50 new lockouts are all still on; the 25 that ended have left the locked map
+    assert len(throttle._locked) == 50
+    assert len(throttle._accounts) <= 10
+    throttle.check("login:0")
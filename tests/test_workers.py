@@ -0,0 +1,89 @@
+import random
+import shutil
+
+from hivebank import BankError
+from hivebank.bulk import parse_row
+from hivebank.limits import TransactionLimits
+from hivebank.sharding import ShardedBankService
+from hivebank.workers import PostingWorkerPool
+
+from conftest import FAST_HASHER, balances, seed_accounts
+
+
+# Random deposits, withdrawals and transfers; small opening balances make plenty of them bounce
+def make_rows(account_numbers, count, seed):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        posting_type = rng.choice(["deposit", "withdrawal", "transfer", "transfer"])
+        row = {"type": posting_type, "account_number": rng.choice(account_numbers), "amount": round(rng.uniform(1, 3_000), 2)}
+        if posting_type == "transfer":
+            row["recipient_account"] = rng.choice(account_numbers)
+        rows.append(row)
+    return rows
+
+
+# Posts every row on its own through ShardedBankService with the default limits, in file order;
+# returns {line: status}
+def post_serially(directory, shards, rows):
+    bank = ShardedBankService(directory, shards, limits=TransactionLimits())
+    statuses = {}
+    try:
+        for line, row in enumerate(rows, start=1):
+            try:
+                posting_type, account_number, amount, recipient_account = parse_row(bank, row)
+                user_id = bank.shard_for_account(account_number).db.connection().execute(
+                    "SELECT user_id FROM users WHERE account_number = ?", (account_number,)
+                ).fetchone()[0]
+                if posting_type == "deposit":
+                    bank.deposit(user_id, amount)
+                elif posting_type == "withdrawal":
+                    bank.withdrawal(user_id, amount)
+                else:
+                    bank.transfer(user_id, recipient_account, amount)
+                statuses[line] = "posted"
+            except BankError:
+                statuses[line] = "rejected"
+    finally:
+        bank.close()
+    return statuses
+
+
+# Each account's postings in order as (type_code, amount_minor, balance_after_minor), by account number
+def postings_by_account(directory, shards):
+    bank = ShardedBankService(directory, shards)
+    try:
+        result = {}
+        for shard in bank.shards:
+            for account_number, type_code, amount_minor, balance_after_minor in shard.db.connection().execute(
+                "SELECT account_number, type_code, amount_minor, balance_after_minor FROM postings JOIN users USING (user_id) ORDER BY transaction_id"
+            ):
+                result.setdefault(account_number, []).append((type_code, amount_minor, balance_after_minor))
+        return result, balances(bank)
+    finally:
+        bank.close()
+
+
+def test_worker_pool_posts_each_account_in_the_same_order_as_a_serial_run(tmp_path):
+    shards = 3
+    seeded = str(tmp_path / "seeded")
+    bank = ShardedBankService(seeded, shards, hasher=FAST_HASHER)
+    account_numbers = seed_accounts(bank, 30, opening_balance=2_000)
+    bank.close()
+    rows = make_rows(account_numbers, 2_000, seed=7)
+
+    serial = str(tmp_path / "serial")
+    shutil.copytree(seeded, serial)
+    serial_statuses = post_serially(serial, shards, rows)
+
+    pooled = str(tmp_path / "pooled")
+    shutil.copytree(seeded, pooled)
+    report = PostingWorkerPool(pooled, shards, max_batch=16, chunk_size=8).import_rows(enumerate(rows, start=1))
+
+    assert {result["line"]: result["status"] for result in report.results} == serial_statuses
+    assert "rejected" in serial_statuses.values()
+    assert any(result["reason"] and "limit" in result["reason"].lower() for result in report.results)
+    serial_postings, serial_balances = postings_by_account(serial, shards)
+    pooled_postings, pooled_balances = postings_by_account(pooled, shards)
+    assert pooled_postings == serial_postings
+    assert pooled_balances == serial_balances